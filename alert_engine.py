@@ -0,0 +1,298 @@
+"""
+Motor de alertas vectorizado
+Mantiene en memoria una ventana de gastos (frame de analytics) y evalúa las
+reglas de la tabla `reglas_alerta` con NumPy/pandas:
+  - outlier:     mediana/MAD por categoría, responsable o global
+  - inactividad: días desde el último gasto
+  - burn_rate:   proyección del gasto del mes contra el presupuesto
+Se evalúa de forma incremental con las transacciones nuevas (on_transaction
+las encola, process_incoming las evalúa en hilo) y en lote una vez al día
+(evaluate_all). Nuevas reglas = nuevas filas en la tabla.
+"""
+import calendar
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import database  # SQLite local
+import directus_manager
+
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLES = 5            # Historial mínimo por sujeto para evaluar outliers
+MAD_SCALE = 0.6745         # z robusto = 0.6745 * (x - mediana) / MAD
+MIN_DAYS_PROJECTION = 5    # Antes de este día del mes la proyección es poco fiable
+RELOAD_TTL = 3600          # Recarga la ventana desde SQLite (recoge lo sincronizado de Directus)
+BUDGETS_TTL = 600
+ALERTS_RETENTION_DAYS = 90
+
+AMBITOS = {"categoria": "categoria", "responsable": "responsable", "global": None}
+
+_lock = threading.RLock()
+_state = {"frame": None, "loaded_at": 0.0}
+_budgets = {"data": {}, "fetched_at": 0.0}
+_pending = deque(maxlen=100)
+_incoming = deque()  # (instante, fila) guardadas y aún sin evaluar
+
+
+# ==================== VENTANA ====================
+
+def _window_start(reglas: list, now: datetime) -> str:
+    """La ventana cubre la regla más larga y, como mínimo, el mes en curso."""
+    dias = max([int(r["ventana_dias"] or 0) for r in reglas] + [now.day])
+    return (now - timedelta(days=dias)).strftime("%Y-%m-%d")
+
+
+def _load_frame(reglas: list, force: bool = False) -> pd.DataFrame:
+    with _lock:
+        if not force and _state["frame"] is not None and time.time() - _state["loaded_at"] < RELOAD_TTL:
+            return _state["frame"]
+        rows = database.get_gastos_desde(_window_start(reglas, datetime.now()))
+        _state["frame"] = analytics.build_frame(
+            [r["fecha"] for r in rows],
+            [r["monto_usd"] or 0 for r in rows],
+            [r["categoria"] or "Otros" for r in rows],
+            [r["concepto"] or "" for r in rows],
+            [r["responsable"] or "" for r in rows],
+        )
+        _state["loaded_at"] = time.time()
+        return _state["frame"]
+
+
+def _append(rows: list):
+    """Añade las transacciones recién guardadas a la ventana en memoria (una sola copia del frame)."""
+    with _lock:
+        if _state["frame"] is None or not rows:
+            return
+        nuevo = analytics.build_frame(
+            [r.get("fecha") for r in rows], [r.get("monto_usd") or 0 for r in rows],
+            [r.get("categoria") or "Otros" for r in rows], [r.get("concepto") or "" for r in rows],
+            [r.get("responsable") or "" for r in rows]
+        )
+        frame = pd.concat([_state["frame"], nuevo], ignore_index=True)
+        for col in ("categoria", "responsable"):
+            frame[col] = frame[col].astype("category")
+        _state["frame"] = frame
+
+
+def _get_budgets(refresh: bool = False) -> dict:
+    """Presupuestos cacheados; solo evaluate_all/refresh (en hilo) consultan Directus."""
+    if refresh and time.time() - _budgets["fetched_at"] >= BUDGETS_TTL:
+        try:
+            _budgets["data"] = directus_manager.get_all_budgets() or {}
+        except Exception as e:
+            logger.warning(f"No se pudieron leer presupuestos para alertas: {e}")
+        _budgets["fetched_at"] = time.time()
+    return _budgets["data"]
+
+
+def prime_budgets(budgets: dict):
+    """Carga presupuestos ya leídos (ej. por dashboard_loader) para no repetir la consulta."""
+    if budgets:
+        _budgets["data"] = budgets
+        _budgets["fetched_at"] = time.time()
+
+
+def _subject_mask(frame: pd.DataFrame, col: str, value) -> np.ndarray:
+    if col is None:
+        return np.ones(len(frame), dtype=bool)
+    return (frame[col].astype(object) == value).to_numpy()
+
+
+# ==================== REGLAS ====================
+
+def _robust_stats(values: np.ndarray):
+    """(mediana, MAD) o None si no hay dispersión suficiente."""
+    if len(values) < MIN_SAMPLES:
+        return None
+    med = np.median(values)
+    mad = np.median(np.abs(values - med))
+    return (med, mad) if mad > 0 else None
+
+
+def _eval_outlier(frame, regla, now, tx=None) -> list:
+    col = AMBITOS.get(regla["ambito"])
+    desde = pd.Timestamp(now.date()) - pd.Timedelta(days=int(regla["ventana_dias"]))
+    win = frame[frame["fecha"] >= desde]
+    hits = []
+
+    if tx is not None:
+        # Incremental: la transacción nueva contra el historial de su sujeto
+        sujeto = tx.get(col) if col else "General"
+        stats = _robust_stats(win["monto"].to_numpy()[_subject_mask(win, col, sujeto)])
+        if stats:
+            med, mad = stats
+            monto = float(tx.get("monto_usd") or 0)
+            if MAD_SCALE * (monto - med) / mad > regla["umbral"]:
+                hits.append((f"{sujeto}:{tx.get('fecha')}:{monto:.2f}", {"sujeto": sujeto, "monto": monto, "mediana": med}))
+        return hits
+
+    # Lote: z robusto de todas las filas de la ventana, agrupado por sujeto
+    if win.empty:
+        return hits
+    keys = win[col] if col else pd.Series("General", index=win.index)
+    grouped = win["monto"].groupby(keys, observed=True)
+    med = grouped.transform("median")
+    mad = (win["monto"] - med).abs().groupby(keys, observed=True).transform("median")
+    n = grouped.transform("size")
+    score = np.where((mad > 0) & (n >= MIN_SAMPLES), MAD_SCALE * (win["monto"] - med) / mad.where(mad > 0, 1), 0)
+    recientes = (win["fecha"] >= pd.Timestamp(now.date()) - pd.Timedelta(days=1)).to_numpy()
+    for i in np.flatnonzero((score > regla["umbral"]) & recientes):
+        fila = win.iloc[i]
+        sujeto = str(keys.iloc[i])
+        monto = float(fila["monto"])
+        hits.append((f"{sujeto}:{fila['fecha']:%Y-%m-%d}:{monto:.2f}", {"sujeto": sujeto, "monto": monto, "mediana": float(med.iloc[i])}))
+    return hits
+
+
+def _eval_inactividad(frame, regla, now, tx=None) -> list:
+    if tx is not None or frame.empty:
+        return []  # Una transacción nueva es actividad
+    col = AMBITOS.get(regla["ambito"])
+    ultimos = frame.groupby(col, observed=True)["fecha"].max() if col else pd.Series({"General": frame["fecha"].max()})
+    dias = (pd.Timestamp(now.date()) - ultimos).dt.days
+    hoy = now.strftime("%Y-%m-%d")
+    return [(f"{sujeto}:{hoy}", {"sujeto": str(sujeto), "dias": int(d)})
+            for sujeto, d in dias[dias >= regla["umbral"]].items()]
+
+
+def _eval_burn_rate(frame, regla, now, tx=None) -> list:
+    budgets = _get_budgets()
+    if not budgets or now.day < MIN_DAYS_PROJECTION:
+        return []
+    mes = frame[frame["fecha"] >= pd.Timestamp(now.year, now.month, 1)]
+    dias_mes = calendar.monthrange(now.year, now.month)[1]
+    presupuestos = pd.Series(budgets, dtype=np.float64)
+
+    if AMBITOS.get(regla["ambito"]) == "categoria":
+        gastado = mes.groupby(mes["categoria"].astype(object))["monto"].sum().reindex(presupuestos.index, fill_value=0.0)
+        if tx is not None:
+            presupuestos = presupuestos[presupuestos.index == tx.get("categoria")]
+            gastado = gastado[presupuestos.index]
+    else:
+        gastado = pd.Series({"General": analytics.total(mes)})
+        presupuestos = pd.Series({"General": float(sum(budgets.values()))})
+
+    proyectado = gastado / now.day * dias_mes
+    pct = proyectado / presupuestos.where(presupuestos > 0) * 100
+    alertas = pct[pct >= regla["umbral"] * 100].dropna()
+    mes_str = now.strftime("%Y-%m")
+    # Un aviso por categoría y tramo de 25%: vuelve a avisar si el ritmo empeora
+    return [(f"{sujeto}:{mes_str}:{int(p // 25)}", {
+                "sujeto": sujeto, "pct": float(p), "gastado": float(gastado[sujeto]),
+                "proyectado": float(proyectado[sujeto]), "presupuesto": float(presupuestos[sujeto])})
+            for sujeto, p in alertas.items()]
+
+
+EVALUADORES = {
+    "outlier": _eval_outlier,
+    "inactividad": _eval_inactividad,
+    "burn_rate": _eval_burn_rate,
+}
+
+
+def _run(reglas: list, frame: pd.DataFrame, now: datetime, tx: dict = None) -> list:
+    """Evalúa las reglas y retorna los mensajes nuevos (deduplicados en SQLite)."""
+    mensajes = []
+    for regla in reglas:
+        evaluar = EVALUADORES.get(regla["tipo"])
+        if not evaluar:
+            logger.warning(f"Regla de alerta {regla['id']} con tipo desconocido: {regla['tipo']}")
+            continue
+        try:
+            for clave, ctx in evaluar(frame, regla, now, tx):
+                if not database.marcar_alerta_enviada(f"{regla['id']}:{clave}"):
+                    continue
+                ctx.setdefault("factor", ctx["monto"] / ctx["mediana"] if ctx.get("mediana") else 0)
+                mensajes.append(regla["mensaje"].format_map(_Defaults(ctx)))
+        except Exception as e:
+            logger.error(f"Error evaluando regla de alerta '{regla['nombre']}': {e}")
+    return mensajes
+
+
+class _Defaults(dict):
+    """Los campos que una regla no calcula se formatean como 0."""
+    def __missing__(self, key):
+        return 0
+
+
+# ==================== API ====================
+
+def on_transaction(row: dict):
+    """
+    Encola un gasto recién guardado (llamado desde outbox.enqueue, en el event
+    loop): solo un append, la evaluación la hace process_incoming() en hilo.
+    """
+    _incoming.append((time.time(), row))
+
+
+def process_incoming() -> list:
+    """
+    Evaluación incremental de los gastos encolados. Las filas ya están en SQLite:
+    las guardadas antes de la última recarga de la ventana ya están incluidas y
+    el resto se añade de una vez antes de evaluar (burn_rate cuenta el gasto que
+    lo dispara). Las alertas quedan pendientes hasta pop_pending(). Bloqueante: usar en hilo.
+    """
+    incoming = []
+    while _incoming:
+        incoming.append(_incoming.popleft())
+    if not incoming:
+        return []
+    try:
+        reglas = database.get_reglas_alerta()
+        if not reglas:
+            return []
+        now = datetime.now()
+        mensajes = []
+        with _lock:
+            frame = _load_frame(reglas)
+            _append([row for queued_at, row in incoming if queued_at >= _state["loaded_at"]])
+            frame = _state["frame"]
+            for _, row in incoming:
+                mensajes.extend(_run(reglas, frame, now, tx=row))
+        _pending.extend(mensajes)
+        return mensajes
+    except Exception as e:
+        logger.error(f"Error en evaluación incremental de alertas: {e}")
+        return []
+
+
+def evaluate_all() -> list:
+    """Evaluación diaria completa (recarga ventana y presupuestos). Bloqueante: usar en hilo."""
+    reglas = database.get_reglas_alerta()
+    if not reglas:
+        return []
+    _get_budgets(refresh=True)
+    frame = _load_frame(reglas, force=True)
+    mensajes = _run(reglas, frame, datetime.now())
+    database.purge_alertas_enviadas(ALERTS_RETENTION_DAYS)
+    return mensajes
+
+
+def refresh():
+    """Refresca presupuestos y ventana si caducaron. Bloqueante: usar en hilo."""
+    reglas = database.get_reglas_alerta()
+    if reglas:
+        _get_budgets(refresh=True)
+        _load_frame(reglas)
+
+
+def invalidate(budgets: bool = False):
+    """Marca la ventana (y opcionalmente los presupuestos) como caducada: se recarga en el próximo uso."""
+    with _lock:
+        _state["loaded_at"] = 0.0
+        if budgets:
+            _budgets["fetched_at"] = 0.0
+
+
+def pop_pending() -> list:
+    mensajes = []
+    while _pending:
+        mensajes.append(_pending.popleft())
+    return mensajes
@@ -0,0 +1,104 @@
+"""
+Motor analítico columnar para resúmenes y gráficos
+Los gastos del período se convierten UNA vez en un DataFrame tipado
+(fecha datetime64, monto float64, categoría categorical) y todas las
+agregaciones se calculan vectorizadas sobre él.
+"""
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["fecha", "monto", "categoria", "concepto", "responsable"]
+
+WEEKDAYS_ES = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+
+
+def _to_amount(values) -> np.ndarray:
+    """Montos a float64; acepta números o textos con coma decimal."""
+    s = pd.Series(values, dtype=object)
+    numeric = pd.to_numeric(s, errors="coerce")
+    text_mask = numeric.isna() & s.notna()
+    if text_mask.any():
+        numeric[text_mask] = pd.to_numeric(s[text_mask].astype(str).str.replace(",", ".", regex=False), errors="coerce")
+    return numeric.to_numpy(dtype=np.float64)
+
+
+def build_frame(fechas, montos, categorias=None, conceptos=None, responsables=None) -> pd.DataFrame:
+    """
+    Construye el frame a partir de columnas (listas paralelas).
+    Filas con fecha o monto inválidos se descartan.
+    """
+    n = len(montos)
+    df = pd.DataFrame({
+        "fecha": pd.to_datetime(pd.Series(fechas, dtype=object).astype(str).str[:10], format="%Y-%m-%d", errors="coerce"),
+        "monto": _to_amount(montos),
+        "categoria": pd.Categorical(categorias if categorias is not None else ["Otros"] * n),
+        "concepto": pd.Series(conceptos if conceptos is not None else [""] * n, dtype=object).fillna("").astype(str),
+        "responsable": pd.Categorical(pd.Series(responsables if responsables is not None else [""] * n, dtype=object).fillna("")),
+    })
+    return df.dropna(subset=["fecha", "monto"]).reset_index(drop=True)
+
+
+def frame_from_records(records: list, fecha="Fecha", monto="Monto USD", categoria="Categoria", concepto="Concepto") -> pd.DataFrame:
+    """Compatibilidad: lista de dicts (formato Sheets/legacy) -> frame."""
+    if isinstance(records, pd.DataFrame):
+        return records
+    records = records or []
+    return build_frame(
+        [r.get(fecha) for r in records],
+        [r.get(monto) for r in records],
+        [r.get(categoria) or "Otros" for r in records],
+        [r.get(concepto) or "" for r in records],
+    )
+
+
+def empty_frame() -> pd.DataFrame:
+    return build_frame([], [], [], [])
+
+
+# ==================== AGREGACIONES ====================
+
+def total(df: pd.DataFrame) -> float:
+    return float(df["monto"].sum()) if len(df) else 0.0
+
+
+def by_category(df: pd.DataFrame) -> dict:
+    """{categoria: total} ordenado de mayor a menor."""
+    if df.empty: return {}
+    s = df.groupby("categoria", observed=True)["monto"].sum().sort_values(ascending=False)
+    return {str(k): float(v) for k, v in s.items()}
+
+
+def by_day(df: pd.DataFrame) -> pd.Series:
+    """Serie indexada por fecha (datetime64) con el total diario, ordenada."""
+    if df.empty: return pd.Series(dtype=np.float64)
+    return df.groupby("fecha")["monto"].sum().sort_index()
+
+
+def daily_trend_records(df: pd.DataFrame) -> list:
+    """[{'Fecha': 'YYYY-MM-DD', 'Monto USD': float}] para consumidores existentes (alertas, prompts)."""
+    daily = by_day(df)
+    return [{"Fecha": d.strftime("%Y-%m-%d"), "Monto USD": float(v)} for d, v in daily.items()]
+
+
+def by_weekday(df: pd.DataFrame) -> np.ndarray:
+    """Totales por día de la semana (índice 0 = lunes)."""
+    if df.empty: return np.zeros(7)
+    return np.bincount(df["fecha"].dt.weekday.to_numpy(), weights=df["monto"].to_numpy(), minlength=7)
+
+
+def top_n(df: pd.DataFrame, n: int = 5) -> pd.DataFrame:
+    return df.nlargest(n, "monto") if len(df) else df
+
+
+def month_heatmap(df: pd.DataFrame, year: int, month: int) -> np.ndarray:
+    """Totales diarios del mes como vector de longitud días_del_mes (0 si no hubo gasto)."""
+    days = pd.Period(year=year, month=month, freq="M").days_in_month
+    if df.empty: return np.zeros(days)
+    fechas = df["fecha"]
+    mask = (fechas.dt.year == year) & (fechas.dt.month == month)
+    return np.bincount(fechas[mask].dt.day.to_numpy() - 1, weights=df.loc[mask, "monto"].to_numpy(), minlength=days)[:days]
+
+
+def without_frame(summary: dict) -> dict:
+    """Copia del resumen sin el DataFrame (para JSON, caché o prompts)."""
+    return {k: v for k, v in (summary or {}).items() if k != "frame"}
@@ -1,4 +1,5 @@
 import https from 'node:https';
+import { createHash } from 'node:crypto';
 
 // Fetch que ignora errores de certificado SSL (BCV tiene cert mal configurado)
 function fetchInsecure(url) {
@@ -18,24 +19,60 @@ function fetchInsecure(url) {
 	});
 }
 
+// Cache HTTP: el bot y la webapp pueden hacer GET condicionales (If-None-Match -> 304)
+const LATEST_TTL_MS = 5 * 60 * 1000;
+const SCRAPE_RETRY_MS = 10 * 60 * 1000;
+const CACHE_CONTROL = 'private, max-age=300, stale-while-revalidate=3600';  // Endpoint autenticado: sin caches compartidas
+
+function todayStr() {
+	return new Date().toISOString().split('T')[0];
+}
+
+function makeEtag(payload) {
+	return `W/"${createHash('sha1').update(JSON.stringify(payload)).digest('base64url')}"`;
+}
+
+function sendCached(req, res, payload, etag = makeEtag(payload)) {
+	res.set('ETag', etag);
+	res.set('Cache-Control', CACHE_CONTROL);
+	if (req.headers['if-none-match'] === etag) {
+		return res.status(304).end();
+	}
+	return res.json(payload);
+}
+
 export default {
 	id: 'bcv-rates',
 	handler: (router, { database }) => {
 
-		// Asegurar que la tabla exchange_rates existe
-		async function ensureTable() {
-			const exists = await database.schema.hasTable('exchange_rates');
-			if (!exists) {
-				await database.schema.createTable('exchange_rates', (table) => {
-					table.increments('id').primary();
-					table.string('currency', 10).notNullable();
-					table.decimal('rate', 20, 8).notNullable();
-					table.date('rate_date').notNullable();
-					table.timestamp('created_at').defaultTo(database.fn.now());
-					table.unique(['currency', 'rate_date']);
+		// Estado a nivel de proceso (compartido entre requests)
+		let tableReady = null;       // Promise memo de ensureTable()
+		let scrapeInFlight = null;   // Promise del scrape en curso (single-flight)
+		let lastScrapeFailure = 0;   // Evita martillar al BCV si está caído
+		let latest = null;           // { payload, etag, date, expiresAt }
+
+		// Asegurar que la tabla exchange_rates existe (una sola introspección por proceso)
+		function ensureTable() {
+			if (!tableReady) {
+				tableReady = (async () => {
+					const exists = await database.schema.hasTable('exchange_rates');
+					if (!exists) {
+						await database.schema.createTable('exchange_rates', (table) => {
+							table.increments('id').primary();
+							table.string('currency', 10).notNullable();
+							table.decimal('rate', 20, 8).notNullable();
+							table.date('rate_date').notNullable();
+							table.timestamp('created_at').defaultTo(database.fn.now());
+							table.unique(['currency', 'rate_date']);
+						});
+						console.log('Tabla exchange_rates creada');
+					}
+				})().catch((error) => {
+					tableReady = null; // Reintentar en el próximo request
+					throw error;
 				});
-				console.log('Tabla exchange_rates creada');
 			}
+			return tableReady;
 		}
 
 		// Scrape tasas del BCV
@@ -67,36 +104,90 @@ export default {
 			};
 		}
 
+		// Scrape + upsert con lock single-flight: requests concurrentes comparten el mismo scrape
+		function refreshRates() {
+			if (!scrapeInFlight) {
+				scrapeInFlight = (async () => {
+					await ensureTable();
+
+					const rates = await scrapeRates();
+
+					if (!rates.usd || !rates.eur) {
+						throw new Error('No se pudieron extraer las tasas del HTML del BCV');
+					}
+
+					const today = todayStr();
+
+					for (const [currency, rate] of [['USD', rates.usd], ['EUR', rates.eur]]) {
+						await database('exchange_rates')
+							.insert({ currency, rate, rate_date: today })
+							.onConflict(['currency', 'rate_date'])
+							.merge({ rate, created_at: database.fn.now() });
+					}
+
+					latest = null; // Invalidar cache en memoria
+					return { rate_date: today, usd: rates.usd, eur: rates.eur };
+				})().catch((error) => {
+					lastScrapeFailure = Date.now();
+					throw error;
+				}).finally(() => {
+					scrapeInFlight = null;
+				});
+			}
+			return scrapeInFlight;
+		}
+
+		async function latestEntries() {
+			const today = todayStr();
+
+			// Buscar tasas de hoy en DB
+			let entries = await database('exchange_rates')
+				.whereIn('currency', ['USD', 'EUR'])
+				.where('rate_date', today);
+
+			// Si no hay de hoy, intentar un scrape (compartido) antes de caer a las más recientes
+			if (entries.length < 2 && Date.now() - lastScrapeFailure > SCRAPE_RETRY_MS) {
+				try {
+					await refreshRates();
+					entries = await database('exchange_rates')
+						.whereIn('currency', ['USD', 'EUR'])
+						.where('rate_date', today);
+				} catch (error) {
+					console.warn('Scrape BCV falló, usando últimas tasas:', error.message);
+				}
+			}
+
+			if (entries.length < 2) {
+				console.log('No rates for today, fetching latest available...');
+				const latestUsd = await database('exchange_rates')
+					.where('currency', 'USD')
+					.orderBy('rate_date', 'desc')
+					.first();
+
+				const latestEur = await database('exchange_rates')
+					.where('currency', 'EUR')
+					.orderBy('rate_date', 'desc')
+					.first();
+
+				entries = [];
+				if (latestUsd) entries.push(latestUsd);
+				if (latestEur) entries.push(latestEur);
+			}
+
+			return entries;
+		}
+
 		// GET /bcv-rates
 		router.get('/', async (req, res) => {
 			try {
-				await ensureTable();
-
-				const today = new Date().toISOString().split('T')[0];
-
-				// Buscar tasas de hoy en DB
-				let entries = await database('exchange_rates')
-					.whereIn('currency', ['USD', 'EUR'])
-					.where('rate_date', today);
-
-				// Si no hay de hoy, buscar las más recientes
-				if (entries.length < 2) {
-					console.log('No rates for today, fetching latest available...');
-					const latestUsd = await database('exchange_rates')
-						.where('currency', 'USD')
-						.orderBy('rate_date', 'desc')
-						.first();
-
-					const latestEur = await database('exchange_rates')
-						.where('currency', 'EUR')
-						.orderBy('rate_date', 'desc')
-						.first();
-
-					entries = [];
-					if (latestUsd) entries.push(latestUsd);
-					if (latestEur) entries.push(latestEur);
+				const today = todayStr();
+				if (latest && latest.date === today && latest.expiresAt > Date.now()) {
+					return sendCached(req, res, latest.payload, latest.etag);
 				}
 
+				await ensureTable();
+				const entries = await latestEntries();
+
 				if (entries.length === 0) {
 					// No data at all
 					return res.status(404).json({
@@ -109,7 +200,7 @@ export default {
 				const usd = entries.find((r) => r.currency === 'USD');
 				const eur = entries.find((r) => r.currency === 'EUR');
 
-				res.json({
+				const payload = {
 					provider: 'bcv',
 					source: 'database',
 					rate_date: usd ? usd.rate_date : (eur ? eur.rate_date : null),
@@ -117,7 +208,10 @@ export default {
 					usd: usd ? parseFloat(usd.rate) : null,
 					eur: eur ? parseFloat(eur.rate) : null,
 					last_updated: usd ? usd.created_at : (eur ? eur.created_at : null)
-				});
+				};
+
+				latest = { payload, etag: makeEtag(payload), date: today, expiresAt: Date.now() + LATEST_TTL_MS };
+				sendCached(req, res, latest.payload, latest.etag);
 
 			} catch (error) {
 				console.error('Error en bcv-rates:', error);
@@ -151,7 +245,7 @@ export default {
 					grouped[row.rate_date][row.currency.toLowerCase()] = parseFloat(row.rate);
 				}
 
-				res.json({
+				sendCached(req, res, {
 					provider: 'bcv',
 					days,
 					rates: grouped,
@@ -168,27 +262,12 @@ export default {
 		// POST /bcv-rates/refresh - Forzar re-scrape
 		router.post('/refresh', async (req, res) => {
 			try {
-				await ensureTable();
-
-				const rates = await scrapeRates();
-
-				if (!rates.usd || !rates.eur) {
-					throw new Error('No se pudieron extraer las tasas del HTML del BCV');
-				}
-
-				const today = new Date().toISOString().split('T')[0];
-
-				for (const [currency, rate] of [['USD', rates.usd], ['EUR', rates.eur]]) {
-					await database('exchange_rates')
-						.insert({ currency, rate, rate_date: today })
-						.onConflict(['currency', 'rate_date'])
-						.merge({ rate, created_at: database.fn.now() });
-				}
+				const rates = await refreshRates();
 
 				res.json({
 					provider: 'bcv',
 					source: 'scrape',
-					rate_date: today,
+					rate_date: rates.rate_date,
 					usd: rates.usd,
 					eur: rates.eur,
 					refreshed: true,
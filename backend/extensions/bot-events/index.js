@@ -0,0 +1,48 @@
+// Envía al bot (POST /api/directus/events) cada create/update/delete de las
+// colecciones que cachea, para que actualice réplica y cachés sin sondear.
+const COLLECTIONS = new Set(['transactions', 'categories', 'savings', 'debts']);
+const ACTIONS = ['create', 'update', 'delete'];
+const RETRIES = 3;
+const TIMEOUT_MS = 10000;
+
+export default ({ action }, { env, logger }) => {
+	const url = env.BOT_EVENTS_URL;
+	const secret = env.BOT_EVENTS_SECRET;
+	if (!url || !secret) {
+		logger.warn('bot-events: BOT_EVENTS_URL/BOT_EVENTS_SECRET sin configurar, eventos desactivados');
+		return;
+	}
+
+	// Fuera del request de Directus: reintentos con backoff ante errores de red o 5xx
+	async function send(event, attempt = 1) {
+		try {
+			const res = await fetch(url, {
+				method: 'POST',
+				headers: { 'Content-Type': 'application/json', 'X-Directus-Events-Secret': secret },
+				body: JSON.stringify(event),
+				signal: AbortSignal.timeout(TIMEOUT_MS),
+			});
+			if (res.status >= 500) throw new Error(`HTTP ${res.status}`);
+			if (!res.ok) logger.warn(`bot-events: ${event.event} rechazado (HTTP ${res.status})`);
+		} catch (err) {
+			if (attempt >= RETRIES) {
+				logger.warn(`bot-events: ${event.event} no entregado: ${err.message}`);
+				return;
+			}
+			setTimeout(() => send(event, attempt + 1), 1000 * 2 ** attempt);
+		}
+	}
+
+	for (const name of ACTIONS) {
+		action(`items.${name}`, (meta) => {
+			if (!COLLECTIONS.has(meta.collection)) return;
+			const keys = meta.keys ?? (meta.key !== undefined ? [meta.key] : []);
+			send({
+				event: `${meta.collection}.items.${name}`,
+				collection: meta.collection,
+				keys,
+				payload: name === 'delete' ? {} : meta.payload,
+			});
+		});
+	}
+};
@@ -0,0 +1,124 @@
+"""
+Banco de pruebas del parser local de gastos (expense_parser)
+Mide sobre un corpus cuántos mensajes se resuelven sin Gemini (gasto
+reconocido o charla descartada), la precisión sobre el corpus etiquetado,
+la latencia del parser y el tiempo de Gemini ahorrado.
+
+Uso:
+    python bench_parser.py
+    python bench_parser.py --file mensajes.txt          # un mensaje por línea (sin etiquetas)
+    python bench_parser.py --gemini-ms 1800             # latencia media asumida de analyze_text
+    python bench_parser.py --measure-gemini 5           # mide N llamadas reales a Gemini
+"""
+import argparse
+import statistics
+import time
+
+import expense_parser
+
+# (mensaje, estado esperado, (monto, moneda, categoria_sugerida) si es MATCH)
+CORPUS = [
+    ("gasté 50$ en comida", "match", (50, "USD", "comida")),
+    ("20$ taxi", "match", (20, "USD", "transporte")),
+    ("1.500 Bs mercado #viaje", "match", (1500, "Bs", "supermercado")),
+    ("Bs. 2.350,50 farmacia ayer", "match", (2350.5, "Bs", "salud")),
+    ("pagué 15,5 usd de netflix", "match", (15.5, "USD", "tech")),
+    ("cena 40$", "match", (40, "USD", "comida")),
+    ("compré 3 arepas por 6$", "match", (6, "USD", "comida")),
+    ("5k bs gasolina", "match", (5000, "Bs", "transporte")),
+    ("Gasté 1,250.75 usd en el súper", "match", (1250.75, "USD", "supermercado")),
+    ("uber 4.5$", "match", (4.5, "USD", "transporte")),
+    ("diezmo 30 dólares", "match", (30, "USD", "diezmos")),
+    ("pagamos 120 bs del condominio", "match", (120, "Bs", "hogar")),
+    ("pague 100 mil bs de condominio", "match", (100000, "Bs", "hogar")),
+    ("2 millones de bs alquiler", "match", (2000000, "Bs", "hogar")),
+    ("matrícula del colegio 85$", "match", (85, "USD", "educacion")),
+    ("3500 bolívares pasaje", "match", (3500, "Bs", "transporte")),
+    ("regalo cumpleaños 25$ #familia", "match", (25, "USD", "regalos")),
+    ("hola familia, ¿cómo están?", "ignore", None),
+    ("jaja nos vemos a las 5", "ignore", None),
+    ("llego en 10 minutos", "ignore", None),
+    ("buenos días 🌞", "ignore", None),
+    ("mañana es la reunión 15/03", "ignore", None),
+    ("ya voy saliendo", "ignore", None),
+    ("el partido quedó 2 a 1", "ambiguous", None),
+    ("me pagaron 300", "ambiguous", None),
+    ("10 euros pizza", "ambiguous", None),
+    ("almuerzo 12$ y taxi 5$", "ambiguous", None),
+    ("tengo 2 hijos", "ambiguous", None),
+    ("pagué 1.000 de luz", "ambiguous", None),
+    ("gasté 50 en comida", "ambiguous", None),
+    ("tengo 50$ en el banco", "ambiguous", None),
+    ("te debo 20$", "ambiguous", None),
+]
+
+
+def load_file(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [(line.strip(), None, None) for line in f if line.strip()]
+
+
+def measure_gemini(messages: list, n: int) -> float:
+    """Latencia media real de analyze_text (ms) sobre los primeros N mensajes."""
+    from gemini_analyzer import analyze_text
+    samples = []
+    for text in messages[:n]:
+        t0 = time.perf_counter()
+        analyze_text(text)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.mean(samples) if samples else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parser local de gastos")
+    parser.add_argument("--file", help="Corpus adicional: un mensaje por línea")
+    parser.add_argument("--gemini-ms", type=float, default=1500.0, help="Latencia asumida de Gemini por mensaje")
+    parser.add_argument("--measure-gemini", type=int, default=0, help="Medir N llamadas reales a Gemini")
+    parser.add_argument("--repeat", type=int, default=200, help="Repeticiones para medir latencia")
+    args = parser.parse_args()
+
+    corpus = list(CORPUS) + (load_file(args.file) if args.file else [])
+    counts = {expense_parser.MATCH: 0, expense_parser.IGNORE: 0, expense_parser.AMBIGUOUS: 0}
+    labeled = correct = 0
+    errors = []
+    latencies = []
+
+    for text, expected, fields in corpus:
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            result = expense_parser.parse(text)
+            latencies.append(time.perf_counter() - t0)
+        counts[result["status"]] += 1
+
+        if expected is None:
+            continue
+        labeled += 1
+        ok = result["status"] == expected
+        if ok and fields:
+            data = result["data"]
+            ok = (abs(data["monto"] - fields[0]) < 0.01 and data["moneda"] == fields[1]
+                  and data["categoria_sugerida"] == fields[2])
+        correct += ok
+        if not ok:
+            errors.append((text, expected, result["status"], result["data"]))
+
+    gemini_ms = measure_gemini([t for t, _, _ in corpus], args.measure_gemini) if args.measure_gemini else args.gemini_ms
+    total = len(corpus)
+    local = counts[expense_parser.MATCH] + counts[expense_parser.IGNORE]
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6
+
+    print(f"\n📊 Parser local sobre {total} mensajes")
+    print(f"   Reconocidos: {counts[expense_parser.MATCH]}  Descartados: {counts[expense_parser.IGNORE]}  A Gemini: {counts[expense_parser.AMBIGUOUS]}")
+    print(f"   Resueltos sin Gemini: {local / total * 100:.1f}%")
+    if labeled:
+        print(f"   Precisión (corpus etiquetado): {correct}/{labeled} = {correct / labeled * 100:.1f}%")
+    print(f"   Latencia parser µs: p50={p(0.50):.1f} p99={p(0.99):.1f}")
+    print(f"   Gemini ({gemini_ms:.0f} ms/mensaje): ahorro {local * gemini_ms / 1000:.1f}s en el corpus, "
+          f"{local / total * gemini_ms:.0f} ms por mensaje en promedio")
+    for text, expected, got, data in errors:
+        print(f"   ✗ {text!r}: esperado {expected}, obtenido {got} {data or ''}")
+
+
+if __name__ == "__main__":
+    main()
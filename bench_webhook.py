@@ -0,0 +1,164 @@
+"""
+Banco de pruebas del modo webhook
+Reproduce updates grabados (JSONL, un Update de Telegram por línea) contra el
+endpoint local y mide throughput/latencia. Con --inprocess mide solo el
+ChatOrderedUpdateProcessor (secuencial vs concurrente) con handlers simulados.
+
+Uso:
+    python bench_webhook.py --file updates.jsonl --url http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET
+    python bench_webhook.py --synthetic 500 --chats 20 --url ...
+    python bench_webhook.py --inprocess --synthetic 200 --chats 10 --delay 0.05
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def synthetic_updates(n: int, chats: int) -> list:
+    """Updates de texto '/g <monto> prueba' repartidos entre `chats` chats."""
+    now = int(time.time())
+    updates = []
+    for i in range(n):
+        chat_id = -1000 - (i % chats)
+        updates.append({
+            "update_id": 900000 + i,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": chat_id, "type": "group", "title": f"Bench {chat_id}"},
+                "from": {"id": 1 + (i % chats), "is_bot": False, "first_name": "Bench"},
+                "text": f"/g {1 + i % 50} prueba bench",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 2}]
+            }
+        })
+    return updates
+
+
+def load_updates(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report(title: str, latencies: list, elapsed: float):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"\n📊 {title}")
+    print(f"   Updates: {len(latencies)} en {elapsed:.2f}s -> {len(latencies) / elapsed:.1f} updates/s")
+    print(f"   Latencia ms: p50={p(0.50):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f} media={statistics.mean(latencies) * 1000:.1f}")
+
+
+def bench_http(updates: list, url: str, secret: str, concurrency: int):
+    """POST de cada update al webhook, como lo haría Telegram."""
+    session = requests.Session()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    def send(update):
+        t0 = time.perf_counter()
+        r = session.post(url, data=json.dumps(update), headers=headers, timeout=30)
+        return time.perf_counter() - t0, r.status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, updates))
+    elapsed = time.perf_counter() - t0
+
+    errors = [code for _, code in results if code != 200]
+    report(f"Webhook HTTP ({concurrency} conexiones)", [lat for lat, _ in results], elapsed)
+    if errors:
+        print(f"   ⚠️ {len(errors)} respuestas no-200 (ej: {errors[0]})")
+
+
+async def check_isolation(processor, delay: float, backlog: int = None) -> tuple:
+    """
+    Un chat con más updates lentos que cupos no debe retrasar a otro chat:
+    el update instantáneo del chat B debe terminar antes que el 2º del chat A.
+    """
+    from telegram import Update
+
+    backlog = backlog or processor.max_concurrent_updates + 2
+    slow = [Update.de_json(u, None) for u in synthetic_updates(backlog, 1)]
+    fast = Update.de_json(synthetic_updates(2, 2)[1], None)
+
+    await processor.initialize()
+    tasks = [asyncio.create_task(processor.process_update(u, asyncio.sleep(delay))) for u in slow]
+    await asyncio.sleep(0)
+    t0 = time.perf_counter()
+    await processor.process_update(fast, asyncio.sleep(0))
+    waited = time.perf_counter() - t0
+    await asyncio.gather(*tasks)
+    await processor.shutdown()
+    return waited < delay, waited
+
+
+def bench_inprocess(updates: list, delay: float, concurrency: int):
+    """Compara procesamiento secuencial vs ChatOrderedUpdateProcessor con handlers de `delay` s."""
+    from telegram import Update
+    from update_processor import ChatOrderedUpdateProcessor
+
+    parsed = [Update.de_json(u, None) for u in updates]
+
+    async def handler(update, order: list, started: dict, latencies: list):
+        await asyncio.sleep(delay)
+        order.append(update.update_id)
+        latencies.append(time.perf_counter() - started[update.update_id])
+
+    async def run(processor):
+        order, started, latencies = [], {}, []
+        await processor.initialize()
+        t0 = time.perf_counter()
+        tasks = []
+        for u in parsed:
+            started[u.update_id] = time.perf_counter()
+            tasks.append(asyncio.create_task(processor.process_update(u, handler(u, order, started, latencies))))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - t0
+        await processor.shutdown()
+        return latencies, elapsed, order
+
+    async def main():
+        seq_lat, seq_elapsed, _ = await run(ChatOrderedUpdateProcessor(1))
+        report("Secuencial (max_concurrent_updates=1)", seq_lat, seq_elapsed)
+
+        con_lat, con_elapsed, order = await run(ChatOrderedUpdateProcessor(concurrency))
+        report(f"Concurrente por chat (max_concurrent_updates={concurrency})", con_lat, con_elapsed)
+
+        # Verificar que cada chat conservó su orden
+        by_chat = {}
+        chat_of = {u.update_id: u.effective_chat.id for u in parsed}
+        for update_id in order:
+            by_chat.setdefault(chat_of[update_id], []).append(update_id)
+        ordered = all(ids == sorted(ids) for ids in by_chat.values())
+        print(f"\n{'✅' if ordered else '❌'} Orden por chat {'preservado' if ordered else 'VIOLADO'}")
+
+        isolated, waited = await check_isolation(ChatOrderedUpdateProcessor(concurrency), delay)
+        print(f"{'✅' if isolated else '❌'} Otro chat atendido en {waited * 1000:.1f} ms con un chat ocupado")
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del modo webhook")
+    parser.add_argument("--file", help="JSONL con updates grabados")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generar N updates sintéticos")
+    parser.add_argument("--chats", type=int, default=10, help="Chats distintos para los sintéticos")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--inprocess", action="store_true", help="Medir solo el procesador de updates")
+    parser.add_argument("--delay", type=float, default=0.05, help="Duración simulada de cada handler (--inprocess)")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else synthetic_updates(args.synthetic or 200, args.chats)
+    print(f"🚀 {len(updates)} updates cargados")
+
+    if args.inprocess:
+        bench_inprocess(updates, args.delay, args.concurrency)
+    else:
+        bench_http(updates, args.url, args.secret, args.concurrency)
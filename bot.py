@@ -3,6 +3,8 @@ Bot de Telegram Financiero 360°
 Multimoneda, Gráficos, Drive y Categorías Dinámicas
 """
 import logging
+import asyncio
+import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, InputMediaPhoto
 from datetime import datetime
 from telegram.ext import (
@@ -23,7 +25,10 @@ import pandas as pd
 LOGGING_EXPENSE = 1
 # import sheets_manager # LEGACY
 import directus_manager as sheets_manager # NEW ADAPTER
-from gemini_analyzer import analyze_receipt, analyze_text, analyze_voice, format_receipt_message, get_financial_advice
+from gemini_analyzer import (
+    analyze_receipt, analyze_voice, format_receipt_message, get_parse_metrics,
+    build_advice_prompt, build_question_prompt, build_audit_prompt, ADVICE_FALLBACK
+)
 
 # Configurar logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -32,13 +37,36 @@ logger = logging.getLogger(__name__)
 # Silenciar advertencia de cache de Google API (innecesaria con oauth2client moderno)
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
 
-from config import TELEGRAM_BOT_TOKEN
+from config import (
+    TELEGRAM_BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, MAX_CONCURRENT_UPDATES,
+    DIRECTUS_EVENTS_SECRET
+)
 
 # Almacén temporal
 pending_data = {}
 
 import currency_service
+import rate_index
 import database  # SQLite local
+import directus_sync
+import directus_events
+import outbox
+import alert_engine
+import budget_ledger
+import month_close
+import expense_parser
+import category_classifier
+import gemini_batcher
+import model_router
+import stream_reply
+import query_engine
+import dashboard_loader
+import webapp_api
+from update_processor import ChatOrderedUpdateProcessor
+import work_queue
+import report_export
+from work_queue import queued
 
 # Función helper para registrar chat
 async def register_chat_if_new(update: Update):
@@ -75,7 +103,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def set_rate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.message.reply_text("🔄 Consultando DolarAPI...")
-    rates = currency_service.get_current_rates()
+    rates = await asyncio.to_thread(currency_service.get_current_rates)
     current_rate = sheets_manager.get_exchange_rate()
     if not rates:
         await msg.edit_text(f"⚠️ Error conectando API.\nTasa actual: {current_rate} Bs/$")
@@ -103,15 +131,11 @@ async def comparar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         now = datetime.now()
-        current = sheets_manager.get_monthly_summary(now.year, now.month)
+        current = await asyncio.to_thread(month_close.get_month, now.year, now.month)
         
-        # Obtener mes anterior
-        if now.month == 1:
-            prev_year, prev_month = now.year - 1, 12
-        else:
-            prev_year, prev_month = now.year, now.month - 1
-        
-        previous = sheets_manager.get_monthly_summary(prev_year, prev_month)
+        # Mes anterior: snapshot congelado al cierre
+        prev_year, prev_month = month_close.previous(now.year, now.month)
+        previous = await asyncio.to_thread(month_close.get_month, prev_year, prev_month)
         
         if not current or not previous:
             await msg.edit_text("❌ No hay datos suficientes para comparar (necesito al menos 2 meses).")
@@ -182,7 +206,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file = await context.bot.get_file(voice.file_id)
         voice_bytes = await file.download_as_bytearray()
         
-        result = analyze_voice(bytes(voice_bytes))
+        result = await asyncio.to_thread(analyze_voice, bytes(voice_bytes))
         
         if not result.get("success"):
             await msg.edit_text(f"❌ No pude entender el audio: {result.get('error', 'Error desconocido')}")
@@ -246,7 +270,9 @@ async def hoja_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def analisis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Dashboard completo con gráficos e IA coaching."""
     msg = await update.message.reply_text("📊 Generando análisis detallado...")
-    summary = sheets_manager.get_monthly_summary()
+    # Resumen y ahorros en una sola petición (GraphQL, con respaldo REST en paralelo)
+    dashboard = await asyncio.to_thread(dashboard_loader.load)
+    summary = dashboard["summary"]
     
     if not summary or summary['count'] == 0:
         await msg.edit_text("❌ No hay datos suficientes para el análisis.")
@@ -259,13 +285,15 @@ async def analisis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bars = visualizer.generate_comparison_chart(summary['total_usd'], summary['total_ingresos'])
     
     # 3. Gráfico de Tendencia
-    trend = visualizer.generate_daily_trend(summary['daily_trend'])
+    # Todas las gráficas comparten el frame tipado del resumen (se parsea una sola vez)
+    frame = summary.get('frame', summary['daily_trend'])
+    trend = visualizer.generate_daily_trend(frame)
     
     # 4. Top 5 Gastos (NUEVO)
-    top5 = visualizer.generate_top5_expenses(summary.get('all_expenses', summary['daily_trend']))
+    top5 = visualizer.generate_top5_expenses(frame)
     
     # 5. Distribución por Día de Semana (NUEVO)
-    weekday = visualizer.generate_weekday_distribution(summary['daily_trend'])
+    weekday = visualizer.generate_weekday_distribution(frame)
     
     media = [
         InputMediaPhoto(pie, caption=f"📉 *Gasto por Categoría*\nTotal: ${summary['total_usd']:,.2f}", parse_mode="Markdown"),
@@ -282,17 +310,20 @@ async def analisis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_media_group(media=media)
     
     # AHORROS
-    savings = sheets_manager.get_savings()
+    savings = dashboard["savings"]
     if savings:
         sav_msg = "💰 *Progreso de Ahorros:*\n"
         for s in savings:
             sav_msg += f"• {s['Meta']}: {s['Porcentaje']} de ${float(s['Objetivo USD']):,.0f}\n"
         await update.message.reply_text(sav_msg, parse_mode="Markdown")
     
-    # AI COACHING
-    advice = get_financial_advice(summary)
-    await update.message.reply_text(f"🤖 *Consejos del Coach (IA):*\n\n{advice}", parse_mode="Markdown")
+    # AI COACHING (streaming sobre un mensaje nuevo)
+    coach_msg = await update.message.reply_text("🤖 Pensando consejos...")
     await msg.delete()
+    await stream_reply.stream_reply(
+        coach_msg, build_advice_prompt(summary), update.effective_chat.id,
+        header="🤖 *Consejos del Coach (IA):*\n\n", fallback=ADVICE_FALLBACK
+    )
 
 async def add_category_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
@@ -414,7 +445,7 @@ async def pagado_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Marcar como pagado: /pagado Persona"""
     if not context.args:
         # Mostrar deudas pendientes
-        debts = sheets_manager.get_pending_debts()
+        debts = await asyncio.to_thread(sheets_manager.get_pending_debts)
         if not debts:
             await update.message.reply_text("✅ No tienes deudas pendientes por cobrar.")
             return
@@ -433,8 +464,9 @@ async def pagado_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def debt_reminder_job(context: ContextTypes.DEFAULT_TYPE):
     """Revisar deudas diarias y notificar vencimientos."""
     logger.info("Ejecutando verificador de deudas...")
-    debts = sheets_manager.get_pending_debts()
     today = datetime.now().strftime("%Y-%m-%d")
+    # Directus filtra por fecha de retorno: solo llegan las deudas que vencen hoy
+    debts = await asyncio.to_thread(sheets_manager.get_pending_debts, today)
     
     for d in debts:
         if d['Fecha Retorno'] == today:
@@ -448,76 +480,53 @@ async def debt_reminder_job(context: ContextTypes.DEFAULT_TYPE):
                 except Exception as e:
                     logger.warning(f"No se pudo enviar a chat {chat['chat_id']}: {e}")
 
+async def _broadcast_alerts(bot, alerts: list):
+    """Envía las alertas a todos los chats registrados."""
+    if not alerts:
+        return
+    full_msg = "🔔 *ALERTAS INTELIGENTES*\n\n" + "\n\n".join(alerts)
+    for chat in database.get_all_chats():
+        try:
+            await bot.send_message(chat['chat_id'], full_msg, parse_mode="Markdown")
+        except Exception as e:
+            logger.warning(f"No se pudo enviar alerta a chat {chat['chat_id']}: {e}")
+
 async def smart_alerts_job(context: ContextTypes.DEFAULT_TYPE):
-    """Alertas inteligentes: inactividad, gastos inusuales, metas estancadas."""
+    """Alertas inteligentes: reglas de alert_engine (inactividad, gastos inusuales, ritmo de presupuesto) y metas estancadas."""
     logger.info("Ejecutando alertas inteligentes...")
     
     try:
-        # Obtener datos del mes
-        summary = sheets_manager.get_monthly_summary()
-        if not summary or summary['count'] == 0:
-            return
-        
-        alerts = []
+        # Solo presupuestos y metas (sin filas de gastos) en una sola petición al backend
+        dashboard = await asyncio.to_thread(dashboard_loader.load, parts=("budgets", "savings"))
+        alert_engine.prime_budgets(dashboard["budgets"])
+        alerts = await asyncio.to_thread(alert_engine.evaluate_all)
         
-        # 1. ALERTA DE INACTIVIDAD (sin gastos en 3+ días)
-        if summary['daily_trend']:
-            from datetime import timedelta
-            last_expense_date = None
-            for t in reversed(summary['daily_trend']):
-                try:
-                    last_expense_date = datetime.strptime(str(t['Fecha']), "%Y-%m-%d")
-                    break
-                except: continue
-            
-            if last_expense_date:
-                days_inactive = (datetime.now() - last_expense_date).days
-                if days_inactive >= 3:
-                    alerts.append(f"📭 *Sin actividad*: Llevas {days_inactive} días sin registrar gastos. ¿Todo bien?")
-        
-        # 2. ALERTA DE GASTO INUSUAL (último gasto > 3x promedio)
-        if summary['daily_trend'] and len(summary['daily_trend']) > 5:
-            amounts = [float(str(t.get('Monto USD', 0)).replace(',', '.')) for t in summary['daily_trend']]
-            avg = sum(amounts[:-1]) / len(amounts[:-1]) if len(amounts) > 1 else 0
-            last_amount = amounts[-1] if amounts else 0
-            
-            if avg > 0 and last_amount > avg * 3:
-                alerts.append(f"⚠️ *Gasto inusual*: Tu último gasto (${last_amount:,.2f}) es {last_amount/avg:.1f}x mayor que tu promedio.")
-        
-        # 3. ALERTA DE PRESUPUESTO CRÍTICO (>90%)
-        budgets = sheets_manager.get_all_budgets()
-        for cat, budget in budgets.items():
-            spent = summary['by_category'].get(cat, 0)
-            if budget > 0:
-                pct = (spent / budget) * 100
-                if pct >= 90:
-                    alerts.append(f"🔴 *Presupuesto crítico*: {cat} al {pct:.0f}% (${spent:,.2f}/${budget:,.2f})")
-        
-        # 4. ALERTA DE META DE AHORRO ESTANCADA
-        savings = sheets_manager.get_savings()
+        # Metas de ahorro estancadas (viven en Directus, fuera del motor)
+        savings = dashboard["savings"]
         for s in savings:
             try:
                 last_update = s.get('Ultima Act', '')
                 if last_update:
                     last_date = datetime.strptime(last_update[:10], "%Y-%m-%d")
                     days_stale = (datetime.now() - last_date).days
-                    if days_stale >= 14:
+                    if days_stale >= 14 and database.marcar_alerta_enviada(f"meta:{s['Meta']}:{datetime.now():%Y-%W}"):
                         alerts.append(f"💤 *Meta estancada*: '{s['Meta']}' no ha crecido en {days_stale} días.")
             except: continue
         
-        # Enviar alertas a todos los chats registrados
-        if alerts:
-            full_msg = "🔔 *ALERTAS INTELIGENTES*\n\n" + "\n\n".join(alerts)
-            chats = database.get_all_chats()
-            for chat in chats:
-                try:
-                    await context.bot.send_message(chat['chat_id'], full_msg, parse_mode="Markdown")
-                except Exception as e:
-                    logger.warning(f"No se pudo enviar alerta a chat {chat['chat_id']}: {e}")
+        await _broadcast_alerts(context.bot, alerts)
         
     except Exception as e:
         logger.error(f"Error en smart_alerts_job: {e}")
 
+async def alert_dispatch_job(context: ContextTypes.DEFAULT_TYPE):
+    """Envía las alertas generadas al registrar gastos (evaluación incremental)."""
+    try:
+        await asyncio.to_thread(alert_engine.refresh)
+    except Exception as e:
+        logger.warning(f"No se pudo refrescar el motor de alertas: {e}")
+    await asyncio.to_thread(alert_engine.process_incoming)
+    await _broadcast_alerts(context.bot, alert_engine.pop_pending())
+
 async def recurrente_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Configurar gasto recurrente: /recurrente Netflix 15 25"""
     try:
@@ -543,7 +552,7 @@ async def recurrente_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def recurring_check_job(context: ContextTypes.DEFAULT_TYPE):
     """Revisar si hay pagos recurrentes hoy."""
     logger.info("Verificando pagos recurrentes...")
-    to_pay = sheets_manager.check_recurring() # Devuelve lista de {row, data}
+    to_pay = await asyncio.to_thread(sheets_manager.check_recurring) # Devuelve lista de {row, data}
     
     if not to_pay: return
     
@@ -566,36 +575,31 @@ async def recurring_check_job(context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f"RECURRENTE: TOCA PAGAR {p['Nombre']}")
 
 async def reporte_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Generar reporte Excel."""
-    msg = await update.message.reply_text("📊 Generando reporte Excel desde Directus...")
+    """/reporte [YYYY-MM] [csv] - Reporte del mes en Excel (o CSV)."""
+    year = month = None
+    fmt = "xlsx"
+    for arg in context.args or []:
+        if arg.lower() == "csv":
+            fmt = "csv"
+        else:
+            try:
+                periodo = datetime.strptime(arg, "%Y-%m")
+                year, month = periodo.year, periodo.month
+            except ValueError:
+                await update.message.reply_text("⚠️ Uso: `/reporte [YYYY-MM] [csv]`", parse_mode="Markdown")
+                return
+    
+    msg = await update.message.reply_text(f"📊 Generando reporte {fmt.upper()} desde Directus...")
     try:
-        # ss = sheets_manager.get_monthly_spreadsheet() 
-        # Traer todo desde Directus
-        g_recs = sheets_manager.get_monthly_records(record_type="expense")
-        i_recs = sheets_manager.get_monthly_records(record_type="income")
-        
-        # Crear Excel en memoria
-        wb = pd.ExcelWriter("reporte.xlsx", engine="openpyxl")
-        
-        if g_recs:
-            df_g = pd.DataFrame(g_recs)
-            # Aplanar campos anidados si es necesario (ej: category.name)
-            if 'category' in df_g.columns:
-                 df_g['category'] = df_g['category'].apply(lambda x: x.get('name') if isinstance(x, dict) else x)
-            df_g.to_excel(wb, sheet_name="Gastos", index=False)
-            
-        if i_recs:
-            df_i = pd.DataFrame(i_recs)
-            df_i.to_excel(wb, sheet_name="Ingresos", index=False)
-            
-        # Guardar buffer
-        buf = io.BytesIO()
-        wb.book.save(buf)
-        wb.close()
-        buf.seek(0)
-        
-        fname = f"Reporte_{datetime.now().strftime('%Y_%m')}.xlsx"
-        await update.message.reply_document(document=buf, filename=fname, caption="Aquí tienes tu reporte mensual 📄")
+        buf, fname, stats = await asyncio.to_thread(report_export.build_report, year, month, fmt)
+        try:
+            # PTB lee el archivo completo para subirlo; solo el resultado final vive en memoria
+            await update.message.reply_document(
+                document=buf.read(), filename=fname,
+                caption=f"Aquí tienes tu reporte mensual 📄 ({stats['rows']} movimientos)"
+            )
+        finally:
+            buf.close()
         await msg.delete()
     except Exception as e:
         await msg.edit_text(f"❌ Error generando reporte: {e}")
@@ -604,36 +608,19 @@ async def consejo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Auditoría financiera con IA sobre últimos gastos."""
     msg = await update.message.reply_text("🕵️ Auditando tus gastos con IA... Espere.")
     try:
-        last_30 = sheets_manager.get_monthly_records(record_type="expense")
-        # Directus returns latest first or we sort
-        last_30 = sorted(last_30, key=lambda x: x.get('date', ''), reverse=True)[:30]
+        # Orden y límite en el servidor: solo viajan los 30 gastos que se auditan
+        last_30 = await asyncio.to_thread(
+            sheets_manager.get_recent_transactions, "expense", 30, "date,concept,amount,category.name"
+        )
         
         if not last_30:
             await msg.edit_text("❌ No hay suficientes gastos para auditar.")
             return
 
-        # Formatear para Gemini
-        text_data = "Fecha | Concepto | Monto USD | Categoria\n"
-        for r in last_30:
-            try:
-                cat_name = r.get('category', {}).get('name') if isinstance(r.get('category'), dict) else "Otros"
-                row_txt = f"{r.get('date')} | {r.get('concept')} | {r.get('amount')} | {cat_name}"
-                text_data += row_txt + "\n"
-            except: continue
-            
-        prompt = f"""Actúa como un auditor financiero experto. Analiza estos últimos gastos de una familia en Venezuela y busca:
-1. Patrones de gasto excesivo.
-2. Gastos hormiga detectados.
-3. Suscripciones ocultas o repetidas.
-4. Oportunidades de ahorro.
-DAME UN REPORTE CONCRETO Y DIRECTO (Bullet points).
-DATOS:
-{text_data}"""
-
-        response = gemini_analyzer.model.generate_content(prompt)
-        advice = response.text
-        
-        await msg.edit_text(f"🕵️ *INFORME DE AUDITORÍA:*\n\n{advice}", parse_mode="Markdown")
+        await stream_reply.stream_reply(
+            msg, build_audit_prompt(last_30), update.effective_chat.id,
+            header="🕵️ *INFORME DE AUDITORÍA:*\n\n"
+        )
         
     except Exception as e:
         await msg.edit_text(f"❌ Error en auditoría: {e}")
@@ -654,7 +641,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def update_rates_job(context: ContextTypes.DEFAULT_TYPE):
     """Tarea horaria para actualizar tasas"""
     logger.info("Ejecutando actualización de tasa automática...")
-    rates = currency_service.get_current_rates()
+    # Historial BCV de Directus: 304 (sin descarga) mientras no haya tasas nuevas
+    await asyncio.to_thread(rate_index.refresh_history)
+    rates = await asyncio.to_thread(currency_service.refresh_rates)
     if not rates: return
     bcv = rates.get("oficial", 0)
     paralelo = rates.get("paralelo", 0)
@@ -668,6 +657,39 @@ async def update_rates_job(context: ContextTypes.DEFAULT_TYPE):
     else:
         sheets_manager.set_exchange_rate(current_rate, source, bcv=bcv, paralelo=paralelo)
 
+async def sync_transactions_job(context: ContextTypes.DEFAULT_TYPE):
+    """Réplica incremental Directus -> SQLite (full=True una vez al día para detectar borrados)."""
+    full = bool(context.job.data and context.job.data.get("full"))
+    await asyncio.to_thread(directus_sync.sync_transactions, full)
+
+async def outbox_drain_job(context: ContextTypes.DEFAULT_TYPE):
+    """Envía a Directus las transacciones guardadas localmente (write-behind)."""
+    await asyncio.to_thread(outbox.drain)
+
+async def outbox_purge_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(outbox.purge)
+
+async def month_close_job(context: ContextTypes.DEFAULT_TYPE):
+    """Cierre del mes anterior (snapshot) y preparación del mes nuevo; idempotente."""
+    try:
+        await asyncio.to_thread(month_close.run_rollover)
+    except Exception as e:
+        logger.error(f"Error en cierre de mes: {e}")
+
+async def classifier_rebuild_job(context: ContextTypes.DEFAULT_TYPE):
+    """Reentrena el clasificador de categorías con el historial (incluye lo sincronizado de Directus)."""
+    try:
+        await asyncio.to_thread(category_classifier.rebuild)
+    except Exception as e:
+        logger.error(f"Error reentrenando clasificador de categorías: {e}")
+
+async def budget_reconcile_job(context: ContextTypes.DEFAULT_TYPE):
+    """Concilia el ledger de presupuestos del mes con Directus."""
+    try:
+        await asyncio.to_thread(budget_ledger.reconcile)
+    except Exception as e:
+        logger.error(f"Error conciliando ledger de presupuestos: {e}")
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.message.reply_text("🔄 Analizando imagen...")
     caption = update.message.caption
@@ -675,7 +697,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file = await context.bot.get_file(photo.file_id)
     image_bytes = await file.download_as_bytearray()
     
-    result = analyze_receipt(bytes(image_bytes), caption=caption)
+    result = await asyncio.to_thread(analyze_receipt, bytes(image_bytes), caption=caption)
     await msg.delete()
     if result["success"]:
         await process_analysis_result(update, result["data"], bytes(image_bytes))
@@ -684,14 +706,30 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text.startswith("/"): return
+    # Ruta rápida local: la charla sin montos se ignora y los gastos claros no pasan por Gemini
+    parsed = expense_parser.parse(update.message.text)
+    if parsed["status"] == expense_parser.IGNORE:
+        return
+    if parsed["status"] == expense_parser.MATCH:
+        await process_analysis_result(update, parsed["data"], None)
+        return
     msg = await update.message.reply_text("🤔 Analizando texto...")
-    result = analyze_text(update.message.text)
+    # Extracciones simultáneas de varios chats comparten una sola llamada a Gemini
+    result = await gemini_batcher.extract(update.message.text)
     await msg.delete()
     if result["success"]:
         await process_analysis_result(update, result["data"], None)
 
 async def process_analysis_result(update: Update, data: dict, image_bytes: bytes = None):
     """Punto de entrada tras el análisis: decide si guarda directo o pregunta."""
+    # Categoría propia de la familia (clasificador local) sobre la sugerencia genérica,
+    # nunca sobre una que el usuario indicó ("en comida", #hashtag)
+    if not data.get("categoria_explicita"):
+        categoria = category_classifier.suggest(data.get("concepto"), data.get("beneficiario"))
+        if categoria:
+            data["categoria"] = data["categoria_sugerida"] = categoria
+            data["categoria_predicha"] = True  # Al guardar no se reentrena con su propia predicción
+    
     # Verificar si el usuario quiere auto-guardado
     conf_required = sheets_manager.is_confirmation_required()
     
@@ -708,7 +746,7 @@ async def process_analysis_result(update: Update, data: dict, image_bytes: bytes
                 await update.effective_message.reply_text(f"⚠️ No se pudo subir la imagen a Drive: {e}")
         
         user = update.effective_user.first_name
-        success, res_msg = sheets_manager.add_transaction(data, user, drive_link, is_income=False)
+        success, res_msg = outbox.enqueue(data, user, drive_link, is_income=False)
         
         if success:
             msg = f"✅ Guardado automático exitoso!\n👤 Responsable: *{user}*"
@@ -770,7 +808,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.error(f"Error subiendo a Drive: {e}")
                 await query.edit_message_text(f"⚠️ Error subiendo imagen: {e}. Guardando datos...")
         
-        success, res_msg = sheets_manager.add_transaction(expense["data"], expense["user"], drive_link, is_income)
+        success, res_msg = outbox.enqueue(expense["data"], expense["user"], drive_link, is_income)
         if success:
             msg = f"✅ Guardado con éxito!\n👤 Responsable: *{expense['user']}*"
             if not is_income:
@@ -797,7 +835,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     elif action == "setrate":
         source, rate_val = parts[1], float(parts[2])
-        rates = currency_service.get_current_rates()
+        rates = currency_service.get_cached_rates()  # Sin red: memoria/SQLite
         bcv = rates.get("oficial", 0) if rates else 0
         paralelo = rates.get("paralelo", 0) if rates else 0
         sheets_manager.set_exchange_rate(rate_val, source, bcv=bcv, paralelo=paralelo)
@@ -815,7 +853,10 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         cat = "_".join(parts[1:-1])
         
         if key in pending_data:
-            pending_data[key]["data"]["categoria"] = cat
+            pending_data[key]["data"]["categoria"] = pending_data[key]["data"]["categoria_sugerida"] = cat
+            pending_data[key]["data"]["categoria_predicha"] = False
+            # Corrección manual: el clasificador aprende al guardar, con más peso (una vez aunque se repita)
+            pending_data[key]["data"]["categoria_corregida"] = True
             # Refrescar mensaje
             rate = sheets_manager.get_exchange_rate()
             data = pending_data[key]["data"]
@@ -865,7 +906,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "categoria": gasto_original.get('categoria', 'Otros')
             }
             
-            success, res_msg = sheets_manager.add_transaction(data, user_name, "", is_income=False)
+            success, res_msg = outbox.enqueue(data, user_name, "", is_income=False)
             
             if success:
                 database.get_or_create_user(query.from_user.id, user_name)
@@ -922,7 +963,30 @@ async def post_init(application: Application):
     from telegram import BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats
     await application.bot.set_my_commands(commands, scope=BotCommandScopeAllPrivateChats())
     await application.bot.set_my_commands(commands, scope=BotCommandScopeAllGroupChats())
+    # Índice histórico de tasas en memoria: la conversión por transacción no hace I/O
+    await asyncio.to_thread(rate_index.preload)
     application.job_queue.run_repeating(update_rates_job, interval=3600, first=10)
+    if DIRECTUS_EVENTS_SECRET:
+        # Directus notifica los cambios (directus_events): solo ponerse al día con lo ocurrido sin el bot
+        application.job_queue.run_once(sync_transactions_job, when=20)
+    else:
+        application.job_queue.run_repeating(sync_transactions_job, interval=300, first=20)
+    application.job_queue.run_repeating(outbox_drain_job, interval=10, first=5)
+    application.job_queue.run_repeating(alert_dispatch_job, interval=15, first=15)
+    application.job_queue.run_repeating(budget_reconcile_job, interval=budget_ledger.RECONCILE_INTERVAL, first=30)
+    # Cierre de mes: barato si ya está cerrado; se reintenta cada hora si hay outbox pendiente
+    application.job_queue.run_repeating(month_close_job, interval=3600, first=60)
+    application.job_queue.run_once(classifier_rebuild_job, when=5)
+    application.job_queue.run_daily(classifier_rebuild_job, time=datetime.strptime("03:50", "%H:%M").time())
+    # Workers para handlers pesados (foto, voz, CSV, análisis)
+    work_queue.start()
+    # API del dashboard de la Web App (snapshot precalculado)
+    try:
+        await webapp_api.start()
+    except Exception as e:
+        logger.error(f"No se pudo iniciar webapp_api: {e}")
+    application.job_queue.run_daily(outbox_purge_job, time=datetime.strptime("03:45", "%H:%M").time())
+    application.job_queue.run_daily(sync_transactions_job, time=datetime.strptime("03:30", "%H:%M").time(), data={"full": True})
     application.job_queue.run_daily(debt_reminder_job, time=datetime.strptime("09:00", "%H:%M").time())
     application.job_queue.run_daily(recurring_check_job, time=datetime.strptime("08:00", "%H:%M").time())
     application.job_queue.run_daily(smart_alerts_job, time=datetime.strptime("10:00", "%H:%M").time())
@@ -944,49 +1008,86 @@ async def gasto_rapido_command(update: Update, context: ContextTypes.DEFAULT_TYP
     
     try:
         monto = float(context.args[0])
-        categoria = context.args[1].capitalize()
-        concepto = " ".join(context.args[2:]) if len(context.args) > 2 else categoria
-        
-        user_id = update.effective_user.id
-        user_name = update.effective_user.first_name
-        
-        # Crear perfil si no existe
-        database.get_or_create_user(user_id, user_name)
-        
-        # Verificar modo silencioso
-        silent = database.is_silent_mode(user_id)
-        
-        data = {
-            "fecha": datetime.now().strftime("%Y-%m-%d"),
-            "monto": monto,
-            "moneda": "USD",
-            "concepto": concepto,
-            "categoria": categoria
-        }
-        
-        success, msg = sheets_manager.add_transaction(data, user_name, "", is_income=False)
+    except ValueError:
+        await update.message.reply_text("⚠️ El primer argumento debe ser un número.")
+        return
+    
+    categoria = context.args[1].capitalize()
+    concepto = " ".join(context.args[2:]) if len(context.args) > 2 else categoria
+    await registrar_gasto_rapido(update, monto, categoria, concepto)
+
+async def registrar_gasto_rapido(update: Update, monto: float, categoria: str, concepto: str, fecha: str = None):
+    """
+    Ruta rápida compartida por /g y la Web App: sin Gemini, una sola
+    escritura local (outbox) y respuesta inmediata.
+    """
+    user_id = update.effective_user.id
+    user_name = update.effective_user.first_name
+    
+    # Crear perfil si no existe
+    database.get_or_create_user(user_id, user_name)
+    
+    # Verificar modo silencioso
+    silent = database.is_silent_mode(user_id)
+    
+    data = {
+        "fecha": fecha or datetime.now().strftime("%Y-%m-%d"),
+        "monto": monto,
+        "moneda": "USD",
+        "concepto": concepto,
+        "categoria": categoria
+    }
+    
+    success, msg = outbox.enqueue(data, user_name, "", is_income=False)
+    
+    if success:
+        # Actualizar streak y verificar logros
+        streak_info = database.update_streak(user_id)
+        nuevos_logros = database.check_and_award_logros(user_id)
         
-        if success:
-            # Actualizar streak y verificar logros
-            streak_info = database.update_streak(user_id)
-            nuevos_logros = database.check_and_award_logros(user_id)
-            
-            if silent:
-                await update.message.reply_text("✅", parse_mode="Markdown")
-            else:
-                response = f"⚡ *${monto:.2f}* en _{categoria}_"
-                if streak_info and streak_info['nuevo_dia']:
-                    response += f" | 🔥 Racha: {streak_info['streak']}"
-                
-                for logro in nuevos_logros:
-                    response += f"\n\n🏆 *¡LOGRO DESBLOQUEADO!*\n{logro['icono']} {logro['nombre']}"
-                
-                await update.message.reply_text(response, parse_mode="Markdown")
+        if silent:
+            await update.effective_message.reply_text("✅", parse_mode="Markdown")
         else:
-            await update.message.reply_text(f"❌ Error: {msg}")
+            response = f"⚡ *${monto:.2f}* en _{categoria}_"
+            if streak_info and streak_info['nuevo_dia']:
+                response += f" | 🔥 Racha: {streak_info['streak']}"
+            
+            for logro in nuevos_logros:
+                response += f"\n\n🏆 *¡LOGRO DESBLOQUEADO!*\n{logro['icono']} {logro['nombre']}"
             
+            await update.effective_message.reply_text(response, parse_mode="Markdown")
+    else:
+        await update.effective_message.reply_text(f"❌ Error: {msg}")
+
+async def webapp_data_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Datos enviados desde la Web App con tg.sendData (action: add_expense)."""
+    await register_chat_if_new(update)
+    try:
+        payload = json.loads(update.effective_message.web_app_data.data)
+    except (AttributeError, ValueError):
+        await update.effective_message.reply_text("⚠️ Datos de la Web App no válidos.")
+        return
+    
+    if payload.get("action") != "add_expense":
+        logger.warning(f"Acción de Web App desconocida: {payload.get('action')}")
+        return
+    
+    try:
+        monto = float(payload.get("amount", 0))
+    except (TypeError, ValueError):
+        monto = 0
+    if monto <= 0:
+        await update.effective_message.reply_text("⚠️ El monto debe ser mayor a 0.")
+        return
+    
+    categoria = str(payload.get("category") or "Otros").strip()[:50]
+    concepto = str(payload.get("description") or categoria).strip()[:200]
+    fecha = None
+    try:
+        fecha = datetime.strptime(str(payload.get("date", ""))[:10], "%Y-%m-%d").strftime("%Y-%m-%d")
     except ValueError:
-        await update.message.reply_text("⚠️ El primer argumento debe ser un número.")
+        pass
+    await registrar_gasto_rapido(update, monto, categoria, concepto, fecha)
 
 async def score_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """/score - Ver puntaje financiero."""
@@ -1190,7 +1291,7 @@ async def fijado_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "categoria": fijado['categoria']
         }
         
-        success, msg = sheets_manager.add_transaction(data, user_name, "", is_income=False)
+        success, msg = outbox.enqueue(data, user_name, "", is_income=False)
         
         if success:
             database.get_or_create_user(user_id, user_name)
@@ -1211,9 +1312,7 @@ async def fijado_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"❌ Error: {msg}")
 
 async def preguntar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """/preguntar - Asistente conversacional IA."""
-    from gemini_analyzer import answer_financial_question
-    
+    """/preguntar - Asistente conversacional IA (respuesta en streaming)."""
     if not context.args:
         await update.message.reply_text(
             "🤖 *Asistente Financiero*\n\n"
@@ -1229,11 +1328,14 @@ async def preguntar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.message.reply_text("🤔 Pensando...")
     
     try:
-        summary = sheets_manager.get_monthly_summary()
-        savings = sheets_manager.get_savings()
-        
-        answer = answer_financial_question(question, summary, savings)
-        await msg.edit_text(f"🤖 {answer}", parse_mode="Markdown")
+        # Preguntas frecuentes: consulta local determinista; abiertas: Gemini con contexto mínimo
+        result = await asyncio.to_thread(query_engine.answer, question, update.effective_user.first_name)
+        if result["text"]:
+            await msg.edit_text(result["text"], parse_mode="Markdown")
+            return
+        await stream_reply.stream_reply(
+            msg, build_question_prompt(question, result["context"]), update.effective_chat.id, header="🤖 "
+        )
     except Exception as e:
         await msg.edit_text(f"❌ Error: {e}")
 
@@ -1426,17 +1528,34 @@ async def csv_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         user_name = update.effective_user.first_name
         
+        rows = []
         for row in reader:
             try:
-                data = {
-                    "fecha": row.get('fecha', datetime.now().strftime("%Y-%m-%d")),
+                rows.append({
+                    "fecha": row.get('fecha') or datetime.now().strftime("%Y-%m-%d"),
                     "monto": float(row.get('monto', 0)),
                     "moneda": row.get('moneda', 'USD'),
                     "concepto": row.get('concepto', row.get('descripcion', '')),
                     "categoria": row.get('categoria', 'Otros')
-                }
-                
-                success, _ = sheets_manager.add_transaction(data, user_name, "", is_income=False)
+                })
+            except:
+                errors += 1
+        
+        # Conversión masiva con la tasa de la fecha de cada fila (sin I/O por fila)
+        if rows:
+            try:
+                usd, _ = rate_index.convert_many(
+                    [r["monto"] for r in rows], [r["fecha"] for r in rows], [r["moneda"] for r in rows],
+                    fuente=sheets_manager.get_rate_source(), fallback=sheets_manager.get_exchange_rate()
+                )
+                for r, monto_usd in zip(rows, usd):
+                    r["monto"], r["moneda"] = float(monto_usd), "USD"
+            except Exception as e:
+                logger.warning(f"Conversión masiva CSV falló, se convierte por fila: {e}")
+        
+        for data in rows:
+            try:
+                success, _ = outbox.enqueue(data, user_name, "", is_income=False)
                 if success:
                     imported += 1
                 else:
@@ -1459,32 +1578,14 @@ async def anos_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = await update.message.reply_text("📅 Generando comparativa anual...")
     
     try:
-        now = datetime.now()
-        data_by_month = {}
-        
-        # Obtener datos de los últimos 12 meses
-        for i in range(12):
-            month = now.month - i
-            year = now.year
-            if month <= 0:
-                month += 12
-                year -= 1
-            
-            try:
-                summary = sheets_manager.get_monthly_summary(year, month)
-                if summary:
-                    key = f"{year}-{month:02d}"
-                    data_by_month[key] = summary.get('total_usd', 0)
-            except:
-                continue
+        # Últimos 12 meses: snapshots de meses cerrados + mes en curso en vivo
+        history = await asyncio.to_thread(month_close.get_history, 12)
+        data_by_month = {key: summary.get('total_usd', 0) for key, summary in history.items()}
         
         if len(data_by_month) < 2:
             await msg.edit_text("❌ No hay suficientes datos para comparar (necesito al menos 2 meses).")
             return
         
-        # Ordenar por fecha
-        data_by_month = dict(sorted(data_by_month.items()))
-        
         chart = visualizer.generate_yearly_comparison(data_by_month)
         
         if chart:
@@ -1542,7 +1643,7 @@ async def duplicar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Encontrar el último gasto del usuario
         ultimo = None
         for g in gastos:
-            if g.get('responsable', '').lower() == user_name.lower():
+            if (g.get('responsable') or '').lower() == user_name.lower():
                 ultimo = g
                 break
         
@@ -1630,13 +1731,52 @@ async def webapp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
+async def post_shutdown(application: Application):
+    await work_queue.stop()
+    # Último intento de enviar lo pendiente antes de salir (lo que falle queda en el outbox)
+    await asyncio.to_thread(outbox.drain)
+
+async def cola_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/cola - Estado de la cola de tareas pesadas."""
+    m = work_queue.get_metrics()
+    g = gemini_batcher.get_metrics()
+    j = get_parse_metrics()
+    r = model_router.get_metrics()
+    ev = directus_events.get_metrics()
+    tails = " | ".join(f"{model}: p50 {l['p50_s']}s p95 {l['p95_s']}s" for model, l in r["latencies"].items())
+    await update.message.reply_text(
+        f"🧵 *Cola de tareas*\n\n"
+        f"⏳ En cola: *{m['queued']}* ({m['chats_waiting']} chats)\n"
+        f"⚙️ Ejecutando: *{m['running']}/{m['workers']}*\n"
+        f"✅ Completadas: {m['completed']} | ❌ Fallidas: {m['failed']} | 🚦 Rechazadas: {m['rejected']}\n"
+        f"⌛ Espera media: {m['wait_avg_s']}s (p95 {m['wait_p95_s']}s)\n"
+        f"🏃 Ejecución media: {m['run_avg_s']}s\n\n"
+        f"🧠 *Lotes Gemini (texto)*\n"
+        f"📨 {g['items']} extracciones en {g['requests']} llamadas ({g['items_per_request']} por llamada)\n"
+        f"⌛ Espera media de lote: {g['wait_avg_ms']} ms\n"
+        f"🧩 JSON: {j['responses']} respuestas | reparadas {j['repair_rate']}% | fallidas {j['failure_rate']}%\n"
+        f"🔀 Modelos: {r['requests']} llamadas | hedges {r['hedges']} (ganados {r['hedge_wins']}) | "
+        f"escalados {r['escalations']} | timeouts {r['timeouts']}\n"
+        f"⏱️ {tails or 'sin datos'} | streaming primer fragmento p50 {r['ttft_p50_s'] or '-'}s\n"
+        f"📡 Eventos Directus: {ev['applied']} aplicados | {ev['errors']} errores | último {ev['last_event_at'] or '-'}",
+        parse_mode="Markdown"
+    )
+
 def main():
     print("🤖 Bot Financiero 360 Iniciado...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Chats distintos en paralelo, mismo chat en orden
+        .concurrent_updates(ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("hoja", hoja_command))
     application.add_handler(CommandHandler("tasa", set_rate_command))
-    application.add_handler(CommandHandler("analisis", analisis_command))
+    application.add_handler(CommandHandler("analisis", queued(analisis_command)))
     application.add_handler(CommandHandler("resumen", summary_command))
     application.add_handler(CommandHandler("nueva", add_category_command))
     application.add_handler(CommandHandler("presupuesto", budget_command))
@@ -1646,9 +1786,10 @@ def main():
     application.add_handler(CommandHandler("deuda", deuda_command))
     application.add_handler(CommandHandler("pagado", pagado_command))
     application.add_handler(CommandHandler("recurrente", recurrente_command))
-    application.add_handler(CommandHandler("reporte", reporte_command))
-    application.add_handler(CommandHandler("consejo", consejo_command))
+    application.add_handler(CommandHandler("reporte", queued(reporte_command)))
+    application.add_handler(CommandHandler("consejo", queued(consejo_command)))
     application.add_handler(CommandHandler("webapp", webapp_command))
+    application.add_handler(CommandHandler("cola", cola_command))
     application.add_handler(CommandHandler("comparar", comparar_command))
     # Gamificación
     application.add_handler(CommandHandler("g", gasto_rapido_command))
@@ -1666,17 +1807,31 @@ def main():
     application.add_handler(CommandHandler("tendencias", tendencias_command))
     application.add_handler(CommandHandler("proyeccion", proyeccion_command))
     # Pendientes V7.0
-    application.add_handler(CommandHandler("csv", csv_command))
+    application.add_handler(CommandHandler("csv", queued(csv_command)))
     application.add_handler(CommandHandler("anos", anos_command))
     application.add_handler(CommandHandler("galeria", galeria_command))
     application.add_handler(CommandHandler("duplicar", duplicar_command))
     # Mensajes y documentos
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    application.add_handler(MessageHandler(filters.VOICE, handle_voice))
-    application.add_handler(MessageHandler(filters.Document.ALL, csv_command))  # Para importar CSV
+    application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, webapp_data_handler))
+    application.add_handler(MessageHandler(filters.PHOTO, queued(handle_photo)))
+    application.add_handler(MessageHandler(filters.VOICE, queued(handle_voice)))
+    application.add_handler(MessageHandler(filters.Document.ALL, queued(csv_command)))  # Para importar CSV
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     application.add_handler(CallbackQueryHandler(handle_callback))
-    application.run_polling()
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL or not WEBHOOK_SECRET:
+            raise RuntimeError("BOT_MODE=webhook requiere WEBHOOK_URL y WEBHOOK_SECRET")
+        # nginx recibe en /telegram y reenvía a este puerto local
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,129 @@
+"""
+Ledger de presupuestos
+Contadores de gasto por mes y categoría en SQLite: cada gasto guardado suma
+a su categoría (record) y la alerta tras guardar es una lectura puntual
+(check) en lugar de releer presupuestos y el resumen completo del mes.
+Un job concilia periódicamente con Directus y, con el backend de Sheets,
+refleja el gastado en la columna "Gastado Actual" de la hoja Presupuestos.
+"""
+import logging
+from datetime import datetime
+
+import database  # SQLite local
+from config import BACKEND
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = 30 * 60  # segundos
+
+_seeded = set()  # Períodos cuyos límites ya se verificaron en este proceso
+
+
+def periodo_de(fecha: str = None) -> str:
+    """'YYYY-MM' de una fecha 'YYYY-MM-DD' (o del mes actual)."""
+    return str(fecha)[:7] if fecha else datetime.now().strftime("%Y-%m")
+
+
+def _month_range(periodo: str) -> tuple[str, str]:
+    year, month = int(periodo[:4]), int(periodo[5:7])
+    end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    return f"{periodo}-01", end
+
+
+def _previous(periodo: str) -> str:
+    year, month = int(periodo[:4]), int(periodo[5:7])
+    return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+
+def _ensure_limits(periodo: str):
+    """
+    Primer gasto del mes antes de seed_month o de la conciliación: hereda los
+    límites del mes anterior (solo SQLite) para que check() alerte desde el día 1.
+    """
+    if periodo in _seeded or periodo != periodo_de():
+        return
+    if not any(row["limite"] for row in database.ledger_get(periodo).values()):
+        limites = {cat: row["limite"] for cat, row in database.ledger_get(_previous(periodo)).items() if row["limite"]}
+        if limites:
+            database.ledger_seed_limites(periodo, limites)
+    _seeded.add(periodo)
+
+
+def record(categoria: str, monto_usd: float, fecha: str = None) -> dict:
+    """Suma un gasto recién guardado a su contador. Retorna la fila del ledger."""
+    try:
+        _ensure_limits(periodo_de(fecha))
+        return database.ledger_add(periodo_de(fecha), categoria or "Otros", float(monto_usd or 0))
+    except Exception as e:
+        logger.error(f"Error actualizando ledger de presupuestos: {e}")
+        return None
+
+
+def check(categoria: str, periodo: str = None) -> dict:
+    """
+    Estado del presupuesto de la categoría, mismo formato que check_budget_alert:
+    {"limit", "spent", "pct", "alert"} o None si no tiene presupuesto.
+    """
+    try:
+        row = database.ledger_get(periodo or periodo_de(), categoria)
+    except Exception as e:
+        logger.error(f"Error leyendo ledger de presupuestos: {e}")
+        return None
+    if not row or not row["limite"] or row["limite"] <= 0:
+        return None
+    pct = (row["gastado"] / row["limite"]) * 100
+    return {
+        "limit": row["limite"], "spent": row["gastado"], "pct": pct,
+        "alert": "red" if pct >= 100 else "yellow" if pct >= 80 else "green"
+    }
+
+
+def set_limit(categoria: str, limite: float):
+    """Refleja de inmediato un /presupuesto nuevo (sin esperar a la conciliación)."""
+    try:
+        database.ledger_set_limite(periodo_de(), categoria, float(limite))
+    except Exception as e:
+        logger.error(f"Error fijando límite en ledger: {e}")
+
+
+def reconcile(periodo: str = None) -> dict:
+    """
+    Recalcula los contadores del período desde Directus (+ gastos locales aún en
+    outbox) y corrige la deriva. Bloqueante: usar en hilo.
+    """
+    import directus_manager
+    import outbox
+
+    periodo = periodo or periodo_de()
+    start, end = _month_range(periodo)
+    antes = database.ledger_get(periodo)
+
+    limites = directus_manager.get_all_budgets()
+    if not limites:
+        # get_all_budgets retorna {} también ante errores: conservar los límites conocidos
+        limites = {cat: row["limite"] for cat, row in antes.items() if row["limite"]}
+
+    gastado = {}
+    # Sin drenados en paralelo: cada gasto cuenta en Directus o en pendientes, nunca en ambos
+    with outbox.paused():
+        for item in directus_manager.iter_transactions(start, end, "expense", fields="id,date,amount,category.name"):
+            cat = item.get("category")
+            name = cat.get("name") if isinstance(cat, dict) and cat.get("name") else "Otros"
+            gastado[name] = gastado.get(name, 0.0) + float(item.get("amount") or 0)
+        for cat, total in database.get_gastos_pendientes_por_categoria(start, end).items():
+            gastado[cat or "Otros"] = gastado.get(cat or "Otros", 0.0) + total
+
+    database.ledger_reconcile(periodo, gastado, limites)
+    drift = sum(abs(gastado.get(cat, 0.0) - (antes.get(cat) or {}).get("gastado", 0.0))
+                for cat in set(gastado) | set(antes))
+    if drift > 0.01:
+        logger.info(f"Ledger {periodo} conciliado: deriva ${drift:,.2f}")
+
+    if BACKEND == "sheets":
+        try:
+            import sheets_manager
+            sheets_manager.update_budget_spent(gastado, int(periodo[:4]), int(periodo[5:7]))
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar 'Gastado Actual' en Sheets: {e}")
+
+    return {"periodo": periodo, "categorias": len(gastado), "drift": round(drift, 2)}
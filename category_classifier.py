@@ -0,0 +1,132 @@
+"""
+Clasificador local de categorías (naive Bayes multinomial)
+Aprende de los gastos de la familia (concepto/beneficiario -> categoría) y
+de las palabras clave de la hoja Categorias (backend de Sheets). Se entrena
+desde SQLite al arrancar y se actualiza incrementalmente con cada gasto
+guardado (las correcciones del callback setcat pesan más). Predecir cuesta microsegundos y no usa LLM.
+"""
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+import database  # SQLite local
+from config import BACKEND
+
+logger = logging.getLogger(__name__)
+
+ALPHA = 0.1              # Suavizado de Laplace
+MIN_CONFIDENCE = 0.55    # Probabilidad posterior mínima para imponer la categoría
+MIN_DOCS = 3             # Ejemplos mínimos antes de predecir
+CORRECTION_WEIGHT = 3    # Una corrección manual pesa como N ejemplos
+KEYWORD_WEIGHT = 2
+TRAINING_ROWS = 5000
+
+STOPWORDS = {
+    "de", "del", "la", "el", "los", "las", "en", "por", "para", "con", "un", "una", "y", "a", "al",
+    "pago", "compra", "gasto", "bs", "usd", "ref", "movil",
+}
+
+_WORD_RE = re.compile(r"[a-z]{2,}")
+
+
+def tokenize(*texts) -> list:
+    """Unigramas + bigramas sin acentos ni números (concepto, beneficiario, ...)."""
+    text = " ".join(str(t) for t in texts if t)
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = [w for w in _WORD_RE.findall(text) if w not in STOPWORDS]
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class CategoryClassifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._features = defaultdict(Counter)   # categoria -> Counter(feature)
+        self._totals = Counter()                # categoria -> nº de features
+        self._docs = Counter()                  # categoria -> nº de ejemplos
+        self._vocab = set()
+        self._built = False
+
+    # ---------- entrenamiento ----------
+
+    def _add(self, tokens: list, categoria: str, weight: int):
+        if not tokens or not categoria:
+            return
+        self._features[categoria].update({t: weight for t in tokens})
+        self._totals[categoria] += weight * len(tokens)
+        self._docs[categoria] += weight
+        self._vocab.update(tokens)
+
+    def learn(self, categoria: str, *texts, weight: int = 1):
+        """Suma un ejemplo (gasto guardado o corrección) al modelo."""
+        with self._lock:
+            self._add(tokenize(*texts), categoria, weight)
+
+    def rebuild(self):
+        """Reentrena desde cero: historial SQLite + Keywords de la hoja Categorias."""
+        examples = database.get_gastos_entrenamiento(TRAINING_ROWS)
+        keywords = {}
+        if BACKEND == "sheets":
+            try:
+                import sheets_manager
+                keywords = sheets_manager.get_category_keywords()
+            except Exception as e:
+                logger.warning(f"No se pudieron leer Keywords de categorías: {e}")
+
+        fresh = CategoryClassifier()
+        for concepto, beneficiario, categoria in examples:
+            fresh._add(tokenize(concepto, beneficiario), categoria, 1)
+        for categoria, words in keywords.items():
+            for word in words:
+                fresh._add(tokenize(word), categoria, KEYWORD_WEIGHT)
+
+        with self._lock:
+            self._features, self._totals = fresh._features, fresh._totals
+            self._docs, self._vocab = fresh._docs, fresh._vocab
+            self._built = True
+        logger.info(f"Clasificador de categorías: {len(examples)} ejemplos, {len(self._docs)} categorías, {len(self._vocab)} features")
+
+    # ---------- predicción ----------
+
+    def predict(self, *texts) -> tuple:
+        """
+        (categoria, probabilidad) o (None, 0.0) si no hay señal suficiente.
+        Sin I/O: hasta que el job programado ejecute rebuild() no se predice.
+        """
+        if not self._built:
+            return None, 0.0
+        tokens = tokenize(*texts)
+        with self._lock:
+            if not tokens or sum(self._docs.values()) < MIN_DOCS:
+                return None, 0.0
+            known = [t for t in tokens if t in self._vocab]
+            if not known:
+                return None, 0.0
+            n_docs = sum(self._docs.values())
+            vocab = len(self._vocab)
+            scores = {}
+            for categoria, docs in self._docs.items():
+                counts, denom = self._features[categoria], self._totals[categoria] + ALPHA * vocab
+                scores[categoria] = math.log(docs / n_docs) + sum(math.log((counts[t] + ALPHA) / denom) for t in known)
+        best = max(scores, key=scores.get)
+        # Posterior normalizada (softmax de log-probabilidades)
+        top = scores[best]
+        prob = 1.0 / sum(math.exp(s - top) for s in scores.values())
+        return best, prob
+
+    def suggest(self, *texts) -> str:
+        """Categoría solo si la confianza supera MIN_CONFIDENCE."""
+        categoria, prob = self.predict(*texts)
+        return categoria if prob >= MIN_CONFIDENCE else None
+
+
+_instance = CategoryClassifier()
+
+
+def learn(categoria, *texts, weight=1): _instance.learn(categoria, *texts, weight=weight)
+def rebuild(): _instance.rebuild()
+def predict(*texts): return _instance.predict(*texts)
+def suggest(*texts): return _instance.suggest(*texts)
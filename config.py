@@ -10,8 +10,25 @@ load_dotenv()
 # Telegram
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Modo de despliegue: "polling" (local) o "webhook" (detrás de nginx en /telegram)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # URL pública completa, ej: https://tu-dominio.com/telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
 # Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Micro-lotes de extracción de texto: espera máxima añadida (ms) y tamaño máximo del lote
+GEMINI_BATCH_MAX_WAIT_MS = int(os.getenv("GEMINI_BATCH_MAX_WAIT_MS", "400"))
+GEMINI_BATCH_MAX_ITEMS = int(os.getenv("GEMINI_BATCH_MAX_ITEMS", "8"))
+# Enrutado de modelos: ligero por defecto, fuerte para respaldo/escalado, audio nativo para voz
+GEMINI_MODEL_LIGHT = os.getenv("GEMINI_MODEL_LIGHT", "gemini-2.5-flash-lite")
+GEMINI_MODEL_STRONG = os.getenv("GEMINI_MODEL_STRONG", "gemini-2.5-flash")
+GEMINI_MODEL_AUDIO = os.getenv("GEMINI_MODEL_AUDIO", "gemini-2.0-flash-exp")
+GEMINI_LATENCY_BUDGET_S = float(os.getenv("GEMINI_LATENCY_BUDGET_S", "25"))
 
 # Google Sheets
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
@@ -22,11 +39,22 @@ GOOGLE_CREDENTIALS_FILE = os.path.join(BASE_DIR, os.getenv("GOOGLE_CREDENTIALS_F
 # Google Drive
 GOOGLE_DRIVE_FOLDER_ID = os.getenv("GOOGLE_DRIVE_FOLDER_ID")
 
+# Backend de datos activo: "directus" (por defecto) o "sheets" (legado, hojas mensuales en Drive).
+# La carpeta de Drive también guarda comprobantes: no basta para decidir si se usa Sheets
+BACKEND = os.getenv("BACKEND", "directus").lower()
+
 # Directus
 DIRECTUS_URL = os.getenv("DIRECTUS_URL", "http://localhost:8055")
 DIRECTUS_TOKEN = os.getenv("DIRECTUS_TOKEN", "")
 DIRECTUS_ORG_ID = os.getenv("DIRECTUS_ORG_ID", "")
 
+# Eventos de Directus (extensión bot-events -> /api/directus/events); vacío = sync periódico
+DIRECTUS_EVENTS_SECRET = os.getenv("DIRECTUS_EVENTS_SECRET", "")
+
+# API de la Web App (nginx hace proxy de /api/ a este puerto)
+WEBAPP_API_HOST = os.getenv("WEBAPP_API_HOST", "127.0.0.1")
+WEBAPP_API_PORT = int(os.getenv("WEBAPP_API_PORT", "8081"))
+
 
 # Categorías de gastos disponibles
 CATEGORIAS = [
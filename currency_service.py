@@ -1,32 +1,49 @@
 """
 Servicio para obtener tasas de cambio de ve.dolarapi.com
+Caché en memoria + SQLite (tasas_cache) con single-flight y stale-while-revalidate.
 """
 import requests
 import logging
+import threading
+import time
+from datetime import datetime
+
+import database  # SQLite local
+import rate_index
 
 logger = logging.getLogger(__name__)
 
 API_URL = "https://ve.dolarapi.com/v1/dolares"
+REQUEST_TIMEOUT = 10
 
-def get_current_rates() -> dict:
-    """
-    Obtiene las tasas actuales (Oficial y Paralelo).
-    Retorna un dict con ambas tasas y la fecha de actualización.
-    """
+# Ventanas de caché (segundos)
+FRESH_TTL = 15 * 60        # Tasa fresca: se sirve sin consultar la API
+STALE_TTL = 12 * 3600      # Tasa vieja: se sirve mientras se revalida en segundo plano
+HISTORY_DAYS = 400         # Retención de la serie histórica en tasas_cache
+
+# Estado del proceso
+_cache = {"rates": None, "fetched_at": 0.0}
+_lock = threading.Lock()
+_inflight = None           # threading.Event de la consulta en curso (single-flight)
+_warmed = False
+
+
+def _fetch_from_api() -> dict:
+    """Consulta DolarAPI directamente. Retorna dict de tasas o None."""
     try:
-        response = requests.get(API_URL, timeout=10)
+        response = requests.get(API_URL, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
         data = response.json()
-        
+
         rates = {
             "oficial": 0.0,
             "paralelo": 0.0,
             "last_update": ""
         }
-        
+
         # La API retorna una lista de monitores.
         # Buscamos "BCV" (oficial) y "Paralelo" (promedio o específico)
-        
+
         for tasa in data:
             name = tasa.get("fuente", "").lower()
             if name == "oficial":
@@ -34,9 +51,133 @@ def get_current_rates() -> dict:
                 rates["last_update"] = tasa.get("fechaActualizacion", "")
             elif name == "paralelo": # Promedio paralelo
                 rates["paralelo"] = tasa.get("promedio", 0.0)
-                
+
         return rates
-        
+
     except Exception as e:
         logger.error(f"Error consultando DolarAPI: {e}")
         return None
+
+
+def _warm_from_db():
+    """Carga la última tasa persistida para responder aunque la API no esté disponible."""
+    global _warmed
+    if _warmed: return
+    _warmed = True
+    try:
+        oficial = database.get_ultima_tasa_cache("oficial")
+        paralelo = database.get_ultima_tasa_cache("paralelo")
+        if not oficial and not paralelo: return
+
+        ts = (oficial or paralelo)["timestamp"]
+        fetched_at = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S").timestamp()
+        with _lock:
+            if _cache["rates"] is None:
+                _cache["rates"] = {
+                    "oficial": oficial["tasa"] if oficial else 0.0,
+                    "paralelo": paralelo["tasa"] if paralelo else 0.0,
+                    "last_update": ts
+                }
+                _cache["fetched_at"] = fetched_at
+    except Exception as e:
+        logger.warning(f"No se pudo precargar tasas desde SQLite: {e}")
+
+
+def _store(rates: dict):
+    """Actualiza la caché en memoria y agrega el punto a la serie de tasas_cache."""
+    now = datetime.now()
+    with _lock:
+        _cache["rates"] = rates
+        _cache["fetched_at"] = now.timestamp()
+
+    ts = now.strftime("%Y-%m-%d %H:%M:%S")
+    for fuente in ("oficial", "paralelo"):
+        if rates.get(fuente):
+            database.add_tasa_cache(fuente, rates[fuente], ts)
+            rate_index.add_point(fuente, now, rates[fuente])
+
+
+def _refresh() -> dict:
+    """
+    Consulta la API con deduplicación single-flight: si ya hay una consulta
+    en curso, espera su resultado en lugar de lanzar otra.
+    """
+    global _inflight
+    with _lock:
+        event = _inflight
+        leader = event is None
+        if leader:
+            event = _inflight = threading.Event()
+
+    if not leader:
+        event.wait(timeout=REQUEST_TIMEOUT + 2)
+        return _snapshot()
+
+    try:
+        rates = _fetch_from_api()
+        if rates and (rates["oficial"] or rates["paralelo"]):
+            _store(rates)
+        return _snapshot()
+    finally:
+        with _lock:
+            _inflight = None
+        event.set()
+
+
+def _refresh_in_background():
+    """Lanza una revalidación sin bloquear al llamador (si no hay una en curso)."""
+    if _inflight is not None: return
+    threading.Thread(target=_refresh, name="rates-refresh", daemon=True).start()
+
+
+def _snapshot() -> dict:
+    rates = _cache["rates"]
+    return dict(rates) if rates else None
+
+
+def _age() -> float:
+    return time.time() - _cache["fetched_at"]
+
+
+def get_current_rates() -> dict:
+    """
+    Obtiene las tasas actuales (Oficial y Paralelo).
+    Retorna un dict con ambas tasas y la fecha de actualización.
+
+    - Fresca: responde desde memoria.
+    - Vieja (< STALE_TTL): responde desde memoria y revalida en segundo plano.
+    - Sin datos o expirada: consulta la API (una sola vez aunque haya llamadas concurrentes).
+    """
+    _warm_from_db()
+    age = _age()
+    if _cache["rates"] and age < FRESH_TTL:
+        return _snapshot()
+    if _cache["rates"] and age < STALE_TTL:
+        _refresh_in_background()
+        return _snapshot()
+    return _refresh()
+
+
+def get_cached_rates() -> dict:
+    """
+    Versión que nunca bloquea por red: retorna lo que haya en memoria/SQLite
+    (o None) y dispara la revalidación si la tasa ya no está fresca.
+    Pensada para callbacks del bot.
+    """
+    _warm_from_db()
+    if _age() >= FRESH_TTL:
+        _refresh_in_background()
+    return _snapshot()
+
+
+def refresh_rates() -> dict:
+    """Fuerza una consulta a la API (job horario) y aplica la retención del historial."""
+    _warm_from_db()
+    rates = _refresh()
+    database.purge_tasas_cache(HISTORY_DAYS)
+    return rates
+
+
+def get_rate_history(fuente: str = "oficial", dias: int = 30) -> list:
+    """Serie temporal de tasas guardadas: [{'tasa': float, 'timestamp': str}, ...]"""
+    return database.get_tasas_cache(fuente, dias)
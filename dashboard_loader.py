@@ -0,0 +1,152 @@
+"""
+Cargador de datos del dashboard (una sola petición GraphQL a Directus)
+Resumen del mes (totales agregados + filas de gastos), presupuestos, metas
+de ahorro y deudas pendientes en una consulta GraphQL con alias. Si
+GraphQL falla (deshabilitado, permisos, error de esquema) se recurre a las
+llamadas REST del adaptador en paralelo. Mismos formatos que directus_manager.
+"""
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import directus_manager
+from directus_manager import DirectusManager
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 30
+GRAPHQL_RETRY_S = 600   # Tras un fallo de GraphQL, usar REST durante este tiempo
+PARTS = ("summary", "budgets", "savings", "debts")
+
+_state = {"graphql_disabled_until": 0.0}
+_stats = {"graphql": 0, "rest": 0, "graphql_errors": 0, "last_ms": 0}
+
+
+def _gql(value) -> str:
+    """Literal GraphQL (claves sin comillas) para filtros y argumentos."""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}: {_gql(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_gql(v) for v in value) + "]"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return json.dumps(str(value))
+
+
+def _month_range(year: int, month: int) -> tuple:
+    end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    return f"{year}-{month:02d}-01", end
+
+
+def build_query(org_id: str, year: int, month: int, parts: tuple = PARTS) -> str:
+    """Consulta con alias solo para las partes pedidas (el resumen trae todas las filas de gastos del mes)."""
+    start, end = _month_range(year, month)
+    org = {"organization": {"id": {"_eq": org_id}}}
+    month_tx = lambda tipo: {"_and": [org, {"type": {"_eq": tipo}}, {"date": {"_gte": start, "_lt": end}}]}
+    blocks = {
+        "summary": f"""
+  expenses_total: transactions_aggregated(filter: {_gql(month_tx("expense"))}) {{ sum {{ amount }} count {{ id }} }}
+  incomes_total: transactions_aggregated(filter: {_gql(month_tx("income"))}) {{ sum {{ amount }} }}
+  expenses: transactions(filter: {_gql(month_tx("expense"))}, sort: ["date", "id"], limit: -1) {{
+    date amount concept category {{ name }}
+  }}""",
+        "budgets": f"""
+  budgets: categories(filter: {_gql({"_and": [org, {"budget": {"_gt": 0}}]})}, limit: -1) {{ name budget }}""",
+        "savings": f"""
+  savings: savings(filter: {_gql(org)}, sort: ["name"], limit: -1) {{
+    name target_amount current_amount date_updated date_created
+  }}""",
+        "debts": f"""
+  debts: debts(filter: {_gql({"_and": [org, {"status": {"_eq": "PENDIENTE"}}]})}, sort: ["return_date"], limit: -1) {{
+    person amount return_date status
+  }}""",
+    }
+    return "query Dashboard {" + "".join(blocks[p] for p in parts) + "\n}"
+
+
+def _first(rows: list) -> dict:
+    return rows[0] if rows else {}
+
+
+def _load_graphql(year: int, month: int, parts: tuple) -> dict:
+    manager = directus_manager._instance
+    r = requests.post(
+        f"{manager.base_url}/graphql",
+        headers=manager._get_headers(),
+        json={"query": build_query(manager.org_id, year, month, parts)},
+        timeout=TIMEOUT
+    )
+    r.raise_for_status()
+    body = r.json()
+    if body.get("errors"):
+        raise RuntimeError(body["errors"][0].get("message", "Error GraphQL"))
+    data = body["data"]
+
+    result = {}
+    if "summary" in parts:
+        exp, inc = _first(data["expenses_total"]), _first(data["incomes_total"])
+        result["summary"] = DirectusManager.build_summary(
+            year, month,
+            float((exp.get("sum") or {}).get("amount") or 0),
+            int((exp.get("count") or {}).get("id") or 0),
+            float((inc.get("sum") or {}).get("amount") or 0),
+            data["expenses"],
+        )
+    if "budgets" in parts:
+        result["budgets"] = {item["name"]: float(item["budget"]) for item in data["budgets"]}
+    if "savings" in parts:
+        result["savings"] = [DirectusManager.format_saving(item) for item in data["savings"]]
+    if "debts" in parts:
+        result["debts"] = [DirectusManager.format_debt(d) for d in data["debts"]]
+    return result
+
+
+def _load_rest(year: int, month: int, parts: tuple) -> dict:
+    """Respaldo: las lecturas REST pedidas en paralelo (la latencia es la de la más lenta)."""
+    readers = {
+        "summary": lambda: directus_manager.get_monthly_summary(year, month),
+        "budgets": directus_manager.get_all_budgets,
+        "savings": directus_manager.get_savings,
+        "debts": directus_manager.get_pending_debts,
+    }
+    with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix="dashboard") as pool:
+        futures = {part: pool.submit(readers[part]) for part in parts}
+        return {part: future.result() for part, future in futures.items()}
+
+
+def load(year: int = None, month: int = None, parts: tuple = PARTS) -> dict:
+    """
+    {"summary", "budgets", "savings", "debts", "source"} del mes indicado
+    (por defecto el actual), o solo las `parts` pedidas: el resumen descarga
+    todas las filas de gastos del mes. Bloqueante: usar en hilo.
+    """
+    now = datetime.now()
+    year, month = year or now.year, month or now.month
+    started = time.monotonic()
+    data = None
+    if time.time() >= _state["graphql_disabled_until"]:
+        try:
+            data = {**_load_graphql(year, month, parts), "source": "graphql"}
+        except Exception as e:
+            _stats["graphql_errors"] += 1
+            _state["graphql_disabled_until"] = time.time() + GRAPHQL_RETRY_S
+            logger.warning(f"Dashboard GraphQL no disponible, usando REST: {e}")
+    if data is None:
+        data = {**_load_rest(year, month, parts), "source": "rest"}
+
+    _stats[data["source"]] += 1
+    _stats["last_ms"] = round((time.monotonic() - started) * 1000)
+    logger.info(f"Dashboard {year}-{month:02d} vía {data['source']} en {_stats['last_ms']} ms")
+    return data
+
+
+def get_metrics() -> dict:
+    return dict(_stats)
@@ -153,6 +153,7 @@ def init_database():
             timestamp TEXT DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasas_fuente_ts ON tasas_cache (fuente, timestamp)")
     
     conn.commit()
     conn.close()
@@ -431,6 +432,72 @@ def get_resumen_mes(year=None, month=None):
         'count_ingresos': len(ingresos)
     }
 
+# ==================== TASAS ====================
+
+def add_tasa_cache(fuente, tasa, timestamp=None):
+    """Agrega un punto a la serie histórica de tasas."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO tasas_cache (fuente, tasa, timestamp)
+            VALUES (?, ?, ?)
+        """, (fuente.lower(), tasa, timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error add_tasa_cache SQLite: {e}")
+        return False
+
+def get_ultima_tasa_cache(fuente):
+    """Obtiene el punto más reciente de una fuente ('oficial', 'paralelo')."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT tasa, timestamp FROM tasas_cache
+        WHERE fuente = ? ORDER BY timestamp DESC LIMIT 1
+    """, (fuente.lower(),))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def get_tasas_cache(fuente=None, dias=30):
+    """Obtiene la serie de tasas de los últimos N días, en orden cronológico."""
+    from datetime import timedelta
+    desde = (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d")
+    conn = get_connection()
+    cursor = conn.cursor()
+    if fuente:
+        cursor.execute("""
+            SELECT fuente, tasa, timestamp FROM tasas_cache
+            WHERE fuente = ? AND timestamp >= ? ORDER BY timestamp
+        """, (fuente.lower(), desde))
+    else:
+        cursor.execute("""
+            SELECT fuente, tasa, timestamp FROM tasas_cache
+            WHERE timestamp >= ? ORDER BY timestamp
+        """, (desde,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def purge_tasas_cache(dias=400):
+    """Elimina puntos de la serie más antiguos que la retención configurada."""
+    from datetime import timedelta
+    try:
+        limite = (datetime.now() - timedelta(days=dias)).strftime("%Y-%m-%d")
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM tasas_cache WHERE timestamp < ?", (limite,))
+        affected = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return affected
+    except Exception as e:
+        logger.error(f"Error purge_tasas_cache SQLite: {e}")
+        return 0
+
 # Inicializar DB al importar
 init_database()
 
@@ -964,3 +1031,652 @@ def get_emails_for_report(frecuencia='semanal'):
     rows = cursor.fetchall()
     conn.close()
     return [dict(row) for row in rows]
+
+# ==================== RÉPLICA DIRECTUS ====================
+
+REPLICA_TABLES = ("gastos", "ingresos")
+
+def init_replica_columns():
+    """Columnas e índices para la réplica local de transacciones de Directus."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    for tabla in REPLICA_TABLES:
+        cols = [row['name'] for row in cursor.execute(f"PRAGMA table_info({tabla})").fetchall()]
+        if "directus_id" not in cols:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN directus_id TEXT")
+        if "updated_at" not in cols:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN updated_at TEXT")
+        if tabla == "gastos" and "beneficiario" not in cols:
+            # Beneficiario del comprobante: el clasificador de categorías entrena con él
+            cursor.execute("ALTER TABLE gastos ADD COLUMN beneficiario TEXT")
+        cursor.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{tabla}_directus_id
+            ON {tabla} (directus_id) WHERE directus_id IS NOT NULL
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabla}_fecha ON {tabla} (fecha)")
+    
+    conn.commit()
+    conn.close()
+
+# Inicializar columnas de réplica
+init_replica_columns()
+
+def upsert_transacciones_replica(tabla, rows):
+    """
+    Inserta/actualiza en lote filas de la réplica, clave = directus_id.
+    Si una transacción cambió de tipo se elimina de la otra tabla.
+    """
+    if tabla not in REPLICA_TABLES or not rows:
+        return 0
+    otra = "ingresos" if tabla == "gastos" else "gastos"
+    
+    if tabla == "gastos":
+        sql = """
+            INSERT INTO gastos (directus_id, fecha, concepto, monto_original, moneda, monto_usd, categoria, referencia, responsable, imagen_url, updated_at)
+            VALUES (:directus_id, :fecha, :concepto, :monto_original, :moneda, :monto_usd, :categoria, :referencia, :responsable, :imagen_url, :updated_at)
+            ON CONFLICT (directus_id) WHERE directus_id IS NOT NULL DO UPDATE SET
+                fecha = excluded.fecha, concepto = excluded.concepto,
+                -- Directus solo guarda USD: conservar monto/moneda original si el monto no cambió
+                monto_original = CASE WHEN gastos.monto_usd = excluded.monto_usd THEN gastos.monto_original ELSE excluded.monto_original END,
+                moneda = CASE WHEN gastos.monto_usd = excluded.monto_usd THEN gastos.moneda ELSE excluded.moneda END,
+                monto_usd = excluded.monto_usd,
+                categoria = excluded.categoria, referencia = COALESCE(excluded.referencia, gastos.referencia),
+                -- El responsable local (Telegram) gana; Directus solo completa los que faltan
+                responsable = COALESCE(gastos.responsable, excluded.responsable),
+                imagen_url = excluded.imagen_url, updated_at = excluded.updated_at
+        """
+    else:
+        sql = """
+            INSERT INTO ingresos (directus_id, fecha, concepto, monto_original, moneda, monto_usd, categoria, responsable, updated_at)
+            VALUES (:directus_id, :fecha, :concepto, :monto_original, :moneda, :monto_usd, :categoria, :responsable, :updated_at)
+            ON CONFLICT (directus_id) WHERE directus_id IS NOT NULL DO UPDATE SET
+                fecha = excluded.fecha, concepto = excluded.concepto,
+                -- Directus solo guarda USD: conservar monto/moneda original si el monto no cambió
+                monto_original = CASE WHEN ingresos.monto_usd = excluded.monto_usd THEN ingresos.monto_original ELSE excluded.monto_original END,
+                moneda = CASE WHEN ingresos.monto_usd = excluded.monto_usd THEN ingresos.moneda ELSE excluded.moneda END,
+                monto_usd = excluded.monto_usd,
+                categoria = excluded.categoria,
+                responsable = COALESCE(ingresos.responsable, excluded.responsable),
+                updated_at = excluded.updated_at
+        """
+    
+    defaults = {"referencia": None, "responsable": None, "imagen_url": None, "moneda": "USD"}
+    params = [{**defaults, **r} for r in rows]
+    
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(sql, params)
+        cursor.executemany(f"DELETE FROM {otra} WHERE directus_id = ?", [(r["directus_id"],) for r in params])
+        conn.commit()
+        conn.close()
+        return len(params)
+    except Exception as e:
+        logger.error(f"Error upsert_transacciones_replica SQLite: {e}")
+        return 0
+
+def delete_transacciones_replica(directus_ids):
+    """Elimina de la réplica las transacciones borradas en Directus."""
+    if not directus_ids:
+        return 0
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        affected = 0
+        for tabla in REPLICA_TABLES:
+            cursor.executemany(f"DELETE FROM {tabla} WHERE directus_id = ?", [(str(i),) for i in directus_ids])
+            affected += cursor.rowcount
+        conn.commit()
+        conn.close()
+        return affected
+    except Exception as e:
+        logger.error(f"Error delete_transacciones_replica SQLite: {e}")
+        return 0
+
+def get_replica_filas(directus_ids):
+    """{directus_id: fila} de la réplica (con su tabla) para los ids indicados."""
+    if not directus_ids:
+        return {}
+    ids = [str(i) for i in directus_ids]
+    marks = ",".join("?" * len(ids))
+    conn = get_connection()
+    cursor = conn.cursor()
+    filas = {}
+    for tabla in REPLICA_TABLES:
+        cursor.execute(f"SELECT directus_id, fecha, concepto, monto_usd, categoria FROM {tabla} WHERE directus_id IN ({marks})", ids)
+        filas.update({row['directus_id']: {**dict(row), "tabla": tabla} for row in cursor.fetchall()})
+    conn.close()
+    return filas
+
+def get_replica_ids():
+    """Conjunto de directus_id presentes en la réplica."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    ids = set()
+    for tabla in REPLICA_TABLES:
+        cursor.execute(f"SELECT directus_id FROM {tabla} WHERE directus_id IS NOT NULL")
+        ids.update(row['directus_id'] for row in cursor.fetchall())
+    conn.close()
+    return ids
+
+# ==================== OUTBOX ====================
+
+def init_outbox_table():
+    """Cola durable de escrituras pendientes hacia el backend remoto (Directus)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            tabla TEXT NOT NULL,
+            local_id INTEGER,
+            payload TEXT NOT NULL,
+            estado TEXT DEFAULT 'pendiente',
+            intentos INTEGER DEFAULT 0,
+            next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            remote_id TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            sent_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pendientes ON outbox (estado, next_attempt_at)")
+    
+    conn.commit()
+    conn.close()
+
+# Inicializar outbox
+init_outbox_table()
+
+def enqueue_transaccion(tabla, row, idempotency_key, payload):
+    """
+    Guarda la transacción local (synced_to_sheets=0) y su entrada de outbox
+    en una sola transacción SQLite. Retorna el id local o None.
+    """
+    if tabla not in REPLICA_TABLES:
+        return None
+    cols = list(row.keys()) + ["synced_to_sheets"]
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"INSERT INTO {tabla} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            list(row.values()) + [0]
+        )
+        local_id = cursor.lastrowid
+        cursor.execute("""
+            INSERT INTO outbox (idempotency_key, tabla, local_id, payload, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (idempotency_key, tabla, local_id, payload, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+        conn.close()
+        return local_id
+    except Exception as e:
+        logger.error(f"Error enqueue_transaccion SQLite: {e}")
+        return None
+
+def get_outbox_pendientes(limit=50):
+    """Entradas pendientes cuyo próximo intento ya venció, en orden de llegada."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT * FROM outbox
+        WHERE estado = 'pendiente' AND next_attempt_at <= ?
+        ORDER BY id LIMIT ?
+    """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_outbox_claves(keys):
+    """Subconjunto de `keys` que son claves de idempotencia del outbox (escrituras propias del bot)."""
+    keys = [k for k in keys if k]
+    if not keys:
+        return set()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT idempotency_key FROM outbox WHERE idempotency_key IN ({','.join('?' * len(keys))})", keys)
+    claves = {row['idempotency_key'] for row in cursor.fetchall()}
+    conn.close()
+    return claves
+
+def mark_outbox_enviado(idempotency_key, remote_id):
+    """Marca la entrada como enviada y enlaza la fila local con su directus_id."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT tabla, local_id FROM outbox WHERE idempotency_key = ?", (idempotency_key,))
+        entry = cursor.fetchone()
+        if not entry:
+            conn.close()
+            return False
+        
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("""
+            UPDATE outbox SET estado = 'enviado', remote_id = ?, sent_at = ?, last_error = NULL
+            WHERE idempotency_key = ?
+        """, (str(remote_id), now, idempotency_key))
+        if entry['local_id'] and remote_id:
+            tabla = entry['tabla']
+            # El sync pudo traer la fila antes que esta confirmación: la local (más completa) gana
+            cursor.execute(f"DELETE FROM {tabla} WHERE directus_id = ? AND id != ?", (str(remote_id), entry['local_id']))
+            cursor.execute(f"UPDATE {tabla} SET directus_id = ?, synced_to_sheets = 1 WHERE id = ?", (str(remote_id), entry['local_id']))
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error mark_outbox_enviado SQLite: {e}")
+        return False
+
+def mark_outbox_fallido(idempotency_key, error, next_attempt_at, definitivo=False):
+    """Registra un intento fallido y reprograma (o deja en 'error' si se agotaron los intentos)."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE outbox SET intentos = intentos + 1, last_error = ?, next_attempt_at = ?, estado = ?
+            WHERE idempotency_key = ?
+        """, (str(error)[:500], next_attempt_at, 'error' if definitivo else 'pendiente', idempotency_key))
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error mark_outbox_fallido SQLite: {e}")
+        return False
+
+def get_outbox_stats():
+    """Conteo de entradas por estado: {'pendiente': n, 'enviado': n, 'error': n}"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT estado, COUNT(*) AS total FROM outbox GROUP BY estado")
+    stats = {row['estado']: row['total'] for row in cursor.fetchall()}
+    conn.close()
+    return stats
+
+def purge_outbox(dias=30):
+    """Elimina entradas ya enviadas con más de `dias` de antigüedad."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM outbox WHERE estado = 'enviado' AND sent_at < datetime('now', 'localtime', ?)
+        """, (f"-{int(dias)} days",))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+    except Exception as e:
+        logger.error(f"Error purge_outbox SQLite: {e}")
+        return 0
+
+# ==================== ALERTAS ====================
+
+# Reglas por defecto: tipo + ámbito + ventana + umbral; el mensaje admite
+# {sujeto} {monto} {mediana} {factor} {dias} {pct} {gastado} {proyectado} {presupuesto}
+REGLAS_ALERTA_DEFAULT = [
+    ("Gasto inusual por categoría", "outlier", "categoria", 60, 3.5,
+     "⚠️ *Gasto inusual en {sujeto}*: ${monto:,.2f} es {factor:.1f}x la mediana (${mediana:,.2f})."),
+    ("Gasto inusual por responsable", "outlier", "responsable", 60, 3.5,
+     "⚠️ *Gasto inusual de {sujeto}*: ${monto:,.2f} es {factor:.1f}x su mediana (${mediana:,.2f})."),
+    ("Sin actividad", "inactividad", "global", 30, 3,
+     "📭 *Sin actividad*: Llevan {dias} días sin registrar gastos. ¿Todo bien?"),
+    ("Ritmo de presupuesto", "burn_rate", "categoria", 31, 1.0,
+     "🔥 *{sujeto}*: a este ritmo cerrarás el mes en ${proyectado:,.2f} ({pct:.0f}% de ${presupuesto:,.2f})."),
+]
+
+def init_alert_tables():
+    """Tablas de reglas de alerta y registro de alertas enviadas."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reglas_alerta (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            ambito TEXT DEFAULT 'global',
+            ventana_dias INTEGER DEFAULT 60,
+            umbral REAL NOT NULL,
+            mensaje TEXT NOT NULL,
+            activa INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS alertas_enviadas (
+            clave TEXT PRIMARY KEY,
+            enviada_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("SELECT COUNT(*) AS total FROM reglas_alerta")
+    if cursor.fetchone()['total'] == 0:
+        cursor.executemany("""
+            INSERT INTO reglas_alerta (nombre, tipo, ambito, ventana_dias, umbral, mensaje)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, REGLAS_ALERTA_DEFAULT)
+    
+    conn.commit()
+    conn.close()
+
+# Inicializar tablas de alertas
+init_alert_tables()
+
+def get_reglas_alerta(solo_activas=True):
+    """Reglas de alerta configuradas."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    if solo_activas:
+        cursor.execute("SELECT * FROM reglas_alerta WHERE activa = 1 ORDER BY id")
+    else:
+        cursor.execute("SELECT * FROM reglas_alerta ORDER BY id")
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def add_regla_alerta(nombre, tipo, ambito, ventana_dias, umbral, mensaje):
+    """Agrega una regla (tipos soportados por alert_engine: outlier, inactividad, burn_rate)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO reglas_alerta (nombre, tipo, ambito, ventana_dias, umbral, mensaje)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (nombre, tipo, ambito, ventana_dias, umbral, mensaje))
+    regla_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return regla_id
+
+def set_regla_alerta_activa(regla_id, activa=True):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE reglas_alerta SET activa = ? WHERE id = ?", (1 if activa else 0, regla_id))
+    updated = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return updated
+
+def marcar_alerta_enviada(clave):
+    """Registra una alerta. Retorna False si ya se había enviado (deduplicación)."""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO alertas_enviadas (clave) VALUES (?)", (clave,))
+        inserted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return inserted
+    except Exception as e:
+        logger.error(f"Error marcar_alerta_enviada SQLite: {e}")
+        return False
+
+def purge_alertas_enviadas(dias=90):
+    """Elimina el registro de alertas más antiguas que `dias`."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM alertas_enviadas WHERE enviada_at < datetime('now', ?)", (f"-{int(dias)} days",))
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+def get_gastos_entrenamiento(limite=5000):
+    """(concepto, beneficiario, categoria) más recientes para entrenar el clasificador de categorías."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT concepto, beneficiario, categoria FROM gastos
+        WHERE (COALESCE(concepto, '') != '' OR COALESCE(beneficiario, '') != '')
+          AND categoria IS NOT NULL AND categoria != ''
+        ORDER BY fecha DESC, id DESC LIMIT ?
+    """, (limite,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [(row['concepto'], row['beneficiario'], row['categoria']) for row in rows]
+
+def get_gastos_desde(fecha):
+    """Gastos con fecha >= `fecha` (columnas mínimas para análisis)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT fecha, monto_usd, categoria, responsable, concepto FROM gastos
+        WHERE fecha >= ? ORDER BY fecha
+    """, (fecha,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+# ==================== LEDGER DE PRESUPUESTOS ====================
+
+def init_ledger_table():
+    """Contadores de gasto por mes y categoría (actualizados en cada gasto, conciliados con el backend)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_presupuestos (
+            periodo TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            gastado REAL DEFAULT 0,
+            limite REAL DEFAULT 0,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            reconciled_at TEXT,
+            PRIMARY KEY (periodo, categoria)
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+# Inicializar ledger
+init_ledger_table()
+
+def ledger_add(periodo, categoria, monto):
+    """Suma `monto` al gastado de la categoría en el período. Retorna la fila actualizada."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO ledger_presupuestos (periodo, categoria, gastado) VALUES (?, ?, ?)
+        ON CONFLICT(periodo, categoria) DO UPDATE SET
+            gastado = gastado + excluded.gastado,
+            updated_at = CURRENT_TIMESTAMP
+    """, (periodo, categoria, monto))
+    conn.commit()
+    cursor.execute("SELECT * FROM ledger_presupuestos WHERE periodo = ? AND categoria = ?", (periodo, categoria))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def ledger_get(periodo, categoria=None):
+    """Una fila (si se indica categoría) o {categoria: fila} del período."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    if categoria is not None:
+        cursor.execute("SELECT * FROM ledger_presupuestos WHERE periodo = ? AND categoria = ?", (periodo, categoria))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+    cursor.execute("SELECT * FROM ledger_presupuestos WHERE periodo = ? ORDER BY gastado DESC", (periodo,))
+    rows = cursor.fetchall()
+    conn.close()
+    return {row['categoria']: dict(row) for row in rows}
+
+def ledger_set_limite(periodo, categoria, limite):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO ledger_presupuestos (periodo, categoria, limite) VALUES (?, ?, ?)
+        ON CONFLICT(periodo, categoria) DO UPDATE SET limite = excluded.limite, updated_at = CURRENT_TIMESTAMP
+    """, (periodo, categoria, limite))
+    conn.commit()
+    conn.close()
+
+def ledger_seed_limites(periodo, limites):
+    """Pre-carga los límites del período (cierre de mes) en una sola transacción."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT INTO ledger_presupuestos (periodo, categoria, limite) VALUES (?, ?, ?)
+        ON CONFLICT(periodo, categoria) DO UPDATE SET limite = excluded.limite, updated_at = CURRENT_TIMESTAMP
+    """, [(periodo, cat, float(lim)) for cat, lim in limites.items()])
+    conn.commit()
+    conn.close()
+
+def ledger_reconcile(periodo, gastado, limites):
+    """
+    Reemplaza los contadores del período por los valores del backend
+    ({categoria: gastado}, {categoria: limite}). Categorías ausentes quedan en 0.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE ledger_presupuestos SET gastado = 0, limite = 0 WHERE periodo = ?", (periodo,))
+        for categoria in set(gastado) | set(limites):
+            cursor.execute("""
+                INSERT INTO ledger_presupuestos (periodo, categoria, gastado, limite, reconciled_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(periodo, categoria) DO UPDATE SET
+                    gastado = excluded.gastado,
+                    limite = excluded.limite,
+                    updated_at = CURRENT_TIMESTAMP,
+                    reconciled_at = CURRENT_TIMESTAMP
+            """, (periodo, categoria, float(gastado.get(categoria, 0)), float(limites.get(categoria, 0))))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error conciliando ledger {periodo}: {e}")
+        raise
+    finally:
+        conn.close()
+
+def get_gastos_pendientes_por_categoria(desde, hasta):
+    """Gastos locales aún no enviados al backend (outbox), {categoria: total} en [desde, hasta)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT categoria, SUM(monto_usd) AS total FROM gastos
+        WHERE directus_id IS NULL AND synced_to_sheets = 0 AND fecha >= ? AND fecha < ?
+        GROUP BY categoria
+    """, (desde, hasta))
+    rows = cursor.fetchall()
+    conn.close()
+    return {row['categoria']: row['total'] or 0 for row in rows}
+
+# ==================== CIERRES DE MES ====================
+
+def init_snapshots_table():
+    """Resúmenes congelados de meses cerrados (inmutables una vez escritos)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots_mes (
+            periodo TEXT PRIMARY KEY,
+            total_gastos REAL DEFAULT 0,
+            total_ingresos REAL DEFAULT 0,
+            num_gastos INTEGER DEFAULT 0,
+            datos TEXT NOT NULL,
+            cerrado_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+# Inicializar snapshots
+init_snapshots_table()
+
+def save_snapshot_mes(periodo, total_gastos, total_ingresos, num_gastos, datos, reemplazar=False):
+    """Guarda el snapshot del período. Sin `reemplazar`, un snapshot existente no se toca."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    verbo = "INSERT OR REPLACE" if reemplazar else "INSERT OR IGNORE"
+    cursor.execute(f"""
+        {verbo} INTO snapshots_mes (periodo, total_gastos, total_ingresos, num_gastos, datos)
+        VALUES (?, ?, ?, ?, ?)
+    """, (periodo, total_gastos, total_ingresos, num_gastos, datos))
+    inserted = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return inserted
+
+def get_snapshots_mes(periodos=None):
+    """{periodo: fila} de los snapshots pedidos (o todos)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    if periodos:
+        marks = ",".join("?" * len(periodos))
+        cursor.execute(f"SELECT * FROM snapshots_mes WHERE periodo IN ({marks}) ORDER BY periodo", list(periodos))
+    else:
+        cursor.execute("SELECT * FROM snapshots_mes ORDER BY periodo")
+    rows = cursor.fetchall()
+    conn.close()
+    return {row['periodo']: dict(row) for row in rows}
+
+# ==================== CONSULTAS (/preguntar) ====================
+
+CONSULTA_COLUMNAS = {"categoria", "responsable"}
+
+def _filtros_consulta(desde, hasta, categorias=None, responsable=None, sin_responsable=False):
+    """WHERE parametrizado común: rango [desde, hasta), categorías y responsable (o filas sin él)."""
+    where, params = ["fecha >= ?", "fecha < ?"], [desde, hasta]
+    if categorias:
+        where.append(f"categoria IN ({','.join('?' * len(categorias))})")
+        params.extend(categorias)
+    if responsable:
+        where.append("responsable LIKE ?")
+        params.append(f"%{responsable}%")
+    if sin_responsable:
+        where.append("COALESCE(responsable, '') = ''")
+    return " AND ".join(where), params
+
+def sum_transacciones(tabla, desde, hasta, categorias=None, responsable=None, sin_responsable=False):
+    """(total_usd, cantidad) de gastos o ingresos en el rango."""
+    if tabla not in ("gastos", "ingresos"):
+        raise ValueError(f"Tabla no consultable: {tabla}")
+    where, params = _filtros_consulta(desde, hasta, categorias, responsable, sin_responsable)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COALESCE(SUM(monto_usd), 0), COUNT(*) FROM {tabla} WHERE {where}", params)
+    total, count = cursor.fetchone()
+    conn.close()
+    return total, count
+
+def resumen_gastos_por(columna, desde, hasta, categorias=None):
+    """[(valor, total_usd, cantidad)] de gastos agrupados por categoría o responsable."""
+    if columna not in CONSULTA_COLUMNAS:
+        raise ValueError(f"Columna no agrupable: {columna}")
+    where, params = _filtros_consulta(desde, hasta, categorias)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT COALESCE({columna}, 'Sin asignar'), SUM(monto_usd), COUNT(*) FROM gastos
+        WHERE {where} GROUP BY 1 ORDER BY 2 DESC
+    """, params)
+    rows = cursor.fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+def top_gastos(desde, hasta, n=5, categorias=None, responsable=None):
+    """Los `n` gastos más altos del rango."""
+    where, params = _filtros_consulta(desde, hasta, categorias, responsable)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT fecha, concepto, monto_usd, categoria, responsable FROM gastos
+        WHERE {where} ORDER BY monto_usd DESC LIMIT ?
+    """, params + [n])
+    rows = cursor.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_valores_distintos(columna):
+    """Valores distintos de categoría o responsable en gastos (para reconocerlos en preguntas)."""
+    if columna not in CONSULTA_COLUMNAS:
+        raise ValueError(f"Columna no consultable: {columna}")
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT {columna} FROM gastos WHERE {columna} IS NOT NULL AND {columna} != ''")
+    rows = cursor.fetchall()
+    conn.close()
+    return [row[0] for row in rows]
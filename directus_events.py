@@ -0,0 +1,197 @@
+"""
+Eventos de Directus -> réplica y cachés del bot
+La extensión hook `bot-events` (o un Flow "Event Hook" + "Webhook") envía cada
+create/update/delete de transactions, categories, savings y debts a
+/api/directus/events. Cada evento se aplica de forma incremental: upsert o
+borrado en la réplica SQLite, delta en el ledger de presupuestos, ventana de
+alertas, cachés en memoria y snapshot del dashboard; así el sync periódico
+deja de ser necesario (queda el completo diario como red de seguridad).
+
+Formato aceptado (un evento o una lista):
+    {"event": "transactions.items.update", "collection": "transactions",
+     "keys": ["123"], "payload": {"amount": 12.5}}
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+import alert_engine
+import budget_ledger
+import category_classifier
+import database  # SQLite local
+import directus_manager
+import directus_sync
+import month_close
+import outbox
+import query_engine
+import webapp_api
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("create", "update", "delete")
+
+_lock = threading.Lock()  # Un evento a la vez: los deltas del ledger leen la fila previa de la réplica
+_stats = {"received": 0, "applied": 0, "ignored": 0, "errors": 0, "last_ms": 0, "last_event_at": None}
+
+
+def parse_event(raw: dict) -> tuple:
+    """(colección, acción, claves, payload) de un evento de hook o de Flow."""
+    event = str(raw.get("event") or "")
+    parts = event.split(".")
+    action = parts[-1]
+    collection = raw.get("collection") or (parts[0] if len(parts) == 3 else "")
+    keys = raw.get("keys") or ([raw["key"]] if raw.get("key") is not None else [])
+    payload = raw.get("payload")
+    if action == "delete" and not keys and isinstance(payload, list):
+        keys = payload  # items.delete: el payload son las claves borradas
+    return collection, action, [str(k) for k in keys], payload if isinstance(payload, dict) else {}
+
+
+# ==================== TRANSACCIONES ====================
+
+def _ledger(row: dict, sign: int):
+    if row.get("tabla", "gastos") == "gastos":
+        budget_ledger.record(row.get("categoria"), sign * float(row.get("monto_usd") or 0), row.get("fecha"))
+
+
+def _fetch_transactions(keys: list) -> list:
+    """Estado actual de los items (el payload de un update solo trae los campos cambiados)."""
+    fields = directus_sync.SYNC_FIELDS.split(",")
+    if directus_manager._instance.ensure_schema():
+        fields.append("external_id")
+    return (
+        directus_manager._instance.query("transactions").where("id", keys, "_in")
+        .fields(*fields).limit(len(keys)).all()
+    )
+
+
+def _apply_transactions(action: str, keys: list) -> dict:
+    # Org del bot: los items de otras organizaciones no vuelven en la consulta
+    items = _fetch_transactions(keys) if action != "delete" else []
+    # Un drenado en curso termina de enlazar sus filas (directus_id) antes de leer la réplica:
+    # sin external_id (esquema no verificado) ese enlace es la única forma de reconocerlas
+    with outbox.paused():
+        result, touched = _apply_to_replica(action, keys, items)
+    # Un cambio en un mes ya cerrado regenera su snapshot
+    month_close.refresh_closed_months([row.get("fecha") for row in touched])
+    return result
+
+
+def _apply_to_replica(action: str, keys: list, items: list) -> tuple:
+    """(resultado, filas tocadas) tras aplicar el evento a réplica, ledger y ventana de alertas."""
+    before = database.get_replica_filas(keys)
+    touched = list(before.values())
+
+    if action == "delete":
+        for old in before.values():
+            _ledger(old, -1)
+        deleted = database.delete_transacciones_replica(list(before))
+        if before:
+            alert_engine.invalidate()
+        return {"deleted": deleted}, touched
+
+    propios = database.get_outbox_claves([item.get("external_id") for item in items])
+    aplicar, nuevos = [], []
+    for item in items:
+        tabla, row = directus_sync.to_local_row(item)
+        old = before.get(row["directus_id"])
+        touched.append(row)
+        if old is None and item.get("external_id") in propios:
+            continue  # Escritura propia aún sin enlazar: el outbox ya la registró
+        if old is not None and action == "create":
+            continue  # Escritura propia ya enlazada (o create repetido): la fila ya está en la réplica
+        aplicar.append(item)
+        if old:
+            _ledger(old, -1)
+        if tabla == "gastos":
+            _ledger(row, +1)
+            if old is None:
+                nuevos.append(row)
+
+    applied = directus_sync.apply_items(aplicar)
+    if len(nuevos) < len(aplicar):
+        alert_engine.invalidate()  # Filas modificadas: la ventana se recarga desde SQLite
+    for row in nuevos:
+        category_classifier.learn(row["categoria"], row["concepto"])
+        alert_engine.on_transaction(row)
+    query_engine.invalidate()
+    return {"applied": applied, "new": len(nuevos), "own": len(items) - len(aplicar)}, touched
+
+
+# ==================== CATEGORÍAS, AHORROS Y DEUDAS ====================
+
+def _apply_categories(action: str, keys: list, payload: dict) -> dict:
+    directus_manager.forget_categories()
+    query_engine.invalidate()
+    alert_engine.invalidate(budgets=True)
+    limits = 0
+    if action != "delete" and (action == "create" or "budget" in payload or "name" in payload):
+        items = (
+            directus_manager._instance.query("categories").where("id", keys, "_in")
+            .fields("id", "name", "budget").limit(len(keys)).all()
+        )
+        for item in items:
+            if item.get("name"):
+                budget_ledger.set_limit(item["name"], float(item.get("budget") or 0))
+                limits += 1
+    return {"categories": len(keys), "limits": limits}
+
+
+def _apply_savings(action: str, keys: list, payload: dict) -> dict:
+    webapp_api.invalidate(savings=True)
+    return {"savings": len(keys)}
+
+
+def _apply_debts(action: str, keys: list, payload: dict) -> dict:
+    # Las deudas se leen de Directus al usarse (/deudas, recordatorio diario): nada en caché
+    return {"debts": len(keys)}
+
+
+# ==================== API ====================
+
+def apply_event(raw: dict) -> dict:
+    """Aplica un evento. Idempotente: repetirlo no altera réplica ni ledger."""
+    collection, action, keys, payload = parse_event(raw)
+    if action not in ACTIONS or not keys:
+        return {"ignored": True}
+    if collection == "transactions":
+        result = _apply_transactions(action, keys)
+        webapp_api.invalidate()
+        return result
+    if collection == "categories":
+        return _apply_categories(action, keys, payload)
+    if collection == "savings":
+        return _apply_savings(action, keys, payload)
+    if collection == "debts":
+        return _apply_debts(action, keys, payload)
+    return {"ignored": True}
+
+
+def handle(events) -> dict:
+    """Aplica uno o varios eventos en orden. Bloqueante: usar en hilo."""
+    events = events if isinstance(events, list) else [events]
+    started = time.monotonic()
+    applied = ignored = errors = 0
+    with _lock:
+        for raw in events:
+            _stats["received"] += 1
+            try:
+                if not isinstance(raw, dict) or apply_event(raw).get("ignored"):
+                    ignored += 1
+                else:
+                    applied += 1
+            except Exception as e:
+                errors += 1
+                logger.error(f"Error aplicando evento de Directus {raw.get('event') if isinstance(raw, dict) else raw!r}: {e}")
+    _stats["applied"] += applied
+    _stats["ignored"] += ignored
+    _stats["errors"] += errors
+    _stats["last_ms"] = round((time.monotonic() - started) * 1000)
+    _stats["last_event_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logger.info(f"Eventos Directus: {applied} aplicados, {ignored} ignorados, {errors} con error en {_stats['last_ms']} ms")
+    return {"applied": applied, "ignored": ignored, "errors": errors}
+
+
+def get_metrics() -> dict:
+    return dict(_stats)
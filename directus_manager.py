@@ -1,11 +1,32 @@
 import requests
 import logging
+import time
 from datetime import datetime
-import json as SimpleJSON
+from urllib3.exceptions import NewConnectionError
 from config import DIRECTUS_URL, DIRECTUS_TOKEN, DIRECTUS_ORG_ID
+import database  # SQLite local
+import rate_index
+import analytics
+from directus_pager import iter_keyset
+from directus_query import DirectusQuery
 
 logger = logging.getLogger(__name__)
 
+
+class UnconfirmedWriteError(RuntimeError):
+    """Lote enviado sin external_id cuya respuesta no llegó: reenviarlo podría duplicarlo."""
+
+
+def _request_sent(error: Exception) -> bool:
+    """False solo si la conexión ni siquiera se estableció (DNS, rechazo, timeout de conexión)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return False
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = error.args[0] if error.args else None
+        return not isinstance(getattr(reason, "reason", reason), NewConnectionError)
+    return True
+
+
 class DirectusManager:
     def __init__(self):
         self.base_url = DIRECTUS_URL.rstrip('/')
@@ -14,25 +35,50 @@ class DirectusManager:
             "Content-Type": "application/json"
         }
         self.org_id = DIRECTUS_ORG_ID
+        self._category_ids = {}  # nombre (minúsculas) -> id, para no consultar en cada escritura
 
     def _get_headers(self):
         return self.headers
 
-    def get_exchange_rate(self) -> float:
-        # Placeholder: fetch from settings collection or hardcoded
-        return 36.5 
+    def query(self, collection: str, scoped: bool = True) -> DirectusQuery:
+        """Consulta sobre una colección; `scoped` filtra por la organización del bot."""
+        q = DirectusQuery(self.base_url, self._get_headers(), collection)
+        return q.where("organization", self.org_id) if scoped else q
+
+    DEFAULT_RATE = 36.5
+
+    def get_exchange_rate(self, fecha=None) -> float:
+        # Tasa vigente en la fecha según la fuente activa (índice en memoria, sin I/O)
+        source = self.get_rate_source()
+        manual = float(database.get_config("TASA_USD", self.DEFAULT_RATE))
+        if source in ["BCV", "PARALELO"]:
+            return rate_index.get_rate(fecha, source) or manual
+        return manual
+
+    def set_exchange_rate(self, rate: float, source: str = "MANUAL", bcv: float = 0, paralelo: float = 0) -> tuple[bool, str]:
+        try:
+            database.set_config("TASA_USD", rate)
+            database.set_config("TASA_SOURCE", source)
+            today = datetime.now()
+            if bcv > 0: rate_index.add_point("BCV", today, bcv)
+            if paralelo > 0: rate_index.add_point("PARALELO", today, paralelo)
+            return True, "OK"
+        except Exception as e:
+            logger.error(f"Error setting exchange rate: {e}")
+            return False, str(e)
+
+    def to_usd(self, data: dict) -> tuple[float, float]:
+        """(monto_usd, tasa_usada) con la tasa vigente en la fecha de la transacción."""
+        fecha = data.get("fecha") or datetime.now().strftime("%Y-%m-%d")
+        return rate_index.to_usd(
+            data.get("monto", 0), data.get("moneda", "Bs"), fecha,
+            self.get_rate_source(), fallback=self.get_exchange_rate(fecha)
+        )
 
     def get_categories(self) -> list:
         try:
-            response = requests.get(
-                f"{self.base_url}/items/categories",
-                headers=self._get_headers(),
-                params={"filter[organization][_eq]": self.org_id, "fields": "name"}
-            )
-            if response.status_code == 200:
-                data = response.json().get('data', [])
-                return [item['name'] for item in data]
-            return []
+            data = self.query("categories").fields("name").sort("name").limit(-1).all()
+            return [item['name'] for item in data]
         except Exception as e:
             logger.error(f"Error fetching categories: {e}")
             return []
@@ -59,17 +105,21 @@ class DirectusManager:
             logger.error(f"Error adding category: {e}")
             return False
 
+    def _build_payload(self, data: dict, monto_usd: float, image_link: str = "", is_income: bool = False) -> dict:
+        return {
+            "date": data.get("fecha", datetime.now().strftime("%Y-%m-%d")),
+            "amount": monto_usd,
+            "concept": data.get("concepto", ""),
+            "type": "income" if is_income else "expense",
+            "category": None, 
+            "organization": self.org_id,
+            "receipt_image": image_link 
+        }
+
     def add_transaction(self, data: dict, user: str, image_link: str = "", is_income: bool = False) -> tuple[bool, str]:
         try:
-            payload = {
-                "date": data.get("fecha", datetime.now().strftime("%Y-%m-%d")),
-                "amount": float(data.get("monto", 0)),
-                "concept": data.get("concepto", ""),
-                "type": "income" if is_income else "expense",
-                "category": None, 
-                "organization": self.org_id,
-                "receipt_image": image_link 
-            }
+            monto_usd, _ = self.to_usd(data)
+            payload = self._build_payload(data, monto_usd, image_link, is_income)
 
             # Extended fields for expenses
             if not is_income:
@@ -89,6 +139,21 @@ class DirectusManager:
             )
             
             if response.status_code in [200, 204]:
+                # Reflejar de inmediato en la réplica local (no esperar al próximo sync)
+                try:
+                    import directus_sync
+                    created = response.json().get("data") or {}
+                    if created.get("id"):
+                        tabla, row = directus_sync.to_local_row({**created, "category": {"name": cat_name}})
+                        row.update(
+                            monto_original=float(data.get("monto", 0)),
+                            moneda=data.get("moneda", "Bs"),
+                            referencia=data.get("referencia") or None,
+                            responsable=user
+                        )
+                        database.upsert_transacciones_replica(tabla, [row])
+                except Exception as db_err:
+                    logger.warning(f"Error sync SQLite (no crítico): {db_err}")
                 return True, "OK"
             else:
                 return False, f"API Error: {response.text}"
@@ -97,32 +162,150 @@ class DirectusManager:
             logger.error(f"Error adding transaction: {e}")
             return False, str(e)
 
+    def add_transactions_batch(self, entries: list) -> dict:
+        """
+        Envío en lote desde el outbox. entries: [{"key": str, "payload": dict, "categoria": str}]
+        Idempotente: las claves que ya existen en Directus (external_id) no se reenvían.
+        Retorna {key: directus_id | Exception}.
+        """
+        if not entries: return {}
+        has_key_field = self.ensure_schema()
+        results = {}
+
+        if has_key_field:
+            existing = (
+                self.query("transactions", scoped=False)
+                .where("external_id", [e["key"] for e in entries], "_in")
+                .fields("id", "external_id").limit(len(entries)).all()
+            )
+            for item in existing:
+                results[item["external_id"]] = item["id"]
+
+        pending = [e for e in entries if e["key"] not in results]
+        cat_ids = {}
+        payloads = []
+        for e in pending:
+            cat = e.get("categoria") or "Otros"
+            if cat not in cat_ids:
+                cat_ids[cat] = self._get_category_id(cat)
+            payload = {**e["payload"], "category": cat_ids[cat]}
+            if has_key_field:
+                payload["external_id"] = e["key"]
+            payloads.append(payload)
+
+        if payloads:
+            try:
+                response = requests.post(
+                    f"{self.base_url}/items/transactions",
+                    headers=self._get_headers(),
+                    json=payloads,
+                    timeout=60
+                )
+                created = (response.json().get("data") or []) if response.status_code in [200, 204] else None
+            except Exception as e:
+                # Cualquier fallo con la petición ya enviada (timeout de lectura, conexión
+                # cortada, respuesta ilegible): sin external_id no se sabe si se guardó
+                if not has_key_field and _request_sent(e):
+                    raise UnconfirmedWriteError(f"Lote sin confirmación: {e}") from e
+                raise
+            if created is not None:
+                for e, item in zip(pending, created):
+                    results[e["key"]] = item.get("id")
+            elif len(pending) > 1 and 400 <= response.status_code < 500:
+                # Un item inválido rechaza todo el lote: reintentar uno a uno para aislarlo
+                for e in pending:
+                    try:
+                        results.update(self.add_transactions_batch([e]))
+                    except Exception as item_err:
+                        results[e["key"]] = item_err
+            elif response.status_code >= 500 and not has_key_field:
+                raise UnconfirmedWriteError(f"API Error {response.status_code}: {response.text[:200]}")
+            else:
+                raise RuntimeError(f"API Error {response.status_code}: {response.text[:200]}")
+
+        return results
+
     def _get_category_id(self, name):
+        cached = self._category_ids.get(str(name).lower())
+        if cached: return cached
+        cat_id = self._fetch_category_id(name)
+        if cat_id: self._category_ids[str(name).lower()] = cat_id
+        return cat_id
+
+    def forget_categories(self):
+        """Vacía la caché nombre -> id (categoría renombrada o borrada en Directus)."""
+        self._category_ids.clear()
+
+    def _fetch_category_id(self, name):
         try:
-            response = requests.get(
-                f"{self.base_url}/items/categories",
-                headers=self._get_headers(),
-                params={"filter[name][_eq]": name, "fields": "id"}
-            )
-            data = response.json().get('data', [])
-            if data: return data[0]['id']
+            lookup = lambda: self.query("categories", scoped=False).where("name", name).fields("id").first()
+            item = lookup()
+            if item: return item['id']
             # Auto-create
             self.add_category(name)
             # Retry
-            response = requests.get(
-                f"{self.base_url}/items/categories",
-                headers=self._get_headers(),
-                params={"filter[name][_eq]": name, "fields": "id"}
-            )
-            data = response.json().get('data', [])
-            return data[0]['id'] if data else None
+            item = lookup()
+            return item['id'] if item else None
         except: return None
 
+    _schema_ok = None            # Solo respuestas definitivas; None = volver a consultar
+    _schema_checked_at = 0.0
+    SCHEMA_RETRY_S = 300         # Tras un error transitorio, reintentar la verificación
+
     def ensure_schema(self):
-        # Placeholder for schema creation logic
-        pass
+        """
+        Crea (una vez por proceso) el campo external_id usado como clave de idempotencia.
+        True/False si la respuesta fue definitiva; None tras un error transitorio
+        (5xx, red), que no se cachea: se reintenta pasado SCHEMA_RETRY_S.
+        """
+        if self._schema_ok is not None: return self._schema_ok
+        if time.time() - self._schema_checked_at < self.SCHEMA_RETRY_S: return None
+        self._schema_checked_at = time.time()
+        try:
+            response = requests.get(f"{self.base_url}/fields/transactions/external_id", headers=self._get_headers(), timeout=15)
+            if response.status_code in [403, 404]:  # Directus responde 403 si el campo no existe
+                response = requests.post(
+                    f"{self.base_url}/fields/transactions",
+                    headers=self._get_headers(),
+                    json={
+                        "field": "external_id",
+                        "type": "string",
+                        "schema": {"is_unique": True, "is_nullable": True},
+                        "meta": {"hidden": True, "readonly": True, "note": "Clave de idempotencia del bot"}
+                    },
+                    timeout=15
+                )
+                if response.status_code in [400, 403]:  # Sin permisos sobre el esquema: respuesta definitiva
+                    self._schema_ok = False
+            if response.status_code in [200, 204]:
+                self._schema_ok = True
+            if not self._schema_ok:
+                logger.warning(f"Sin transactions.external_id (idempotencia desactivada): {response.status_code}")
+        except Exception as e:
+            logger.warning(f"Error verificando esquema de transactions: {e}")
+        return self._schema_ok
+
+    _own_user_id = None
+    _own_user_checked_at = 0.0
+
+    def own_user_id(self):
+        """
+        Id del usuario del token (el bot), cacheado. Sus filas ya llevan el responsable
+        de Telegram; None si aún no se pudo consultar (reintento pasado SCHEMA_RETRY_S).
+        """
+        if self._own_user_id is not None: return self._own_user_id
+        if time.time() - self._own_user_checked_at < self.SCHEMA_RETRY_S: return None
+        self._own_user_checked_at = time.time()
+        try:
+            response = requests.get(f"{self.base_url}/users/me", headers=self._get_headers(), params={"fields": "id"}, timeout=15)
+            response.raise_for_status()
+            self._own_user_id = (response.json().get("data") or {}).get("id")
+        except Exception as e:
+            logger.warning(f"No se pudo leer el usuario del token de Directus: {e}")
+        return self._own_user_id
 
-    def get_monthly_summary(self, year: int = None, month: int = None) -> dict:
+    def get_monthly_summary(self, year: int = None, month: int = None, strict: bool = False) -> dict:
+        """strict=True (snapshots de cierre): un detalle incompleto retorna None en lugar de un resumen parcial."""
         try:
             if not year: year = datetime.now().year
             if not month: month = datetime.now().month
@@ -133,103 +316,70 @@ class DirectusManager:
             else:
                 end_date = f"{year}-{month+1:02d}-01"
             
-            base_filter = {
+            expenses_filter = {
                 "organization": {"_eq": self.org_id},
-                "date": {"_gte": start_date, "_lt": end_date}
+                "date": {"_gte": start_date, "_lt": end_date},
+                "type": {"_eq": "expense"}
             }
             
-            # Expenses
-            expenses_filter = base_filter.copy()
-            expenses_filter["type"] = {"_eq": "expense"}
-            
-            # Incomes
-            incomes_filter = base_filter.copy()
-            incomes_filter["type"] = {"_eq": "income"}
-            
-            # Aggregate Expenses
-            r_exp = requests.get(
-                f"{self.base_url}/items/transactions",
-                headers=self._get_headers(),
-                params={
-                    "filter": SimpleJSON.dumps(expenses_filter),
-                    "aggregate[sum]": "amount",
-                    "aggregate[count]": "*"
-                }
-            )
-            exp_data = r_exp.json()['data'][0] if r_exp.status_code == 200 else {}
-            total_usd = float(exp_data.get('sum', {}).get('amount') or 0)
-            count = int(exp_data.get('count') or 0)
-
-            # Aggregate Incomes
-            r_inc = requests.get(
-                f"{self.base_url}/items/transactions",
-                headers=self._get_headers(),
-                params={
-                    "filter": SimpleJSON.dumps(incomes_filter),
-                    "aggregate[sum]": "amount"
-                }
-            )
-            inc_data = r_inc.json()['data'][0] if r_inc.status_code == 200 else {}
-            total_ingresos = float(inc_data.get('sum', {}).get('amount') or 0)
-
-            # Details for Trend & Category
-            r_details = requests.get(
-                f"{self.base_url}/items/transactions",
-                headers=self._get_headers(),
-                params={
-                    "filter": SimpleJSON.dumps(expenses_filter),
-                    "fields": "date,amount,category.name,concept",
-                    "limit": -1
-                }
-            )
-            
-            by_category = {}
-            daily_trend = []
-            all_expenses = []
-            
-            if r_details.status_code == 200:
-                rows = r_details.json()['data']
-                daily_map = {}
-                
-                for row in rows:
-                    amt = float(row.get('amount') or 0)
-                    cat = row.get('category')
-                    cat_name = cat.get('name') if cat else 'Otros'
-                    concept = row.get('concept', 'Sin concepto')
-                    date = row.get('date')
-
-                    # Category Aggregation
-                    by_category[cat_name] = by_category.get(cat_name, 0) + amt
-                    
-                    # Daily Aggregation
-                    daily_map[date] = daily_map.get(date, 0) + amt
-                    
-                    # All Expenses for Top 5
-                    all_expenses.append({
-                        "Fecha": date,
-                        "Concepto": concept,
-                        "Monto USD": amt,
-                        "Categoria": cat_name
-                    })
-                
-                for date in sorted(daily_map.keys()):
-                    daily_trend.append({"Fecha": date, "Monto USD": daily_map[date]})
-
-            return {
-                "total_usd": total_usd,
-                "total_ingresos": total_ingresos,
-                "by_category": by_category,
-                "daily_trend": daily_trend,
-                "all_expenses": all_expenses,
-                "count": count,
-                "year": year,
-                "month": month
+            # Totales de gastos e ingresos en una sola consulta agregada (groupBy type)
+            totals = {
+                row.get('type'): row for row in
+                self.query("transactions")
+                .where("date", start_date, "_gte").where("date", end_date, "_lt")
+                .where("type", ["expense", "income"], "_in")
+                .aggregate("sum", "amount").aggregate("count", "*").group_by("type").all()
             }
+            exp_data, inc_data = totals.get("expense", {}), totals.get("income", {})
+            total_usd = float((exp_data.get('sum') or {}).get('amount') or 0)
+            count = exp_data.get('count') or 0
+            count = int(next(iter(count.values()), 0) if isinstance(count, dict) else count)
+            total_ingresos = float((inc_data.get('sum') or {}).get('amount') or 0)
+
+            # Details for Trend & Category (streaming por páginas keyset -> columnas)
+            rows = self.iter_items("transactions", expenses_filter, self.SUMMARY_FIELDS)
+            return self.build_summary(year, month, total_usd, count, total_ingresos, rows, strict)
 
         except Exception as e:
             logger.error(f"Error getting summary: {e}")
             return None
 
+    SUMMARY_FIELDS = "date,amount,category.name,concept"
+
+    @staticmethod
+    def build_summary(year: int, month: int, total_usd: float, count: int, total_ingresos: float, rows, strict: bool = False) -> dict:
+        """
+        Resumen mensual (formato de get_monthly_summary) a partir de totales y filas de gastos (SUMMARY_FIELDS).
+        Con strict=True un error de paginación o un detalle que no cuadra con el conteo lanza excepción.
+        """
+        fechas, montos, categorias, conceptos = [], [], [], []
+        try:
+            for row in rows:
+                cat = row.get('category')
+                fechas.append(row.get('date'))
+                montos.append(row.get('amount') or 0)
+                categorias.append(cat.get('name') if cat else 'Otros')
+                conceptos.append(row.get('concept') or 'Sin concepto')
+        except Exception as e:
+            if strict: raise
+            logger.warning(f"Detalle de gastos incompleto: {e}")
+        if strict and len(fechas) != count:
+            raise RuntimeError(f"Detalle de gastos incompleto: {len(fechas)} de {count} filas")
+        
+        # Un solo frame tipado para todas las agregaciones y gráficos
+        frame = analytics.build_frame(fechas, montos, categorias, conceptos)
+
+        return {
+            "total_usd": total_usd,
+            "total_ingresos": total_ingresos,
+            "by_category": analytics.by_category(frame),
+            "daily_trend": analytics.daily_trend_records(frame),
+            "frame": frame,
+            "count": count,
+            "year": year,
+            "month": month
+        }
+
     # --- BUDGETS ---
     def set_budget(self, category: str, amount: float) -> bool:
         try:
@@ -244,51 +394,32 @@ class DirectusManager:
                     headers=self._get_headers(),
                     json={"budget": amount}
                 )
-                return r.status_code in [200, 204]
+                if r.status_code in [200, 204]:
+                    import budget_ledger
+                    budget_ledger.set_limit(category, amount)
+                    return True
+                return False
             return False
         except: return False
 
     def get_all_budgets(self) -> dict:
         try:
-            r = requests.get(
-                f"{self.base_url}/items/categories",
-                headers=self._get_headers(),
-                params={
-                    "filter[organization][_eq]": self.org_id,
-                    "filter[budget][_gt]": 0,
-                    "fields": "name,budget"
-                }
-            )
-            data = r.json().get('data', [])
+            data = self.query("categories").where("budget", 0, "_gt").fields("name", "budget").limit(-1).all()
             return {item['name']: float(item['budget']) for item in data}
         except: return {}
 
     def check_budget_alert(self, category: str) -> dict:
-        try:
-            budgets = self.get_all_budgets()
-            limit = budgets.get(category, 0)
-            if limit <= 0: return None
-            summary = self.get_monthly_summary()
-            spent = summary['by_category'].get(category, 0)
-            pct = (spent / limit) * 100
-            return {
-                "limit": limit, "spent": spent, "pct": pct,
-                "alert": "red" if pct >= 100 else "yellow" if pct >= 80 else "green"
-            }
-        except: return None
+        """Lectura O(1) del ledger local; budget_ledger.reconcile lo concilia con Directus."""
+        import budget_ledger
+        return budget_ledger.check(category)
 
     # --- SAVINGS ---
     def set_savings_goal(self, name: str, amount: float) -> bool:
         try:
-            r = requests.get(
-                f"{self.base_url}/items/savings",
-                headers=self._get_headers(),
-                params={"filter[name][_eq]": name, "filter[organization][_eq]": self.org_id}
-            )
-            data = r.json().get('data', [])
+            item = self.query("savings").where("name", name).fields("id").first()
             payload = {"name": name, "target_amount": amount, "organization": self.org_id}
-            if data:
-                rid = data[0]['id']
+            if item:
+                rid = item['id']
                 requests.patch(f"{self.base_url}/items/savings/{rid}", headers=self._get_headers(), json=payload)
             else:
                 payload["current_amount"] = 0
@@ -298,37 +429,31 @@ class DirectusManager:
 
     def get_savings(self) -> list:
         try:
-            r = requests.get(
-                f"{self.base_url}/items/savings",
-                headers=self._get_headers(),
-                params={"filter[organization][_eq]": self.org_id}
+            data = (
+                self.query("savings")
+                .fields("name", "target_amount", "current_amount", "date_updated", "date_created")
+                .sort("name").limit(-1).all()
             )
-            data = r.json().get('data', [])
-            res = []
-            for item in data:
-                tgt = float(item.get('target_amount', 0))
-                cur = float(item.get('current_amount', 0))
-                pct = (cur / tgt * 100) if tgt > 0 else 0
-                res.append({
-                    "Meta": item.get('name'),
-                    "Objetivo USD": tgt,
-                    "Ahorrado Actual": cur,
-                    "Porcentaje": f"{pct:.1f}%",
-                    "Ultima Act": item.get('date_updated') or item.get('date_created')
-                })
-            return res
+            return [self.format_saving(item) for item in data]
         except: return []
 
+    @staticmethod
+    def format_saving(item: dict) -> dict:
+        tgt = float(item.get('target_amount') or 0)
+        cur = float(item.get('current_amount') or 0)
+        pct = (cur / tgt * 100) if tgt > 0 else 0
+        return {
+            "Meta": item.get('name'),
+            "Objetivo USD": tgt,
+            "Ahorrado Actual": cur,
+            "Porcentaje": f"{pct:.1f}%",
+            "Ultima Act": item.get('date_updated') or item.get('date_created')
+        }
+
     def add_savings(self, name: str, amount: float, user: str = "Desconocido") -> dict:
         try:
-            r = requests.get(
-                f"{self.base_url}/items/savings",
-                headers=self._get_headers(),
-                params={"filter[name][_eq]": name, "filter[organization][_eq]": self.org_id}
-            )
-            data = r.json().get('data', [])
-            if not data: return {"success": False}
-            item = data[0]
+            item = self.query("savings").where("name", name).fields("id", "target_amount", "current_amount").first()
+            if not item: return {"success": False}
             new_total = float(item.get('current_amount', 0)) + amount
             tgt = float(item.get('target_amount', 0))
             new_pct = (new_total / tgt * 100) if tgt > 0 else 0
@@ -347,26 +472,28 @@ class DirectusManager:
             return r.status_code in [200, 204]
         except: return False
 
-    def get_pending_debts(self) -> list:
+    def get_pending_debts(self, due_date: str = None) -> list:
+        """Deudas pendientes (solo las que vencen en `due_date` si se indica), por fecha de retorno."""
         try:
-            r = requests.get(
-                f"{self.base_url}/items/debts",
-                headers=self._get_headers(),
-                params={"filter[status][_eq]": "PENDIENTE", "filter[organization][_eq]": self.org_id}
-            )
-            return [{"Persona": d['person'], "Monto Préstamo": d['amount'], "Fecha Retorno": d['return_date'], "Estado": d['status']} for d in r.json().get('data', [])]
+            q = self.query("debts").where("status", "PENDIENTE")
+            if due_date:
+                q.where("return_date", due_date)
+            data = q.fields("person", "amount", "return_date", "status").sort("return_date").limit(-1).all()
+            return [self.format_debt(d) for d in data]
         except: return []
 
+    @staticmethod
+    def format_debt(d: dict) -> dict:
+        return {"Persona": d['person'], "Monto Préstamo": d['amount'], "Fecha Retorno": d['return_date'], "Estado": d['status']}
+
     def mark_debt_as_paid(self, name: str) -> bool:
         try:
-            r = requests.get(
-                f"{self.base_url}/items/debts",
-                headers=self._get_headers(),
-                params={"filter[person][_eq]": name, "filter[status][_eq]": "PENDIENTE", "filter[organization][_eq]": self.org_id}
+            item = (
+                self.query("debts").where("person", name).where("status", "PENDIENTE")
+                .fields("id").sort("return_date").first()
             )
-            data = r.json().get('data', [])
-            if not data: return False
-            requests.patch(f"{self.base_url}/items/debts/{data[0]['id']}", headers=self._get_headers(), json={"status": "PAGADO"})
+            if not item: return False
+            requests.patch(f"{self.base_url}/items/debts/{item['id']}", headers=self._get_headers(), json={"status": "PAGADO"})
             return True
         except: return False
 
@@ -379,51 +506,79 @@ class DirectusManager:
         except: return False
 
     def check_recurring(self) -> list:
+        """Pagos recurrentes activos que tocan hoy (mismo formato {row, data} que la versión de Sheets)."""
         try:
-            today_day = datetime.now().day
-            r = requests.get(
-                f"{self.base_url}/items/recurring",
-                headers=self._get_headers(),
-                params={"filter[active][_eq]": True, "filter[day][_eq]": today_day, "filter[organization][_eq]": self.org_id}
+            data = (
+                self.query("recurring").where("active", True).where("day", datetime.now().day)
+                .fields("id", "name", "amount", "day").limit(-1).all()
             )
-            # Need to filter logic in python for month check, omitted for brevity but should match
-            return [] 
+            return [{"row": r['id'], "data": {"Nombre": r['name'], "Monto": r['amount'], "Dia": r['day']}} for r in data]
         except: return []
     
     def mark_recurring_paid(self, row_id): pass
 
 
     # --- HELPERS FOR BOT REFACTOR ---
-    def get_rate_source(self): return "DIRECTUS"
+    def get_rate_source(self): return database.get_config("TASA_SOURCE", "BCV")
     def is_confirmation_required(self): return True
     def get_sheet_url(self): return f"{self.base_url}/admin/content/transactions"
     
+    PAGE_SIZE = 500
+    REPORT_FIELDS = "id,date,type,amount,concept,category.name,receipt_image"
+
+    def iter_items(self, collection: str, filter: dict = None, fields: str = "*", keys: tuple = ("date", "id"), page_size: int = PAGE_SIZE, prefetch: bool = True):
+        """Recorre una colección por páginas keyset (ver directus_pager). Lanza excepción si Directus falla."""
+        return iter_keyset(
+            f"{self.base_url}/items/{collection}", self._get_headers(),
+            filter=filter, fields=fields, keys=keys, page_size=page_size, prefetch=prefetch
+        )
+
+    def iter_transactions(self, start_date: str, end_date: str, record_type: str = None, fields: str = REPORT_FIELDS, page_size: int = PAGE_SIZE):
+        """Genera las transacciones con fecha en [start_date, end_date) página a página (memoria constante)."""
+        tx_filter = {
+            "organization": {"_eq": self.org_id},
+            "date": {"_gte": start_date, "_lt": end_date}
+        }
+        if record_type:
+            tx_filter["type"] = {"_eq": record_type}
+        return self.iter_items("transactions", tx_filter, fields, page_size=page_size)
+
     def get_monthly_records(self, record_type="expense"):
-        # For reporting
+        """Transacciones del mes en curso (campos del reporte), paginadas."""
         try:
-            r = requests.get(
-                f"{self.base_url}/items/transactions",
-                headers=self._get_headers(),
-                params={
-                    "filter[type][_eq]": record_type,
-                    "filter[organization][_eq]": self.org_id,
-                    "fields": "*.*",
-                    "limit": -1
-                }
-            )
-            return r.json().get('data', [])
+            now = datetime.now()
+            end = f"{now.year + 1}-01-01" if now.month == 12 else f"{now.year}-{now.month + 1:02d}-01"
+            return list(self.iter_transactions(f"{now.year}-{now.month:02d}-01", end, record_type))
         except: return []
 
+    def get_recent_transactions(self, record_type="expense", limit=30, fields=REPORT_FIELDS):
+        """Las `limit` transacciones más recientes, ordenadas y recortadas en el servidor."""
+        try:
+            return (
+                self.query("transactions").where("type", record_type)
+                .fields(*fields.split(",")).sort("-date", "-id").limit(limit).all()
+            )
+        except Exception as e:
+            logger.warning(f"No se pudieron leer transacciones recientes: {e}")
+            return []
+
 
 # Singleton instance
 _instance = DirectusManager()
 
 # Exports
-def get_exchange_rate(): return _instance.get_exchange_rate()
+def get_exchange_rate(fecha=None): return _instance.get_exchange_rate(fecha)
+def set_exchange_rate(rate, source="MANUAL", bcv=0, paralelo=0): return _instance.set_exchange_rate(rate, source, bcv, paralelo)
+def to_usd(data): return _instance.to_usd(data)
 def get_categories(): return _instance.get_categories()
 def add_category(name): return _instance.add_category(name)
+def forget_categories(): return _instance.forget_categories()
 def add_transaction(data, user, image_link="", is_income=False): return _instance.add_transaction(data, user, image_link, is_income)
-def get_monthly_summary(year=None, month=None): return _instance.get_monthly_summary(year, month)
+def add_transactions_batch(entries): return _instance.add_transactions_batch(entries)
+def ensure_schema(): return _instance.ensure_schema()
+def own_user_id(): return _instance.own_user_id()
+def build_payload(data, monto_usd, image_link="", is_income=False): return _instance._build_payload(data, monto_usd, image_link, is_income)
+def get_monthly_summary(year=None, month=None, strict=False): return _instance.get_monthly_summary(year, month, strict)
 def set_budget(cat, amt): return _instance.set_budget(cat, amt)
 def get_all_budgets(): return _instance.get_all_budgets()
 def check_budget_alert(cat): return _instance.check_budget_alert(cat)
@@ -432,7 +587,7 @@ def get_savings(): return _instance.get_savings()
 def add_savings(n, a, u=""): return _instance.add_savings(n, a, u)
 def set_milestones(n, h): return _instance.set_milestones(n, h)
 def add_debtor(n, a, d, u): return _instance.add_debtor(n, a, d, u)
-def get_pending_debts(): return _instance.get_pending_debts()
+def get_pending_debts(due_date=None): return _instance.get_pending_debts(due_date)
 def mark_debt_as_paid(n): return _instance.mark_debt_as_paid(n)
 def add_recurring(n, a, d): return _instance.add_recurring(n, a, d)
 def check_recurring(): return _instance.check_recurring()
@@ -441,3 +596,5 @@ def get_rate_source(): return _instance.get_rate_source()
 def is_confirmation_required(): return _instance.is_confirmation_required()
 def get_sheet_url(): return _instance.get_sheet_url()
 def get_monthly_records(type="expense"): return _instance.get_monthly_records(type)
+def get_recent_transactions(type="expense", limit=30, fields=DirectusManager.REPORT_FIELDS): return _instance.get_recent_transactions(type, limit, fields)
+def iter_transactions(start_date, end_date, record_type=None, fields=DirectusManager.REPORT_FIELDS): return _instance.iter_transactions(start_date, end_date, record_type, fields)
@@ -0,0 +1,83 @@
+"""
+Paginación keyset para colecciones de Directus
+Reemplaza las consultas con limit=-1: recorre la colección por páginas
+ordenadas por una clave compuesta (por defecto date, id), pidiendo cada
+página "después de la última fila vista" en lugar de usar offsets.
+Opcionalmente precarga la página siguiente mientras se consume la actual.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+DEFAULT_KEYS = ("date", "id")
+
+
+def _key_value(row: dict, key: str):
+    value = row.get(key)
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def _after(keys: tuple, last: dict) -> dict:
+    """
+    Filtro "fila > last" en orden lexicográfico de `keys`:
+    k0 > v0  OR  (k0 = v0 AND k1 > v1)  OR ...
+    """
+    branches = []
+    for i, key in enumerate(keys):
+        conds = [{k: {"_eq": last[k]}} for k in keys[:i]]
+        conds.append({key: {"_gt": last[key]}})
+        branches.append(conds[0] if len(conds) == 1 else {"_and": conds})
+    return branches[0] if len(branches) == 1 else {"_or": branches}
+
+
+def _with_keys(fields: str, keys: tuple) -> str:
+    """Asegura que los campos de la clave vengan en la respuesta."""
+    if not fields or fields == "*" or fields.startswith("*"):
+        return fields or "*"
+    parts = [f.strip() for f in fields.split(",") if f.strip()]
+    return ",".join(parts + [k for k in keys if k not in parts])
+
+
+def iter_keyset(url: str, headers: dict, filter: dict = None, fields: str = "*",
+                keys: tuple = DEFAULT_KEYS, page_size: int = PAGE_SIZE,
+                prefetch: bool = True, timeout: int = 30):
+    """
+    Genera las filas de `url` (ej: {base}/items/transactions o {base}/users)
+    en orden ascendente de `keys`. Las claves no deben ser nulas.
+    """
+    keys = tuple(keys)
+    params_base = {
+        "fields": _with_keys(fields, keys),
+        "sort": ",".join(keys),
+        "limit": page_size
+    }
+
+    def fetch(last):
+        conds = [c for c in (filter, _after(keys, last) if last else None) if c]
+        params = dict(params_base)
+        if conds:
+            params["filter"] = json.dumps(conds[0] if len(conds) == 1 else {"_and": conds})
+        r = requests.get(url, headers=headers, params=params, timeout=timeout)
+        r.raise_for_status()
+        return r.json().get("data", [])
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="directus-prefetch") if prefetch else None
+    try:
+        rows = fetch(None)
+        while rows:
+            more = len(rows) >= page_size
+            last = {k: _key_value(rows[-1], k) for k in keys}
+            # Pedir la siguiente página mientras el llamador procesa la actual
+            pending = pool.submit(fetch, last) if (more and pool) else None
+            yield from rows
+            if not more:
+                return
+            rows = pending.result() if pending else fetch(last)
+    finally:
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
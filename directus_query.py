@@ -0,0 +1,114 @@
+"""
+Constructor de consultas para la API REST de Directus
+Empuja la selección al servidor (filter, fields, sort, limit, aggregate,
+groupBy) para que el bot transfiera solo las filas y columnas que usa:
+
+    query = manager.query("debts").where("status", "PENDIENTE").where("return_date", hoy)
+    deudas = query.fields("person", "amount", "return_date").sort("return_date").all()
+
+Las colecciones grandes se recorren con .iter() (paginación keyset).
+"""
+import json
+import logging
+
+import requests
+
+from directus_pager import iter_keyset
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 30
+
+
+class DirectusQuery:
+    def __init__(self, base_url: str, headers: dict, collection: str, timeout: int = TIMEOUT):
+        self.url = f"{base_url}/items/{collection}"
+        self.headers = headers
+        self.timeout = timeout
+        self._conds = []
+        self._fields = None
+        self._sort = None
+        self._limit = None
+        self._aggregate = {}
+        self._group_by = None
+
+    # ---------- construcción (cada método retorna self) ----------
+
+    def where(self, field: str, value, op: str = "_eq") -> "DirectusQuery":
+        """Condición sobre un campo; 'category.name' se anida como relación."""
+        cond = {op: value}
+        for part in reversed(field.split(".")):
+            cond = {part: cond}
+        self._conds.append(cond)
+        return self
+
+    def filter(self, conds: dict) -> "DirectusQuery":
+        """Filtro Directus arbitrario (se combina con _and)."""
+        if conds:
+            self._conds.append(conds)
+        return self
+
+    def fields(self, *names: str) -> "DirectusQuery":
+        self._fields = ",".join(names)
+        return self
+
+    def sort(self, *keys: str) -> "DirectusQuery":
+        """Claves de orden; prefijo '-' para descendente."""
+        self._sort = ",".join(keys)
+        return self
+
+    def limit(self, n: int) -> "DirectusQuery":
+        self._limit = n
+        return self
+
+    def aggregate(self, func: str, field: str = "*") -> "DirectusQuery":
+        """sum, count, avg, min, max, countDistinct... (varios campos con varias llamadas)."""
+        current = self._aggregate.get(func)
+        self._aggregate[func] = f"{current},{field}" if current else field
+        return self
+
+    def group_by(self, *fields: str) -> "DirectusQuery":
+        self._group_by = ",".join(fields)
+        return self
+
+    # ---------- ejecución ----------
+
+    def _filter(self):
+        if not self._conds:
+            return None
+        return self._conds[0] if len(self._conds) == 1 else {"_and": list(self._conds)}
+
+    def params(self) -> dict:
+        params = {}
+        conds = self._filter()
+        if conds:
+            params["filter"] = json.dumps(conds)
+        if self._fields:
+            params["fields"] = self._fields
+        if self._sort:
+            params["sort"] = self._sort
+        if self._limit is not None:
+            params["limit"] = self._limit
+        for func, field in self._aggregate.items():
+            params[f"aggregate[{func}]"] = field
+        if self._group_by:
+            params["groupBy"] = self._group_by
+        return params
+
+    def all(self) -> list:
+        """Filas de la consulta. Lanza excepción si Directus responde con error."""
+        r = requests.get(self.url, headers=self.headers, params=self.params(), timeout=self.timeout)
+        r.raise_for_status()
+        return r.json().get("data", [])
+
+    def first(self):
+        self._limit = 1
+        rows = self.all()
+        return rows[0] if rows else None
+
+    def iter(self, keys: tuple = ("date", "id"), page_size: int = 500, prefetch: bool = True):
+        """Recorre todas las filas por páginas keyset (ignora sort/limit)."""
+        return iter_keyset(
+            self.url, self.headers, filter=self._filter(), fields=self._fields or "*",
+            keys=keys, page_size=page_size, prefetch=prefetch, timeout=self.timeout
+        )
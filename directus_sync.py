@@ -0,0 +1,119 @@
+"""
+Sincronización incremental Directus -> SQLite
+Directus sigue siendo la ruta de escritura; gastos/ingresos en SQLite son una
+réplica de lectura (upsert por directus_id) para /duplicar, /tag, /score y analíticas.
+"""
+import logging
+import threading
+from datetime import datetime
+
+import database  # SQLite local
+import directus_manager
+import webapp_api
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+WATERMARK_KEY = "SYNC_TRANSACTIONS_WATERMARK"
+SYNC_FIELDS = (
+    "id,date,amount,concept,type,category.name,receipt_image,date_created,date_updated,"
+    "user_created.id,user_created.first_name,user_created.email"
+)
+
+_lock = threading.Lock()  # Evita dos sincronizaciones simultáneas
+
+
+def _changed_at(item: dict) -> str:
+    return item.get("date_updated") or item.get("date_created") or ""
+
+
+def to_local_row(item: dict) -> tuple[str, dict]:
+    """Convierte un item de Directus a (tabla, fila de la réplica)."""
+    cat = item.get("category")
+    cat_name = cat.get("name") if isinstance(cat, dict) else None
+    amount = float(item.get("amount") or 0)
+    tabla = "ingresos" if item.get("type") == "income" else "gastos"
+    row = {
+        "directus_id": str(item["id"]),
+        "fecha": str(item.get("date") or "")[:10],
+        "concepto": item.get("concept") or "",
+        "monto_original": amount,
+        "moneda": "USD",
+        "monto_usd": amount,
+        "categoria": cat_name or ("General" if tabla == "ingresos" else "Otros"),
+        "updated_at": _changed_at(item),
+    }
+    if tabla == "gastos":
+        row["imagen_url"] = item.get("receipt_image") or None
+    # Creado desde la app o el admin: el usuario de Directus es el responsable
+    # (las filas del bot ya traen el de Telegram; sin el id del bot no se asigna)
+    creator = item.get("user_created")
+    own_id = directus_manager.own_user_id()
+    if isinstance(creator, dict) and own_id and creator.get("id") != own_id:
+        row["responsable"] = creator.get("first_name") or (creator.get("email") or "").split("@")[0] or None
+    return tabla, row
+
+
+def apply_items(items: list) -> int:
+    """Aplica a la réplica un lote de items de Directus (sync, escrituras propias o webhooks)."""
+    by_table = {"gastos": [], "ingresos": []}
+    for item in items:
+        try:
+            tabla, row = to_local_row(item)
+            by_table[tabla].append(row)
+        except Exception as e:
+            logger.warning(f"Item de Directus ignorado en réplica: {e}")
+    return sum(database.upsert_transacciones_replica(t, rows) for t, rows in by_table.items() if rows)
+
+
+def sync_transactions(full: bool = False) -> dict:
+    """
+    Trae de Directus las transacciones cambiadas desde la marca de agua
+    (date_updated/date_created) en lotes y las aplica con upsert.
+    full=True recorre todo y elimina localmente lo que ya no existe en Directus.
+    """
+    if not _lock.acquire(blocking=False):
+        return {"skipped": True}
+    try:
+        watermark = None if full else database.get_config(WATERMARK_KEY)
+        base_filter = {"organization": {"_eq": directus_manager._instance.org_id}}
+        if watermark:
+            # _gte: los upserts son idempotentes, así no se pierden cambios con el mismo timestamp
+            base_filter["_or"] = [
+                {"date_updated": {"_gte": watermark}},
+                {"date_created": {"_gte": watermark}}
+            ]
+
+        applied, new_watermark = 0, watermark
+        seen_ids = set()
+        batch = []
+        # Keyset por id: páginas acotadas aunque el historial crezca
+        for item in directus_manager._instance.iter_items("transactions", base_filter, SYNC_FIELDS, keys=("id",), page_size=BATCH_SIZE):
+            batch.append(item)
+            seen_ids.add(str(item["id"]))
+            changed = _changed_at(item)
+            if changed and (not new_watermark or changed > new_watermark):
+                new_watermark = changed
+            if len(batch) >= BATCH_SIZE:
+                applied += apply_items(batch)
+                batch = []
+        if batch:
+            applied += apply_items(batch)
+
+        deleted = 0
+        if full:
+            deleted = database.delete_transacciones_replica(database.get_replica_ids() - seen_ids)
+
+        if new_watermark and new_watermark != watermark:
+            database.set_config(WATERMARK_KEY, new_watermark)
+        if applied or deleted:
+            webapp_api.invalidate()
+
+        result = {"applied": applied, "deleted": deleted, "watermark": new_watermark, "synced_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        logger.info(f"Sync Directus -> SQLite: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Error sincronizando transacciones: {e}")
+        return {"error": str(e)}
+    finally:
+        _lock.release()
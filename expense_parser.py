@@ -0,0 +1,225 @@
+"""
+Parser local de gastos en texto (ruta rápida antes de Gemini)
+Gramática determinista en español para mensajes como "gasté 50 en comida",
+"20$ taxi" o "1.500 Bs mercado #viaje": resuelve monto, moneda, categoría,
+fecha (relativa o dd/mm[/aa]) y hashtags sin red. Un filtro de relevancia descarta la
+charla sin montos; solo los mensajes ambiguos llegan a Gemini.
+"""
+import os
+import re
+import unicodedata
+from datetime import datetime, timedelta
+
+from config import CATEGORIA_MAP
+
+MATCH = "match"          # Gasto reconocido localmente
+IGNORE = "ignore"        # Sin monto: no es un gasto (no se responde)
+AMBIGUOUS = "ambiguous"  # Tiene números pero no es concluyente: Gemini
+
+# Moneda cuando el mensaje no la indica; vacío (por defecto) = ambiguo, lo resuelve Gemini
+DEFAULT_CURRENCY = os.getenv("PARSER_DEFAULT_CURRENCY", "")
+
+CURRENCIES = {
+    "$": "USD", "usd": "USD", "us": "USD", "dolar": "USD", "dolares": "USD", "verdes": "USD",
+    "bs": "Bs", "bss": "Bs", "ves": "Bs", "bolivar": "Bs", "bolivares": "Bs", "bolos": "Bs",
+}
+FOREIGN = {"€", "eur", "euro", "euros", "cop", "pesos"}  # Monedas sin conversión local -> Gemini
+
+EXPENSE_VERBS = {
+    "gaste", "gasto", "gastamos", "pague", "pago", "pagamos", "compre", "compra", "compramos",
+    "costo", "salio", "cuesta", "gastado", "pagado", "comprado", "di", "dimos",
+}
+INCOME_WORDS = {"cobre", "cobramos", "cobro", "recibi", "recibimos", "ingreso", "sueldo", "salario", "pagaron", "depositaron"}
+
+# Palabras que, tras un número, indican que no es dinero
+NON_MONEY_UNITS = {
+    "min", "mins", "minuto", "minutos", "hora", "horas", "h", "hrs", "dia", "dias", "semana", "semanas",
+    "mes", "meses", "ano", "anos", "km", "kg", "kilos", "metros", "m", "veces", "vez", "personas",
+    "pm", "am", "%", "x", "gb", "mb",
+}
+
+# Palabra clave -> categoría (mismas claves que CATEGORIA_MAP / categoria_sugerida de Gemini)
+CATEGORY_KEYWORDS = {
+    "supermercado": {"supermercado", "mercado", "super", "abasto", "viveres", "bodegon", "automercado", "compras"},
+    "comida": {"comida", "almuerzo", "desayuno", "cena", "restaurant", "restaurante", "pizza", "hamburguesa",
+               "arepa", "arepas", "empanada", "empanadas", "cafe", "helado", "delivery", "pollo", "sushi", "perros"},
+    "transporte": {"transporte", "taxi", "uber", "yummy", "ridery", "gasolina", "pasaje", "pasajes", "bus",
+                   "metro", "estacionamiento", "peaje", "mototaxi", "carro", "mecanico", "aceite", "cauchos"},
+    "salud": {"salud", "farmacia", "medicina", "medicinas", "medico", "doctor", "consulta", "clinica",
+              "examenes", "laboratorio", "dentista", "odontologo", "pastillas"},
+    "hogar": {"hogar", "casa", "luz", "agua", "gas", "internet", "cantv", "condominio", "alquiler", "renta",
+              "aseo", "limpieza", "servicios", "electricidad", "telefono"},
+    "ropa": {"ropa", "zapatos", "camisa", "pantalon", "vestido", "peluqueria", "barberia", "corte"},
+    "tech": {"tech", "tecnologia", "celular", "telefono", "laptop", "computadora", "cargador", "audifonos",
+             "netflix", "spotify", "suscripcion", "datos", "saldo", "recarga"},
+    "entretenimiento": {"entretenimiento", "cine", "fiesta", "salida", "paseo", "playa", "juego", "juegos",
+                        "concierto", "rumba", "cervezas", "birras", "tragos"},
+    "diezmos": {"diezmo", "diezmos", "ofrenda", "ofrendas", "iglesia"},
+    "educacion": {"educacion", "colegio", "escuela", "universidad", "curso", "libros", "libro", "utiles",
+                  "matricula", "mensualidad", "clases"},
+    "regalos": {"regalo", "regalos", "cumpleanos", "detalle"},
+}
+KEYWORD_INDEX = {kw: cat for cat, kws in CATEGORY_KEYWORDS.items() for kw in kws}
+
+RELATIVE_DAYS = {"hoy": 0, "ayer": 1, "anteayer": 2, "antier": 2}
+MULTIPLIERS = {"k": 1_000, "mil": 1_000, "millon": 1_000_000, "millones": 1_000_000}
+
+# Monto: "1.500,50", "1,500.50", "25.50", "50", "100 mil", "2 millones de bs", precedido/seguido de moneda
+_NUMBER = r"\d{1,3}(?:[.,]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+_AMOUNT_RE = re.compile(
+    rf"(?P<pre>\$|€|\b(?:usd|bs|bss|ves)\.?)?\s*(?P<num>{_NUMBER})"
+    rf"(?:\s*(?P<mult>k|mil|millones|millon)\b(?:\s+de\b)?)?\s*(?P<post>\$|€|[a-zñ%]+\.?)?",
+    re.IGNORECASE
+)
+_HASHTAG_RE = re.compile(r"#(\w+)")
+_TIME_RE = re.compile(r"\b\d{1,2}:\d{2}\b|\ba las \d{1,2}\b")
+_DATE_RE = re.compile(r"\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b|\b\d{4}-\d{2}-\d{2}\b")
+_DIGIT_RE = re.compile(r"\d")
+
+
+def _fold(text: str) -> str:
+    """Minúsculas sin acentos (las tildes son opcionales en el chat). Conserva la longitud."""
+    return "".join(unicodedata.normalize("NFKD", c.lower())[0] if c.isalpha() else c for c in text)
+
+
+def parse_number(raw: str) -> float:
+    """Números en formato latino o anglosajón: '1.500' -> 1500, '25,5' -> 25.5, '1,500.50' -> 1500.5."""
+    if "." in raw and "," in raw:
+        decimal = "." if raw.rfind(".") > raw.rfind(",") else ","
+        thousands = "," if decimal == "." else "."
+        return float(raw.replace(thousands, "").replace(decimal, "."))
+    sep = "." if "." in raw else "," if "," in raw else None
+    if sep is None:
+        return float(raw)
+    if re.fullmatch(rf"\d{{1,3}}(?:\{sep}\d{{3}})+", raw):
+        return float(raw.replace(sep, ""))  # Separador de miles
+    return float(raw.replace(sep, "."))
+
+
+def _amount_candidates(folded: str) -> list:
+    """[(monto, moneda|None, inicio, fin)] descartando horas, fechas y unidades no monetarias."""
+    masked = _DATE_RE.sub(lambda m: " " * len(m.group()), _TIME_RE.sub(lambda m: " " * len(m.group()), folded))
+    masked = _HASHTAG_RE.sub(lambda m: " " * len(m.group()), masked)
+    found = []
+    for m in _AMOUNT_RE.finditer(masked):
+        pre = (m.group("pre") or "").rstrip(".")
+        post = (m.group("post") or "").rstrip(".")
+        if post in NON_MONEY_UNITS and not pre:
+            continue
+        if post in FOREIGN or pre in FOREIGN:
+            found.append((None, "FOREIGN", m.start(), m.end()))
+            continue
+        monto = parse_number(m.group("num")) * MULTIPLIERS.get((m.group("mult") or "").lower(), 1)
+        moneda = CURRENCIES.get(pre) or CURRENCIES.get(post)
+        # Sin moneda tras el número, la palabra siguiente es parte del concepto: recortar el match
+        end = m.end() if CURRENCIES.get(post) else m.end("mult") if m.group("mult") else m.end("num")
+        found.append((monto, moneda, m.start(), end))
+    return found
+
+
+def _parse_date(raw: str, today: datetime):
+    """'15/03', '15/03/26', '15/03/2026' o '2026-03-15'. Sin año: la última ocurrencia hasta hoy. None si no es válida."""
+    try:
+        if "-" in raw:
+            return datetime.strptime(raw, "%Y-%m-%d")
+        parts = [int(p) for p in raw.split("/")]
+        if len(parts) == 3:
+            year = parts[2] + 2000 if parts[2] < 100 else parts[2]
+            return datetime(year, parts[1], parts[0])
+        fecha = datetime(today.year, parts[1], parts[0])
+        return fecha if fecha.date() <= today.date() else fecha.replace(year=today.year - 1)
+    except ValueError:
+        return None
+
+
+def _category(words: list, hashtags: list) -> tuple:
+    """
+    (clave de categoría, explícita) por hashtag, 'en <palabra>' o palabra clave
+    (en ese orden). Solo las dos primeras las indicó el usuario.
+    """
+    for tag in hashtags:
+        if tag in KEYWORD_INDEX:
+            return KEYWORD_INDEX[tag], True
+    for i, word in enumerate(words[:-1]):
+        if word in ("en", "de", "para") and words[i + 1] in KEYWORD_INDEX:
+            return KEYWORD_INDEX[words[i + 1]], True
+    for word in words:
+        if word in KEYWORD_INDEX:
+            return KEYWORD_INDEX[word], False
+    return None, False
+
+
+def parse(text: str, today: datetime = None) -> dict:
+    """
+    Clasifica y, si es posible, extrae el gasto.
+    Retorna {"status": MATCH|IGNORE|AMBIGUOUS, "data": dict|None, "reason": str}.
+    `data` tiene la forma del JSON de Gemini (monto, moneda, fecha, concepto,
+    categoria_sugerida) más `categoria`, `categoria_explicita` y `etiquetas`.
+    """
+    text = (text or "").strip()
+    if not text or not _DIGIT_RE.search(text):
+        return {"status": IGNORE, "data": None, "reason": "sin números"}
+
+    folded = _fold(text)
+    candidates = _amount_candidates(folded)
+    if not candidates:
+        return {"status": IGNORE, "data": None, "reason": "sin montos"}
+
+    words = re.findall(r"[a-zñ]+", _HASHTAG_RE.sub(" ", folded))
+    hashtags = [_fold(t) for t in _HASHTAG_RE.findall(text)]
+    if any(c[1] == "FOREIGN" for c in candidates):
+        return {"status": AMBIGUOUS, "data": None, "reason": "moneda extranjera"}
+    if INCOME_WORDS & set(words):
+        return {"status": AMBIGUOUS, "data": None, "reason": "posible ingreso"}
+    if len(candidates) > 1:
+        # "compré 3 arepas por 6$": si solo uno lleva moneda, los demás son cantidades
+        with_currency = [c for c in candidates if c[1]]
+        if len(with_currency) != 1:
+            return {"status": AMBIGUOUS, "data": None, "reason": "varios montos"}
+        candidates = with_currency
+
+    monto, moneda, start, end = candidates[0]
+    moneda = moneda or DEFAULT_CURRENCY
+    if not moneda:
+        # "pagué 1.000 de luz": $1.000 o Bs 1.000 cambian el gasto por completo
+        return {"status": AMBIGUOUS, "data": None, "reason": "moneda no indicada"}
+    categoria, explicita = _category(words, hashtags)
+    # Señal mínima de que es un gasto: verbo de gasto o categoría reconocida
+    # (la moneda sola no basta: "tengo 50$ en el banco", "te debo 20$")
+    if monto <= 0 or not (EXPENSE_VERBS & set(words) or categoria):
+        return {"status": AMBIGUOUS, "data": None, "reason": "sin señales de gasto"}
+
+    today = today or datetime.now()
+    fechas = list(_DATE_RE.finditer(folded))
+    if len(fechas) > 1:
+        return {"status": AMBIGUOUS, "data": None, "reason": "varias fechas"}
+    if fechas:
+        fecha = _parse_date(fechas[0].group(), today)
+        if fecha is None:
+            return {"status": AMBIGUOUS, "data": None, "reason": "fecha no válida"}
+    else:
+        fecha = today - timedelta(days=next((RELATIVE_DAYS[w] for w in words if w in RELATIVE_DAYS), 0))
+
+    # Concepto: el texto original sin el monto, la fecha ni palabras de relleno
+    resto = text
+    for span_start, span_end in sorted([(start, end)] + [f.span() for f in fechas], reverse=True):
+        resto = resto[:span_start] + " " + resto[span_end:]
+    filler = EXPENSE_VERBS | set(RELATIVE_DAYS) | {"en", "de", "para", "por", "un", "una", "el", "la", "los", "las"}
+    concepto = " ".join(w for w in resto.split() if _fold(w).strip(".,;:!?") not in filler and not w.startswith("#"))
+    concepto = concepto.strip(" .,;:-") or (categoria or "Gasto").capitalize()
+
+    return {
+        "status": MATCH,
+        "reason": "gramática local",
+        "data": {
+            "tipo": "Efectivo",
+            "monto": round(monto, 2),
+            "moneda": moneda,
+            "fecha": fecha.strftime("%Y-%m-%d"),
+            "concepto": concepto,
+            "categoria_sugerida": categoria or "otros",
+            "categoria": CATEGORIA_MAP[categoria or "otros"],
+            "categoria_explicita": explicita,
+            "etiquetas": hashtags,
+        }
+    }
@@ -0,0 +1,87 @@
+"""
+Micro-lotes de extracciones de texto con Gemini
+Las extracciones que llegan casi a la vez (hora pico, varios chats) se
+agrupan hasta GEMINI_BATCH_MAX_WAIT_MS o GEMINI_BATCH_MAX_ITEMS y se envían
+como una sola petición que devuelve un arreglo JSON; cada handler recibe
+su resultado. La latencia añadida está acotada por la espera máxima.
+"""
+import asyncio
+import logging
+import time
+
+from config import GEMINI_BATCH_MAX_ITEMS, GEMINI_BATCH_MAX_WAIT_MS
+from gemini_analyzer import EXTRACTION_PROMPT, analyze_text, analyze_texts_batch
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiBatcher:
+    def __init__(self, max_wait_ms: int = GEMINI_BATCH_MAX_WAIT_MS, max_items: int = GEMINI_BATCH_MAX_ITEMS):
+        self.max_wait = max_wait_ms / 1000
+        self.max_items = max(1, max_items)
+        self._pending = []       # [(texto, future, encolado_at)]
+        self._timer = None
+        self._tasks = set()
+        self.stats = {"items": 0, "requests": 0, "batched_items": 0, "prompt_chars_saved": 0}
+        self._waits = []
+
+    async def extract(self, text: str) -> dict:
+        """Mismo resultado que analyze_text, compartiendo la llamada con otros chats."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.monotonic()))
+        self.stats["items"] += 1
+        if len(self._pending) >= self.max_items or self.max_wait <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        texts = [text for text, _, _ in batch]
+        started = time.monotonic()
+        self._waits.extend(started - queued_at for _, _, queued_at in batch)
+        del self._waits[:-200]
+        self.stats["requests"] += 1
+        try:
+            if len(texts) == 1:
+                results = [await asyncio.to_thread(analyze_text, texts[0])]
+            else:
+                self.stats["batched_items"] += len(texts)
+                self.stats["prompt_chars_saved"] += (len(texts) - 1) * len(EXTRACTION_PROMPT)
+                results = await asyncio.to_thread(analyze_texts_batch, texts)
+                logger.info(f"Lote Gemini: {len(texts)} textos en {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Error en lote Gemini: {e}")
+            results = [{"success": False, "error": f"Error al analizar texto: {e}"}] * len(texts)
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():  # El handler pudo haberse cancelado
+                future.set_result(result)
+
+    def get_metrics(self) -> dict:
+        items, requests = self.stats["items"], self.stats["requests"]
+        return {
+            **self.stats,
+            "pending": len(self._pending),
+            "items_per_request": round(items / requests, 2) if requests else 0.0,
+            "wait_avg_ms": round(sum(self._waits) / len(self._waits) * 1000) if self._waits else 0,
+        }
+
+
+_instance = GeminiBatcher()
+
+
+async def extract(text): return await _instance.extract(text)
+def get_metrics(): return _instance.get_metrics()
@@ -3,6 +3,8 @@ import json
 import sys
 import logging
 
+from directus_pager import iter_keyset
+
 # Configure logging to stdout
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', stream=sys.stdout)
 logger = logging.getLogger()
@@ -40,11 +42,7 @@ def main():
     # 1. Get Users
     log("Fetching users...")
     try:
-        r_users = requests.get(f"{URL}/users", headers=headers, params={"limit": -1, "fields": "id,email"})
-        if r_users.status_code != 200:
-             log(f"Users fetch error: {r_users.text}")
-             return
-        users = r_users.json()['data']
+        users = list(iter_keyset(f"{URL}/users", headers, fields="id,email", keys=("id",)))
         log(f"Found {len(users)} users.")
     except Exception as e:
         log(f"Error fetching users: {e}")
@@ -53,25 +51,22 @@ def main():
     # 2. Get Workspaces
     log("Fetching workspaces...")
     try:
-        r_ws = requests.get(f"{URL}/items/workspaces", headers=headers, params={"limit": -1, "fields": "id,user,name"})
-        if r_ws.status_code != 200:
-             log(f"Workspaces fetch error: {r_ws.text}")
-             return
-        workspaces = r_ws.json()['data']
-        log(f"Found {len(workspaces)} workspaces.")
+        # Solo se necesita el conjunto de usuarios con workspace: se consume en streaming
+        users_with_ws = set()
+        count = 0
+        for ws in iter_keyset(f"{URL}/items/workspaces", headers, fields="id,user", keys=("id",)):
+            count += 1
+            u_val = ws.get('user')
+            if isinstance(u_val, dict):
+                users_with_ws.add(u_val.get('id'))
+            elif u_val:
+                users_with_ws.add(u_val)
+        log(f"Found {count} workspaces.")
     except Exception as e:
         log(f"Error fetching workspaces: {e}")
         return
 
     # 3. Analyze
-    users_with_ws = set()
-    for ws in workspaces:
-        u_val = ws.get('user')
-        if isinstance(u_val, dict):
-            users_with_ws.add(u_val.get('id'))
-        elif u_val:
-            users_with_ws.add(u_val)
-
     missing_ws_users = [u for u in users if u['id'] not in users_with_ws]
     
     log(f"Users without workspace: {len(missing_ws_users)}")
@@ -0,0 +1,218 @@
+"""
+Enrutador de modelos Gemini
+Elige el modelo según el tipo de entrada y su tamaño, impone un presupuesto
+de latencia, lanza una petición de respaldo (hedge) al modelo alterno cuando
+el principal supera su p95 histórico y escala al modelo fuerte si el ligero
+devuelve campos incompletos. Registra decisiones y latencias de cola.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import google.generativeai as genai
+
+from config import GEMINI_LATENCY_BUDGET_S, GEMINI_MODEL_AUDIO, GEMINI_MODEL_LIGHT, GEMINI_MODEL_STRONG
+
+logger = logging.getLogger(__name__)
+
+LONG_TEXT_CHARS = 600               # Textos largos (estados de cuenta pegados) -> modelo fuerte
+LARGE_IMAGE_BYTES = 2 * 1024 * 1024  # Capturas grandes con varios comprobantes -> modelo fuerte
+HEDGE_MIN_S = 1.5                   # Nunca duplicar peticiones antes de esto
+HEDGE_DEFAULT_S = 6.0               # Espera antes del hedge mientras no hay historial
+MIN_SAMPLES = 20                    # Muestras necesarias para usar el p95 del modelo
+MIN_ESCALATE_S = 3.0                # Presupuesto restante mínimo para escalar
+LATENCY_WINDOW = 200
+WORKERS = 8
+
+
+class ModelRouter:
+    def __init__(self, budget_s: float = GEMINI_LATENCY_BUDGET_S):
+        self.budget = budget_s
+        self._pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="gemini")
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))  # modelo -> segundos
+        self._ttft = deque(maxlen=LATENCY_WINDOW)                           # streaming: tiempo al primer fragmento
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "escalations": 0, "timeouts": 0, "errors": 0}
+
+    # ---------- decisiones ----------
+
+    def route(self, kind: str, size: int = 0) -> tuple:
+        """(principal, respaldo) según el tipo de entrada ('text', 'batch', 'image', 'audio', 'chat') y su tamaño."""
+        if kind == "audio":
+            return GEMINI_MODEL_AUDIO, GEMINI_MODEL_STRONG
+        if (kind == "text" and size > LONG_TEXT_CHARS) or (kind == "image" and size > LARGE_IMAGE_BYTES):
+            return GEMINI_MODEL_STRONG, GEMINI_MODEL_LIGHT
+        return GEMINI_MODEL_LIGHT, GEMINI_MODEL_STRONG
+
+    def _p95(self, model: str):
+        with self._lock:
+            samples = sorted(self._latencies[model])
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+    def hedge_delay(self, model: str) -> float:
+        p95 = self._p95(model)
+        return max(HEDGE_MIN_S, p95 if p95 is not None else HEDGE_DEFAULT_S)
+
+    # ---------- ejecución ----------
+
+    def _call(self, model: str, contents, config):
+        t0 = time.monotonic()
+        response = genai.GenerativeModel(model).generate_content(
+            contents, generation_config=config, request_options={"timeout": self.budget}
+        )
+        with self._lock:
+            self._latencies[model].append(time.monotonic() - t0)
+        return response
+
+    def _parse(self, response, parse):
+        """
+        Aplica el parser del llamador; una respuesta no parseable cuenta como fallo.
+        Un resultado con "no_data" (respuesta válida sin datos, ej. texto sin gasto)
+        no es un fallo: se retorna tal cual, sin hedge ni escalado.
+        """
+        if parse is None:
+            return response.text
+        result = parse(response)
+        if not result.get("success") and not result.get("no_data"):
+            raise ValueError(result.get("error", "Respuesta no utilizable"))
+        return result
+
+    @staticmethod
+    def _abandon(futures):
+        """Cancela las peticiones aún en cola; las que ya corren terminan solas (timeout = presupuesto)."""
+        for future in futures:
+            future.cancel()
+
+    def generate(self, kind: str, contents, config=None, size: int = 0, parse=None, is_complete=None):
+        """
+        Ejecuta la petición con hedge y escalado. `parse(response)` convierte la
+        respuesta (por defecto se retorna response.text); `is_complete(result)`
+        decide si hay que escalar al modelo fuerte. Lanza TimeoutError si se
+        agota el presupuesto sin respuesta utilizable.
+        """
+        primary, fallback = self.route(kind, size)
+        started = time.monotonic()
+        deadline = started + self.budget
+        hedge_at = started + self.hedge_delay(primary)
+        futures = {self._pool.submit(self._call, primary, contents, config): primary}
+        pending = set(futures)
+        hedged = False
+        last_error = None
+        self.stats["requests"] += 1
+
+        def launch_fallback(reason: str):
+            nonlocal hedged
+            hedged = True
+            self.stats["hedges"] += 1
+            logger.info(f"Gemini {kind}: hedge a {fallback} ({reason}, {time.monotonic() - started:.1f}s)")
+            future = self._pool.submit(self._call, fallback, contents, config)
+            futures[future] = fallback
+            pending.add(future)
+
+        result = winner = None
+        while result is None:
+            now = time.monotonic()
+            if now >= deadline:
+                self.stats["timeouts"] += 1
+                self._abandon(pending)
+                raise TimeoutError(f"Gemini no respondió en {self.budget:.0f}s")
+            if not pending:
+                self.stats["errors"] += 1
+                raise last_error
+            timeout = deadline - now if hedged else min(deadline, hedge_at) - now
+            done, pending = wait(pending, timeout=max(0, timeout), return_when=FIRST_COMPLETED)
+            if not done:
+                if not hedged and time.monotonic() >= hedge_at:
+                    launch_fallback(f"p95 de {primary} superado")
+                continue
+            for future in done:
+                try:
+                    result, winner = self._parse(future.result(), parse), futures[future]
+                    break
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"Gemini {kind}: {futures[future]} falló: {e}")
+            if result is None and not hedged:
+                launch_fallback("error del principal")
+        # Las peticiones perdedoras ya en curso terminan en segundo plano (sus latencias alimentan el p95)
+        self._abandon(pending)
+
+        escalated = False
+        remaining = deadline - time.monotonic()
+        no_data = isinstance(result, dict) and result.get("no_data")
+        if (is_complete is not None and not no_data and not is_complete(result) and winner != GEMINI_MODEL_STRONG
+                and remaining > MIN_ESCALATE_S):
+            self.stats["escalations"] += 1
+            escalated = True
+            future = self._pool.submit(self._call, GEMINI_MODEL_STRONG, contents, config)
+            try:
+                strong = self._parse(future.result(timeout=remaining), parse)
+                if is_complete(strong):
+                    result, winner = strong, GEMINI_MODEL_STRONG
+            except Exception as e:
+                self._abandon([future])
+                logger.warning(f"Gemini {kind}: escalado a {GEMINI_MODEL_STRONG} fallido: {e}")
+
+        if winner != primary and not escalated:
+            self.stats["hedge_wins"] += 1
+        logger.info(
+            f"Gemini {kind} (size={size}): {winner} en {time.monotonic() - started:.2f}s "
+            f"[principal={primary}, hedge={hedged}, escalado={escalated}]"
+        )
+        return result
+
+    def stream(self, kind: str, contents, size: int = 0):
+        """
+        Generador de fragmentos de texto (API de streaming) con el modelo principal.
+        Sin hedge: lo visible es el tiempo al primer fragmento, que se registra.
+        """
+        model, _ = self.route(kind, size)
+        started = time.monotonic()
+        self.stats["requests"] += 1
+        response = genai.GenerativeModel(model).generate_content(
+            contents, stream=True, request_options={"timeout": self.budget}
+        )
+        first = None
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:  # Fragmento sin texto (ej. solo metadatos de seguridad)
+                continue
+            if first is None:
+                first = time.monotonic() - started
+                with self._lock:
+                    self._ttft.append(first)
+            yield text
+        logger.info(f"Gemini {kind} (stream): {model} primer fragmento {first or 0:.2f}s, total {time.monotonic() - started:.2f}s")
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            snapshot = {model: sorted(samples) for model, samples in self._latencies.items()}
+            ttft = sorted(self._ttft)
+        latencies = {
+            model: {
+                "n": len(s),
+                "p50_s": round(s[len(s) // 2], 2),
+                "p95_s": round(s[min(len(s) - 1, int(0.95 * len(s)))], 2),
+            }
+            for model, s in snapshot.items() if s
+        }
+        return {
+            **self.stats,
+            "latencies": latencies,
+            "ttft_p50_s": round(ttft[len(ttft) // 2], 2) if ttft else None,
+        }
+
+
+_instance = ModelRouter()
+
+
+def route(kind, size=0): return _instance.route(kind, size)
+def generate(kind, contents, config=None, size=0, parse=None, is_complete=None): return _instance.generate(kind, contents, config, size, parse, is_complete)
+def generate_text(prompt, kind="chat"): return _instance.generate(kind, prompt, size=len(prompt))
+def stream_text(prompt, kind="chat"): return _instance.stream(kind, prompt, size=len(prompt))
+def get_metrics(): return _instance.get_metrics()
@@ -0,0 +1,180 @@
+"""
+Cierre de mes
+Al cambiar de mes congela el mes terminado en un snapshot inmutable en SQLite
+(totales, categorías, serie diaria y mayores gastos) y pre-carga la
+configuración del mes nuevo. Las consultas históricas (/anos, /comparar)
+leen snapshots en lugar de recalcular desde Directus.
+"""
+import json
+import logging
+from datetime import datetime
+
+import analytics
+import database  # SQLite local
+import directus_manager
+from config import BACKEND
+
+logger = logging.getLogger(__name__)
+
+TOP_N = 10
+HISTORY_MONTHS = 12
+
+
+def periodo(year: int, month: int) -> str:
+    return f"{year}-{month:02d}"
+
+
+def previous(year: int, month: int) -> tuple[int, int]:
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def _month_range(year: int, month: int) -> tuple[str, str]:
+    end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    return f"{year}-{month:02d}-01", end
+
+
+def _is_closed(year: int, month: int) -> bool:
+    now = datetime.now()
+    return (year, month) < (now.year, now.month)
+
+
+# ==================== SNAPSHOTS ====================
+
+def build_snapshot(year: int, month: int) -> dict:
+    """Resumen del mes con el mismo formato que get_monthly_summary (sin el frame) + top de gastos."""
+    # strict: un snapshot es inmutable, nunca congelar un detalle parcial (el próximo cierre reintenta)
+    summary = directus_manager.get_monthly_summary(year, month, strict=True)
+    if summary is None:
+        raise RuntimeError(f"No se pudo leer el resumen de {periodo(year, month)}")
+    frame = summary.get("frame")
+    top = analytics.top_n(frame, TOP_N) if frame is not None else analytics.empty_frame()
+    return {
+        "year": year,
+        "month": month,
+        "total_usd": round(summary["total_usd"], 2),
+        "total_ingresos": round(summary["total_ingresos"], 2),
+        "count": summary["count"],
+        "by_category": {cat: round(v, 2) for cat, v in summary["by_category"].items()},
+        "daily_trend": summary["daily_trend"],
+        "top_expenses": [
+            {"Fecha": f"{r.fecha:%Y-%m-%d}", "Concepto": r.concepto, "Categoria": str(r.categoria), "Monto USD": round(r.monto, 2)}
+            for r in top.itertuples()
+        ],
+    }
+
+
+def _from_row(row: dict) -> dict:
+    snap = json.loads(row["datos"])
+    snap["closed_at"] = row["cerrado_at"]
+    return snap
+
+
+def get_snapshot(year: int, month: int) -> dict:
+    row = database.get_snapshots_mes([periodo(year, month)]).get(periodo(year, month))
+    return _from_row(row) if row else None
+
+
+def close_month(year: int, month: int, force: bool = False) -> dict:
+    """
+    Congela un mes terminado. Idempotente: si ya existe el snapshot se retorna
+    tal cual (force=True lo regenera, ej. tras importar gastos atrasados).
+    Si quedan gastos del mes en el outbox se aplaza el cierre (retorna None).
+    """
+    if not _is_closed(year, month):
+        raise ValueError(f"{periodo(year, month)} aún no ha terminado")
+    if not force:
+        existing = get_snapshot(year, month)
+        if existing:
+            return existing
+
+    start, end = _month_range(year, month)
+    if database.get_gastos_pendientes_por_categoria(start, end):
+        logger.info(f"Cierre de {periodo(year, month)} aplazado: hay gastos pendientes en el outbox")
+        return None
+
+    snap = build_snapshot(year, month)
+    database.save_snapshot_mes(
+        periodo(year, month), snap["total_usd"], snap["total_ingresos"], snap["count"],
+        json.dumps(snap, ensure_ascii=False), reemplazar=force
+    )
+    logger.info(f"Mes {periodo(year, month)} cerrado: ${snap['total_usd']:,.2f} en {snap['count']} gastos")
+    return get_snapshot(year, month)
+
+
+def refresh_closed_months(fechas) -> list:
+    """Regenera el snapshot de los meses cerrados a los que pertenecen las fechas (gastos atrasados o editados)."""
+    meses = {(int(f[:4]), int(f[5:7])) for f in map(str, fechas) if len(f) >= 7 and f[:4].isdigit()}
+    refreshed = []
+    for year, month in sorted(meses):
+        if not (_is_closed(year, month) and get_snapshot(year, month)):
+            continue
+        try:
+            if close_month(year, month, force=True):
+                refreshed.append(periodo(year, month))
+        except Exception as e:
+            logger.warning(f"No se pudo regenerar el snapshot de {periodo(year, month)}: {e}")
+    return refreshed
+
+
+def seed_month(year: int, month: int):
+    """Pre-carga la configuración del mes: límites del ledger (una transacción) y, con el backend de Sheets, la hoja mensual."""
+    prev = periodo(*previous(year, month))
+    limites = directus_manager.get_all_budgets() or {
+        cat: row["limite"] for cat, row in database.ledger_get(prev).items() if row["limite"]
+    }
+    if limites:
+        database.ledger_seed_limites(periodo(year, month), limites)
+
+    if BACKEND == "sheets":
+        try:
+            import sheets_manager
+            sheets_manager.get_monthly_spreadsheet(year, month)  # Inicializa y migra en lote si es nueva
+        except Exception as e:
+            logger.warning(f"No se pudo preparar la hoja de {periodo(year, month)}: {e}")
+
+
+def run_rollover() -> dict:
+    """Job de cambio de mes: cierra el mes anterior y prepara el actual. Bloqueante: usar en hilo."""
+    now = datetime.now()
+    prev_year, prev_month = previous(now.year, now.month)
+    if get_snapshot(prev_year, prev_month):
+        return {"closed": None}
+
+    import outbox
+    outbox.drain()  # Que lo guardado a última hora del mes llegue antes de congelarlo
+    snap = close_month(prev_year, prev_month)
+    if snap:
+        seed_month(now.year, now.month)
+    return {"closed": periodo(prev_year, prev_month) if snap else None}
+
+
+# ==================== CONSULTAS HISTÓRICAS ====================
+
+def get_month(year: int, month: int) -> dict:
+    """Mes en curso: resumen en vivo. Meses terminados: snapshot (se crea si falta)."""
+    if not _is_closed(year, month):
+        return analytics.without_frame(directus_manager.get_monthly_summary(year, month)) or None
+    try:
+        return close_month(year, month)
+    except Exception as e:
+        logger.warning(f"No se pudo cerrar {periodo(year, month)}: {e}")
+        return None
+
+
+def get_history(months: int = HISTORY_MONTHS) -> dict:
+    """{periodo: resumen} de los últimos `months` meses (incluye el actual), una lectura de SQLite."""
+    now = datetime.now()
+    targets = []
+    year, month = now.year, now.month
+    for _ in range(months):
+        targets.append((year, month))
+        year, month = previous(year, month)
+
+    rows = database.get_snapshots_mes([periodo(y, m) for y, m in targets])
+    history = {}
+    for y, m in targets:
+        key = periodo(y, m)
+        summary = _from_row(rows[key]) if key in rows else get_month(y, m)
+        if summary:
+            history[key] = summary
+    return dict(sorted(history.items()))
@@ -0,0 +1,178 @@
+"""
+Outbox durable de transacciones (write-behind)
+El bot confirma tras el commit local en SQLite; un job drena la cola hacia
+Directus en lotes, con backoff exponencial y claves de idempotencia.
+"""
+import json
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import alert_engine
+import budget_ledger
+import category_classifier
+import database  # SQLite local
+import directus_manager
+import month_close
+import webapp_api
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+BASE_BACKOFF = 10          # segundos; se duplica en cada intento fallido
+MAX_BACKOFF = 3600
+MAX_ATTEMPTS = 25          # ~1 día de reintentos antes de quedar en 'error'
+RETENTION_DAYS = 30
+MAX_ROUNDS = 20            # Lotes por drenado (el resto queda para el próximo job)
+
+_lock = threading.Lock()   # Un solo drenado a la vez
+
+
+def enqueue(data: dict, user: str, image_link: str = "", is_income: bool = False) -> tuple[bool, str]:
+    """
+    Misma firma que add_transaction del adaptador: guarda local + outbox y
+    retorna de inmediato. El envío remoto lo hace drain().
+    """
+    try:
+        monto_usd, _ = directus_manager.to_usd(data)
+        fecha = data.get("fecha") or datetime.now().strftime("%Y-%m-%d")
+        categoria = data.get("categoria") or ("General" if is_income else "Otros")
+        tabla = "ingresos" if is_income else "gastos"
+        row = {
+            "fecha": fecha,
+            "concepto": data.get("concepto", ""),
+            "monto_original": float(data.get("monto", 0)),
+            "moneda": data.get("moneda", "Bs"),
+            "monto_usd": monto_usd,
+            "categoria": categoria,
+            "responsable": user,
+        }
+        if not is_income:
+            row["referencia"] = data.get("referencia") or None
+            row["imagen_url"] = image_link or None
+            row["beneficiario"] = data.get("beneficiario") or None
+
+        key = uuid.uuid4().hex
+        payload = json.dumps({
+            "payload": directus_manager.build_payload({**data, "fecha": fecha}, monto_usd, image_link, is_income),
+            "categoria": categoria
+        })
+        if database.enqueue_transaccion(tabla, row, key, payload) is None:
+            return False, "No se pudo guardar localmente"
+        webapp_api.invalidate()
+        if not is_income:
+            budget_ledger.record(categoria, monto_usd, fecha)
+            if not data.get("categoria_predicha"):
+                # Una sola vez al guardar; una corrección manual (setcat) pesa más
+                weight = category_classifier.CORRECTION_WEIGHT if data.get("categoria_corregida") else 1
+                category_classifier.learn(categoria, data.get("concepto"), data.get("beneficiario"), weight=weight)
+            alert_engine.on_transaction(row)
+        return True, "OK"
+    except Exception as e:
+        logger.error(f"Error encolando transacción: {e}")
+        return False, str(e)
+
+
+def _backoff(intentos: int) -> str:
+    delay = min(BASE_BACKOFF * (2 ** intentos), MAX_BACKOFF)
+    return (datetime.now() + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _fail(entry: dict, error, definitivo: bool = False):
+    intentos = entry["intentos"] + 1
+    definitivo = definitivo or intentos >= MAX_ATTEMPTS
+    database.mark_outbox_fallido(entry["idempotency_key"], error, _backoff(intentos), definitivo)
+    if definitivo:
+        logger.error(f"Outbox: {entry['idempotency_key']} quedó en 'error' (sin más reintentos): {error}")
+
+
+def drain(batch_size: int = BATCH_SIZE) -> dict:
+    """Envía las entradas vencidas en lotes. Retorna {'sent': n, 'failed': n}."""
+    if not _lock.acquire(blocking=False):
+        return {"skipped": True}
+    sent = failed = 0
+    atrasadas = []  # Fechas de meses anteriores: su snapshot (si ya se cerró) queda desactualizado
+    mes_actual = datetime.now().strftime("%Y-%m")
+    try:
+        for _ in range(MAX_ROUNDS):
+            entries = database.get_outbox_pendientes(batch_size)
+            if not entries: break
+
+            # Esquema sin verificar (error transitorio): un intento previo pudo llevar external_id
+            # y reenviarlo sin deduplicar crearía el gasto dos veces
+            idempotent = directus_manager.ensure_schema()
+            batch, valid = [], []
+            for entry in entries:
+                if entry["intentos"] and idempotent is None:
+                    _fail(entry, "Reintento aplazado: esquema external_id sin verificar")
+                    failed += 1
+                    continue
+                try:
+                    batch.append({"key": entry["idempotency_key"], **json.loads(entry["payload"])})
+                    valid.append(entry)
+                except Exception as e:
+                    _fail(entry, f"Payload inválido: {e}", definitivo=True)
+                    failed += 1
+
+            if not batch:
+                if len(entries) < batch_size: break
+                continue
+            try:
+                results = directus_manager.add_transactions_batch(batch)
+            except directus_manager.UnconfirmedWriteError as e:
+                # Pudo guardarse: no reenviar nunca, queda en 'error' para revisión manual
+                logger.error(f"Outbox: lote de {len(batch)} sin confirmación y sin idempotencia: {e}")
+                for entry in valid:
+                    _fail(entry, e, definitivo=True)
+                failed += len(valid)
+                break
+            except Exception as e:
+                # Backend caído o lento: todo el lote se reprograma
+                logger.warning(f"Outbox: lote de {len(batch)} no enviado: {e}")
+                for entry in valid:
+                    _fail(entry, e)
+                failed += len(valid)
+                break
+
+            for entry, item in zip(valid, batch):
+                result = results.get(entry["idempotency_key"])
+                if result is None or isinstance(result, Exception):
+                    # Reintento uno a uno sin confirmación: tampoco se reenvía
+                    _fail(entry, result or "Sin respuesta del backend",
+                          definitivo=isinstance(result, directus_manager.UnconfirmedWriteError))
+                    failed += 1
+                else:
+                    database.mark_outbox_enviado(entry["idempotency_key"], result)
+                    sent += 1
+                    fecha = str(item["payload"].get("date") or "")
+                    if fecha[:7] < mes_actual:
+                        atrasadas.append(fecha)
+
+            if len(entries) < batch_size: break
+
+        if sent or failed:
+            logger.info(f"Outbox drenado: {sent} enviados, {failed} fallidos")
+    finally:
+        _lock.release()
+
+    # Fuera del lock: regenerar un snapshot lee el mes completo de Directus
+    if atrasadas:
+        month_close.refresh_closed_months(atrasadas)
+    return {"sent": sent, "failed": failed}
+
+
+@contextmanager
+def paused():
+    """Bloquea el drenado mientras dura el bloque (lecturas consistentes backend + pendientes)."""
+    with _lock:
+        yield
+
+
+def purge() -> int:
+    return database.purge_outbox(RETENTION_DAYS)
+
+
+def get_stats() -> dict:
+    return database.get_outbox_stats()
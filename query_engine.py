@@ -0,0 +1,325 @@
+"""
+Motor de consultas deterministas para /preguntar
+Reconoce las preguntas frecuentes (gasto por categoría/período/persona,
+balance, metas de ahorro, presupuesto, mayores gastos) y las responde con
+consultas parametrizadas sobre la réplica SQLite y el ledger, en
+milisegundos y sin LLM. Solo las preguntas abiertas van a Gemini, con un
+contexto mínimo (totales del mes y categorías principales).
+"""
+import logging
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+from telegram.helpers import escape_markdown
+
+import budget_ledger
+import database  # SQLite local
+import directus_manager
+from config import CATEGORIA_MAP
+from expense_parser import KEYWORD_INDEX
+
+logger = logging.getLogger(__name__)
+
+VALUES_TTL = 600        # Categorías/responsables conocidos (cache)
+TOP_N = 5
+CONTEXT_CATEGORIES = 5  # Categorías en el contexto mínimo de las preguntas abiertas
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+SAVINGS_WORDS = {"ahorro", "ahorros", "meta", "metas", "ahorrado"}
+BUDGET_WORDS = {"presupuesto", "presupuestos", "limite", "limites"}
+BALANCE_WORDS = {"balance", "ingreso", "ingresos", "sobra", "sobro", "queda", "quedo", "ganamos", "gane"}
+TOP_WORDS = {"mayor", "mayores", "top", "caro", "caros", "grandes", "alto", "altos"}
+PERSON_WORDS = {"quien", "quienes", "persona", "personas", "cada"}
+CATEGORY_WORDS = {"categoria", "categorias", "rubro", "rubros"}
+SPEND_WORDS = {"gaste", "gastamos", "gastado", "gasto", "gastos", "gastaron", "gasta", "llevo", "llevamos", "van", "cuanto"}
+SELF_WORDS = {"yo"}
+QUANTITY_WORDS = {"cuanto", "cuanta", "cuantos", "total"}
+# Por qué / debería / cómo / recomendaciones: piden criterio, no una cifra -> Gemini
+OPEN_WORDS = {"porque", "deberia", "deberiamos", "debo", "debemos", "como", "recomiendas", "recomienda",
+              "recomendarias", "conviene", "consejo", "consejos", "sugieres", "puedo", "podemos", "mejorar"}
+
+_values = {"categoria": [], "responsable": [], "loaded_at": 0.0}
+_stats = {"local": 0, "llm": 0, "local_ms": 0.0}
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _words(text: str) -> list:
+    return re.findall(r"[a-z0-9]+", _fold(text))
+
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def _md(value) -> str:
+    """Texto de los datos (concepto, categoría, persona) escapado para parse_mode="Markdown"."""
+    return escape_markdown(str(value), version=1)
+
+
+def _known(columna: str) -> list:
+    if time.time() - _values["loaded_at"] >= VALUES_TTL:
+        _values["categoria"] = database.get_valores_distintos("categoria")
+        _values["responsable"] = database.get_valores_distintos("responsable")
+        _values["loaded_at"] = time.time()
+    return _values[columna]
+
+
+# ==================== EXTRACCIÓN DE PARÁMETROS ====================
+
+def _month_range(year: int, month: int) -> tuple:
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return datetime(year, month, 1), end
+
+
+def parse_period(words: list, today: datetime) -> tuple:
+    """(desde, hasta, etiqueta) con hasta exclusivo. Por defecto: el mes en curso."""
+    today = datetime(today.year, today.month, today.day)
+    text = " ".join(words)
+    m = re.search(r"ultimos (\d+) dias", text)
+    if m:
+        dias = int(m.group(1))
+        return today - timedelta(days=dias - 1), today + timedelta(days=1), f"los últimos {dias} días"
+    if "hoy" in words:
+        return today, today + timedelta(days=1), "hoy"
+    if "ayer" in words:
+        return today - timedelta(days=1), today, "ayer"
+    if "semana pasada" in text:
+        lunes = today - timedelta(days=today.weekday() + 7)
+        return lunes, lunes + timedelta(days=7), "la semana pasada"
+    if "semana" in words:
+        return today - timedelta(days=today.weekday()), today + timedelta(days=1), "esta semana"
+    if "mes pasado" in text:
+        y, mth = (today.year - 1, 12) if today.month == 1 else (today.year, today.month - 1)
+        return (*_month_range(y, mth), "el mes pasado")
+    if "ano pasado" in text:
+        return datetime(today.year - 1, 1, 1), datetime(today.year, 1, 1), f"{today.year - 1}"
+    if "ano" in words:
+        return datetime(today.year, 1, 1), today + timedelta(days=1), "este año"
+    for word in words:
+        if word in MESES:
+            mth = MESES[word]
+            y = today.year if mth <= today.month else today.year - 1
+            return (*_month_range(y, mth), f"en {word} {y}")
+    return (*_month_range(today.year, today.month), "este mes")
+
+
+def parse_categories(words: list) -> tuple:
+    """(etiqueta, [nombres de categoría en la réplica]) o (None, None)."""
+    known = _known("categoria")
+    for word in words:
+        short = KEYWORD_INDEX.get(word) or (word if word in CATEGORIA_MAP else None)
+        matches = []
+        for cat in known:
+            tokens = set(_words(cat))
+            if word in tokens or (short and (short in tokens or _fold(cat) == _fold(CATEGORIA_MAP.get(short, "")))):
+                matches.append(cat)
+        if not matches and short:
+            matches = [CATEGORIA_MAP[short], short.capitalize()]
+        if matches:
+            return (CATEGORIA_MAP.get(short) or matches[0]), matches
+    return None, None
+
+
+def parse_person(words: list, asker: str = None):
+    """Responsable mencionado por nombre, o quien pregunta si dice 'yo'."""
+    for name in _known("responsable"):
+        first = _words(name)[:1]
+        if first and len(first[0]) > 2 and first[0] in words:
+            return name
+    if asker and SELF_WORDS & set(words):
+        return asker
+    return None
+
+
+# ==================== INTENCIONES ====================
+
+def _answer_savings(**_) -> str:
+    goals = directus_manager.get_savings()
+    if not goals:
+        return "🐷 No tienes metas de ahorro registradas. Crea una con /ahorro."
+    lines = [
+        f"• {_md(g['Meta'])}: {_money(g['Ahorrado Actual'])} de {_money(g['Objetivo USD'])} ({g['Porcentaje']})"
+        for g in goals
+    ]
+    return "🐷 *Metas de ahorro:*\n" + "\n".join(lines)
+
+
+def _answer_budget(cat_label, cats, **_) -> str:
+    if cats:
+        check = budget_ledger.check(cats[0])
+        if not check or not check.get("limit"):
+            return f"📏 {_md(cat_label)} no tiene presupuesto este mes. Usa /presupuesto para fijarlo."
+        return (f"📏 {_md(cat_label)}: {_money(check['spent'])} de {_money(check['limit'])} "
+                f"({check['pct']:.0f}%). Quedan {_money(max(check['limit'] - check['spent'], 0))}.")
+    rows = database.ledger_get(budget_ledger.periodo_de())
+    rows = {cat: r for cat, r in rows.items() if r["limite"]}
+    if not rows:
+        return "📏 No hay presupuestos este mes. Usa /presupuesto para fijarlos."
+    lines = [f"• {_md(cat)}: {_money(r['gastado'])} de {_money(r['limite'])} ({r['gastado'] / r['limite'] * 100:.0f}%)"
+             for cat, r in sorted(rows.items(), key=lambda kv: -kv[1]["gastado"] / kv[1]["limite"])]
+    return "📏 *Presupuestos del mes:*\n" + "\n".join(lines)
+
+
+def _unassigned_note(desde, hasta, cats=None, tablas=("gastos",)) -> str:
+    """
+    Los registros hechos desde la app o el panel de Directus llegan a la réplica
+    sin responsable: avisar que la respuesta por persona no los incluye.
+    """
+    total, count = 0.0, 0
+    for tabla in tablas:
+        t, n = database.sum_transacciones(tabla, desde, hasta, cats, sin_responsable=True)
+        total, count = total + t, count + n
+    if not count:
+        return ""
+    return f"\nℹ️ {count} registro{'s' if count != 1 else ''} ({_money(total)}) sin responsable (fuera del bot) no se atribuye{'n' if count != 1 else ''} a nadie."
+
+
+def _answer_balance(desde, hasta, periodo, person, **_) -> str:
+    ingresos, _n = database.sum_transacciones("ingresos", desde, hasta, responsable=person)
+    gastos, _n = database.sum_transacciones("gastos", desde, hasta, responsable=person)
+    balance = ingresos - gastos
+    icon = "✅" if balance >= 0 else "⚠️"
+    quien = f" de {_md(person)}" if person else ""
+    nota = _unassigned_note(desde, hasta, tablas=("gastos", "ingresos")) if person else ""
+    return (f"{icon} Balance{quien} {periodo}: {_money(balance)}\n"
+            f"💵 Ingresos: {_money(ingresos)} | 💸 Gastos: {_money(gastos)}{nota}")
+
+
+def _answer_top(desde, hasta, periodo, cats, cat_label, person, **_) -> str:
+    rows = database.top_gastos(desde, hasta, TOP_N, cats, person)
+    if not rows:
+        return f"📭 No hay gastos registrados {periodo}."
+    lines = [f"{i}. {_money(r['monto_usd'] or 0)} — {_md(r['concepto'] or r['categoria'])} ({r['fecha']})"
+             for i, r in enumerate(rows, 1)]
+    filtro = f" en {_md(cat_label)}" if cat_label else ""
+    nota = _unassigned_note(desde, hasta, cats) if person else ""
+    return f"💸 *Mayores gastos{filtro} {periodo}:*\n" + "\n".join(lines) + nota
+
+
+def _answer_breakdown(columna, desde, hasta, periodo, cats, **_) -> str:
+    rows = database.resumen_gastos_por(columna, desde, hasta, cats)
+    if not rows:
+        return f"📭 No hay gastos registrados {periodo}."
+    total = sum(r[1] or 0 for r in rows)
+    lines = [f"• {_md(valor)}: {_money(monto or 0)} ({(monto or 0) / total * 100:.0f}%)" for valor, monto, _n in rows[:8]]
+    titulo = "por persona" if columna == "responsable" else "por categoría"
+    nota = "\nℹ️ _Sin asignar_: registrados desde la app o el panel, sin responsable." \
+        if columna == "responsable" and any(valor == "Sin asignar" for valor, _m, _n in rows) else ""
+    return f"📊 *Gastos {titulo} {periodo}* (total {_money(total)}):\n" + "\n".join(lines) + nota
+
+
+def _answer_spend(desde, hasta, periodo, cats, cat_label, person, **_) -> str:
+    total, count = database.sum_transacciones("gastos", desde, hasta, cats, person)
+    quien = f"{_md(person)} gastó" if person else "Gastaron"
+    filtro = f" en {_md(cat_label)}" if cat_label else ""
+    nota = _unassigned_note(desde, hasta, cats) if person else ""
+    if not count:
+        return f"📭 No hay gastos{filtro} registrados {periodo}.{nota}"
+    return f"💸 {quien}{filtro} {periodo}: *{_money(total)}* en {count} gasto{'s' if count != 1 else ''}.{nota}"
+
+
+def _is_open(words: list) -> bool:
+    """Por qué / debería / cómo...: la respuesta es un razonamiento, no una consulta."""
+    why = any(a == "por" and b == "que" for a, b in zip(words, words[1:]))
+    return why or bool(set(words) & OPEN_WORDS)
+
+
+def classify(words: list, has_category: bool = False) -> str:
+    """Intención de la pregunta o None si es abierta."""
+    if _is_open(words):
+        return None
+    ws = set(words)
+    spend = ws & SPEND_WORDS
+    quantity = ws & QUANTITY_WORDS
+    income = ws & {"ingreso", "ingresos"}
+    if ws & SAVINGS_WORDS:
+        return "ahorro"
+    if ws & BUDGET_WORDS:
+        return "presupuesto"
+    if ws & TOP_WORDS:
+        # Solo hay ranking de gastos: "mi mayor ingreso" es abierta
+        return "top" if not income and (spend or ws & {"que", "cuales"}) else None
+    if "balance" in ws or (ws & BALANCE_WORDS and quantity):
+        return "balance"
+    if ws & PERSON_WORDS and spend:
+        return "por_persona"
+    if spend and not quantity and (ws & CATEGORY_WORDS or {"en", "que"} <= ws):
+        return "por_categoria"
+    if quantity and (spend - QUANTITY_WORDS or has_category):
+        return "gasto"
+    return None
+
+
+def answer(question: str, asker: str = None, today: datetime = None) -> dict:
+    """
+    {"intent": str|None, "text": respuesta local o None, "context": contexto mínimo
+    para Gemini si la pregunta es abierta}.
+    """
+    started = time.perf_counter()
+    today = today or datetime.now()
+    words = _words(question)
+    cat_label, cats = parse_categories(words)
+    intent = classify(words, bool(cats))
+
+    if intent is None:
+        _stats["llm"] += 1
+        return {"intent": None, "text": None, "context": minimal_context(today)}
+
+    desde, hasta, periodo = parse_period(words, today)
+    params = {
+        "desde": desde.strftime("%Y-%m-%d"), "hasta": hasta.strftime("%Y-%m-%d"), "periodo": periodo,
+        "cats": cats, "cat_label": cat_label, "person": parse_person(words, asker),
+    }
+    handlers = {
+        "ahorro": _answer_savings,
+        "presupuesto": _answer_budget,
+        "balance": _answer_balance,
+        "top": _answer_top,
+        "por_persona": lambda **p: _answer_breakdown("responsable", **p),
+        "por_categoria": lambda **p: _answer_breakdown("categoria", **p),
+        "gasto": _answer_spend,
+    }
+    text = handlers[intent](**params)
+    elapsed = (time.perf_counter() - started) * 1000
+    _stats["local"] += 1
+    _stats["local_ms"] += elapsed
+    logger.info(f"/preguntar local [{intent}] en {elapsed:.1f} ms: {question!r}")
+    return {"intent": intent, "text": text, "context": None}
+
+
+def minimal_context(today: datetime = None) -> dict:
+    """Totales del mes y las categorías principales (misma forma que el resumen que usa el prompt)."""
+    today = today or datetime.now()
+    desde, hasta = (d.strftime("%Y-%m-%d") for d in _month_range(today.year, today.month))
+    gastos, count = database.sum_transacciones("gastos", desde, hasta)
+    ingresos, _n = database.sum_transacciones("ingresos", desde, hasta)
+    categorias = database.resumen_gastos_por("categoria", desde, hasta)[:CONTEXT_CATEGORIES]
+    return {
+        "total_usd": round(gastos, 2),
+        "total_ingresos": round(ingresos, 2),
+        "count": count,
+        "by_category": {cat: round(monto or 0, 2) for cat, monto, _n in categorias},
+    }
+
+
+def invalidate():
+    """Olvida las categorías/responsables conocidos (cambiaron en Directus)."""
+    _values["loaded_at"] = 0.0
+
+
+def get_metrics() -> dict:
+    total = _stats["local"] + _stats["llm"]
+    return {
+        **_stats,
+        "local_pct": round(_stats["local"] / total * 100, 1) if total else 0.0,
+        "local_avg_ms": round(_stats["local_ms"] / _stats["local"], 2) if _stats["local"] else 0.0,
+    }
@@ -0,0 +1,222 @@
+"""
+Índice histórico de tasas de cambio (Bs/$)
+Convierte cada transacción con la tasa vigente en SU fecha, sin I/O por transacción.
+Fuentes: tabla exchange_rates (extensión bcv-rates de Directus) y tasas_cache (SQLite).
+"""
+import bisect
+import logging
+import threading
+from datetime import datetime, date
+
+import numpy as np
+import requests
+
+import database  # SQLite local
+from config import DIRECTUS_URL, DIRECTUS_TOKEN
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 400
+
+# Nombres de fuente aceptados -> clave interna (misma que tasas_cache)
+SOURCE_ALIASES = {
+    "bcv": "oficial",
+    "oficial": "oficial",
+    "paralelo": "paralelo",
+}
+
+USD_ALIASES = ["usd", "$", "us", "dolar", "doblar", "dólares"]
+
+
+def _normalize_source(fuente: str) -> str:
+    """Clave interna de BCV/PARALELO; None para MANUAL u otras (sin serie: se usa el fallback)."""
+    return SOURCE_ALIASES.get(str(fuente or "").lower())
+
+
+def _to_ordinal(fecha) -> int:
+    """Convierte 'YYYY-MM-DD' (o datetime/date) a ordinal de días."""
+    if fecha is None:
+        return date.today().toordinal()
+    if isinstance(fecha, datetime):
+        return fecha.date().toordinal()
+    if isinstance(fecha, date):
+        return fecha.toordinal()
+    return datetime.strptime(str(fecha)[:10], "%Y-%m-%d").toordinal()
+
+
+def is_usd(moneda) -> bool:
+    return str(moneda or "Bs").lower() in USD_ALIASES
+
+
+class RateIndex:
+    """
+    Serie ordenada por fecha de tasas por fuente.
+    get_rate() hace búsqueda binaria: la tasa vigente en una fecha es la
+    última publicada en o antes de ese día.
+    """
+
+    def __init__(self):
+        self._dates = {}    # fuente -> [ordinal, ...] ordenado
+        self._rates = {}    # fuente -> [tasa, ...]
+        self._arrays = {}   # fuente -> (np.ndarray fechas, np.ndarray tasas) para conversión masiva
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def load(self, points: dict):
+        """Reemplaza el índice. points: {fuente: {ordinal: tasa}}"""
+        with self._lock:
+            self._dates, self._rates, self._arrays = {}, {}, {}
+            for fuente, by_day in points.items():
+                days = sorted(by_day)
+                self._dates[fuente] = days
+                self._rates[fuente] = [by_day[d] for d in days]
+            self.loaded_at = datetime.now()
+
+    def add_point(self, fuente: str, fecha, tasa: float):
+        """Inserta/actualiza la tasa de un día manteniendo el orden."""
+        if not tasa or tasa <= 0: return
+        fuente = _normalize_source(fuente)
+        if fuente is None: return
+        day = _to_ordinal(fecha)
+        with self._lock:
+            days = self._dates.setdefault(fuente, [])
+            rates = self._rates.setdefault(fuente, [])
+            i = bisect.bisect_left(days, day)
+            if i < len(days) and days[i] == day:
+                rates[i] = float(tasa)
+            else:
+                days.insert(i, day)
+                rates.insert(i, float(tasa))
+            self._arrays.pop(fuente, None)
+
+    def get_rate(self, fecha=None, fuente: str = "BCV") -> float:
+        """Tasa vigente en la fecha (O(log n)). None si no hay datos de esa fuente."""
+        fuente = _normalize_source(fuente)
+        days = self._dates.get(fuente)
+        if not days: return None
+        i = bisect.bisect_right(days, _to_ordinal(fecha)) - 1
+        # Fechas anteriores al primer punto: usar la tasa más antigua conocida
+        return self._rates[fuente][max(i, 0)]
+
+    def to_usd(self, monto: float, moneda: str, fecha=None, fuente: str = "BCV", fallback: float = None) -> tuple:
+        """Retorna (monto_usd, tasa_usada)."""
+        monto = float(monto or 0)
+        if is_usd(moneda):
+            return monto, 1.0
+        tasa = self.get_rate(fecha, fuente) or fallback
+        if not tasa:
+            return monto, 1.0
+        return round(monto / tasa, 2), tasa
+
+    def _get_arrays(self, fuente: str):
+        arrays = self._arrays.get(fuente)
+        if arrays is None:
+            with self._lock:
+                arrays = (
+                    np.asarray(self._dates.get(fuente, []), dtype=np.int64),
+                    np.asarray(self._rates.get(fuente, []), dtype=np.float64),
+                )
+                self._arrays[fuente] = arrays
+        return arrays
+
+    def convert_many(self, montos, fechas, monedas=None, fuente: str = "BCV", fallback: float = None):
+        """
+        Conversión vectorizada para importaciones (CSV, sync).
+        Retorna (montos_usd, tasas_usadas) como np.ndarray.
+        """
+        montos = np.asarray(montos, dtype=np.float64)
+        days = np.fromiter((_to_ordinal(f) for f in fechas), dtype=np.int64, count=len(montos))
+        usd_mask = np.zeros(len(montos), dtype=bool) if monedas is None else \
+            np.fromiter((is_usd(m) for m in monedas), dtype=bool, count=len(montos))
+
+        fuente = _normalize_source(fuente)
+        idx_dates, idx_rates = self._get_arrays(fuente) if fuente else ((), ())
+        if len(idx_rates):
+            pos = np.clip(np.searchsorted(idx_dates, days, side="right") - 1, 0, None)
+            tasas = idx_rates[pos]
+        else:
+            tasas = np.full(len(montos), fallback or 1.0, dtype=np.float64)
+
+        tasas = np.where(usd_mask, 1.0, tasas)
+        return np.round(montos / tasas, 2), tasas
+
+
+# ==================== CARGA ====================
+
+# Última respuesta de /bcv-rates/history para GET condicional (ETag)
+_history_cache = {"key": None, "etag": None, "data": {}}
+
+
+def _fetch_directus_history(days: int) -> dict:
+    """Lee exchange_rates vía GET /bcv-rates/history. Retorna {ordinal: tasa_usd}."""
+    try:
+        headers = {"Authorization": f"Bearer {DIRECTUS_TOKEN}"}
+        if _history_cache["key"] == days and _history_cache["etag"]:
+            headers["If-None-Match"] = _history_cache["etag"]
+        r = requests.get(
+            f"{DIRECTUS_URL.rstrip('/')}/bcv-rates/history",
+            headers=headers,
+            params={"days": days},
+            timeout=15
+        )
+        if r.status_code == 304:
+            return dict(_history_cache["data"])
+        if r.status_code != 200:
+            logger.warning(f"bcv-rates/history respondió {r.status_code}")
+            return {}
+        result = {}
+        for rate_date, values in r.json().get("rates", {}).items():
+            usd = values.get("usd")
+            if usd:
+                result[_to_ordinal(rate_date)] = float(usd)
+        _history_cache.update(key=days, etag=r.headers.get("ETag"), data=result)
+        return dict(result)
+    except Exception as e:
+        logger.warning(f"No se pudo leer historial de bcv-rates: {e}")
+        return {}
+
+
+def _load_tasas_cache(days: int) -> dict:
+    """Lee tasas_cache: el último punto de cada día gana. Retorna {fuente: {ordinal: tasa}}."""
+    points = {}
+    for row in database.get_tasas_cache(None, days):
+        try:
+            points.setdefault(row["fuente"], {})[_to_ordinal(row["timestamp"])] = float(row["tasa"])
+        except Exception:
+            continue
+    return points
+
+
+_index = RateIndex()
+
+
+def preload(days: int = HISTORY_DAYS) -> int:
+    """Construye el índice en memoria (llamar al arrancar el bot). Retorna nº de puntos."""
+    points = _load_tasas_cache(days)
+    # El BCV publicado en exchange_rates es la fuente oficial autoritativa
+    points.setdefault("oficial", {}).update(_fetch_directus_history(days))
+    _index.load(points)
+    total = sum(len(v) for v in points.values())
+    logger.info(f"Índice de tasas cargado: {total} puntos")
+    return total
+
+
+def refresh_history(days: int = HISTORY_DAYS) -> int:
+    """
+    Relee exchange_rates con GET condicional (304 si no cambió) y fusiona los
+    puntos nuevos en el índice. Llamar en la actualización horaria de tasas.
+    """
+    etag = _history_cache["etag"]
+    history = _fetch_directus_history(days)
+    if not history or (etag and _history_cache["etag"] == etag):
+        return 0
+    for day, tasa in history.items():
+        _index.add_point("oficial", date.fromordinal(day), tasa)
+    return len(history)
+
+
+def get_index() -> RateIndex: return _index
+def get_rate(fecha=None, fuente="BCV"): return _index.get_rate(fecha, fuente)
+def add_point(fuente, fecha, tasa): return _index.add_point(fuente, fecha, tasa)
+def to_usd(monto, moneda, fecha=None, fuente="BCV", fallback=None): return _index.to_usd(monto, moneda, fecha, fuente, fallback)
+def convert_many(montos, fechas, monedas=None, fuente="BCV", fallback=None): return _index.convert_many(montos, fechas, monedas, fuente, fallback)
@@ -0,0 +1,75 @@
+"""
+Reproductor de eventos de Directus
+Envía eventos grabados (JSONL, un evento de la extensión bot-events o de un
+Flow por línea) a /api/directus/events, como lo haría Directus, y mide la
+latencia de aplicación. Sin --file genera eventos de ejemplo a partir de la
+réplica local (updates de las últimas transacciones + un cambio de ahorros).
+
+Uso:
+    python replay_directus_events.py --file eventos.jsonl --secret $DIRECTUS_EVENTS_SECRET
+    python replay_directus_events.py --sample 20 --url http://127.0.0.1:8081/api/directus/events --secret ...
+"""
+import argparse
+import json
+import statistics
+import time
+
+import requests
+
+
+def sample_events(n: int) -> list:
+    """Updates de las `n` transacciones más recientes de la réplica y un update de ahorros."""
+    import database
+    conn = database.get_connection()
+    rows = conn.execute(
+        "SELECT directus_id FROM gastos WHERE directus_id IS NOT NULL ORDER BY fecha DESC, id DESC LIMIT ?", (n,)
+    ).fetchall()
+    conn.close()
+    events = [
+        {"event": "transactions.items.update", "collection": "transactions", "keys": [row["directus_id"]], "payload": {}}
+        for row in rows
+    ]
+    events.append({"event": "savings.items.update", "collection": "savings", "keys": ["0"], "payload": {}})
+    return events
+
+
+def load_events(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(events: list, url: str, secret: str):
+    """POST secuencial (Directus emite un evento por acción, en orden)."""
+    session = requests.Session()
+    headers = {"Content-Type": "application/json", "X-Directus-Events-Secret": secret}
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    for event in events:
+        started = time.perf_counter()
+        r = session.post(url, data=json.dumps(event), headers=headers, timeout=30)
+        latencies.append(time.perf_counter() - started)
+        if r.status_code != 200:
+            errors.append((event.get("event"), r.status_code, r.text[:200]))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"\n📡 {len(events)} eventos en {elapsed:.2f}s")
+    print(f"   Latencia ms: p50={p(0.50):.1f} p95={p(0.95):.1f} media={statistics.mean(latencies) * 1000:.1f}")
+    for event, status, body in errors[:5]:
+        print(f"   ⚠️ {event}: HTTP {status} {body}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce eventos de Directus contra el bot")
+    parser.add_argument("--file", help="JSONL con eventos grabados")
+    parser.add_argument("--sample", type=int, default=10, help="Eventos de ejemplo desde la réplica local")
+    parser.add_argument("--url", default="http://127.0.0.1:8081/api/directus/events")
+    parser.add_argument("--secret", default="")
+    args = parser.parse_args()
+
+    events = load_events(args.file) if args.file else sample_events(args.sample)
+    if not events:
+        raise SystemExit("Sin eventos para reproducir")
+    print(f"🚀 {len(events)} eventos cargados")
+    replay(events, args.url, args.secret)
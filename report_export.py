@@ -0,0 +1,119 @@
+"""
+Exportación de reportes en streaming (Excel write-only o CSV)
+Recorre Directus por páginas acotadas al período y escribe fila a fila en un
+buffer SpooledTemporaryFile: la memoria no crece con el historial.
+"""
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import directus_manager
+
+logger = logging.getLogger(__name__)
+
+SPOOL_MAX_BYTES = 5 * 1024 * 1024  # Por encima de esto el buffer pasa a disco
+
+HEADERS = ["Fecha", "Concepto", "Monto USD", "Categoría", "Comprobante"]
+SHEETS = {"expense": "Gastos", "income": "Ingresos"}
+
+
+def month_range(year: int = None, month: int = None) -> tuple[str, str]:
+    """('YYYY-MM-01', primer día del mes siguiente)."""
+    now = datetime.now()
+    year, month = year or now.year, month or now.month
+    start = f"{year}-{month:02d}-01"
+    end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    return start, end
+
+
+def _row(item: dict) -> list:
+    cat = item.get("category")
+    return [
+        str(item.get("date") or "")[:10],
+        item.get("concept") or "",
+        float(item.get("amount") or 0),
+        cat.get("name") if isinstance(cat, dict) else "Otros",
+        item.get("receipt_image") or ""
+    ]
+
+
+def _write_xlsx(items, buf) -> dict:
+    wb = Workbook(write_only=True)
+    sheets, totals = {}, {}
+    bold = Font(bold=True)
+
+    def header(ws):
+        cells = []
+        for title in HEADERS:
+            cell = WriteOnlyCell(ws, value=title)
+            cell.font = bold
+            cells.append(cell)
+        return cells
+
+    # Hojas creadas de antemano para mantener el orden Gastos, Ingresos
+    for tipo, title in SHEETS.items():
+        ws = wb.create_sheet(title)
+        ws.append(header(ws))
+        sheets[tipo], totals[tipo] = ws, 0.0
+
+    count = 0
+    for item in items:
+        tipo = item.get("type") if item.get("type") in sheets else "expense"
+        row = _row(item)
+        sheets[tipo].append(row)
+        totals[tipo] += row[2]
+        count += 1
+
+    for tipo, ws in sheets.items():
+        ws.append([])
+        ws.append(["TOTAL", "", round(totals[tipo], 2)])
+
+    wb.save(buf)
+    return {"rows": count, "total_gastos": totals["expense"], "total_ingresos": totals["income"]}
+
+
+def _write_csv(items, buf) -> dict:
+    # csv escribe texto: se acumula en un StringIO pequeño y se vuelca en bytes por bloques
+    chunk = io.StringIO()
+    writer = csv.writer(chunk)
+    buf.write("\ufeff".encode("utf-8"))  # BOM para que Excel detecte UTF-8
+    writer.writerow(["Tipo"] + HEADERS)
+    totals = {"expense": 0.0, "income": 0.0}
+    count = 0
+    for item in items:
+        tipo = item.get("type") if item.get("type") in totals else "expense"
+        row = _row(item)
+        writer.writerow([SHEETS[tipo]] + row)
+        totals[tipo] += row[2]
+        count += 1
+        if count % 500 == 0:
+            buf.write(chunk.getvalue().encode("utf-8"))
+            chunk.seek(0)
+            chunk.truncate()
+    buf.write(chunk.getvalue().encode("utf-8"))
+    return {"rows": count, "total_gastos": totals["expense"], "total_ingresos": totals["income"]}
+
+
+def build_report(year: int = None, month: int = None, fmt: str = "xlsx") -> tuple:
+    """
+    Genera el reporte del mes. Retorna (buffer posicionado al inicio, nombre, stats).
+    El llamador debe cerrar el buffer.
+    """
+    start, end = month_range(year, month)
+    items = directus_manager.iter_transactions(start, end)
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        stats = _write_csv(items, buf) if fmt == "csv" else _write_xlsx(items, buf)
+    except Exception:
+        buf.close()
+        raise
+    buf.seek(0)
+    fname = f"Reporte_{start[:7].replace('-', '_')}.{'csv' if fmt == 'csv' else 'xlsx'}"
+    logger.info(f"Reporte {fname}: {stats['rows']} filas")
+    return buf, fname, stats
@@ -9,6 +9,8 @@ import drive_manager
 from config import GOOGLE_CREDENTIALS_FILE, GOOGLE_DRIVE_FOLDER_ID
 import logging
 import database  # SQLite local
+import rate_index
+import analytics
 
 logger = logging.getLogger(__name__)
 
@@ -92,7 +94,10 @@ def get_sheet_url(year: int = None, month: int = None) -> str:
         return None
 
 def try_migrate_from_previous_month(year, month, current_ss):
-    """Copia tasa, categorías y presupuestos del mes anterior si existen."""
+    """
+    Copia configuración (tasa, fuente, etc.), categorías y presupuestos del mes
+    anterior si existen: una lectura por hoja de cálculo y una escritura en lote.
+    """
     try:
         prev_date = datetime(year, month, 1) - timedelta(days=1)
         prev_filename = f"Gastos_{prev_date.year}_{prev_date.month:02d}"
@@ -103,42 +108,33 @@ def try_migrate_from_previous_month(year, month, current_ss):
         client = get_client()
         prev_ss = client.open_by_key(prev_id)
         
-        # 1. Copiar Tasa
-        try:
-            ws_conf = prev_ss.worksheet("Configuracion")
-            tasa = ws_conf.acell('B2').value
-            source = ws_conf.acell('B3').value # Asumiendo row 3
-            if tasa:
-                set_exchange_rate(float(tasa.replace(",", ".")), source or "MANUAL", current_ss)
-        except: pass
-
-        # 2. Copiar Categorías
-        try:
-            ws_cat = prev_ss.worksheet("Categorias")
-            cats = ws_cat.get_all_values()
-            if len(cats) > 1:
-                cur_cat = current_ss.worksheet("Categorias")
-                cur_cat.clear()
-                cur_cat.update("A1", cats)
-        except: pass
-        
-        # 3. Copiar Presupuestos
-        try:
-            ws_pres = prev_ss.worksheet("Presupuestos")
-            pres = ws_pres.get_all_values()
-            if len(pres) > 1:
-                cur_pres = current_ss.worksheet("Presupuestos")
-                # Copiar solo Categoría y Límite (cols A y B), resetear Gastado (Col C) a 0
-                import copy
-                new_pres = []
-                for row in pres:
-                    if row[0] == "Categoría": new_pres.append(row)
-                    else: new_pres.append([row[0], row[1], 0])
-                
-                cur_pres.clear()
-                cur_pres.update("A1", new_pres)
-        except: pass
-
+        prev_conf, cats, pres = [r.get("values", []) for r in prev_ss.values_batch_get(
+            ["Configuracion!A:B", "Categorias!A:Z", "Presupuestos!A:C"]
+        )["valueRanges"]]
+        cur_conf = current_ss.values_batch_get(["Configuracion!A:B"])["valueRanges"][0].get("values", [])
+        
+        data = []
+        
+        # 1. Configuración: claves del mes actual + valores del anterior (tasa, fuente, ...)
+        conf = {row[0]: row[1] if len(row) > 1 else "" for row in cur_conf if row}
+        conf.update({row[0]: row[1] for row in prev_conf[1:] if len(row) > 1 and row[0]})
+        header = cur_conf[0] if cur_conf else ["Clave", "Valor"]
+        conf_rows = [header] + [[k, v] for k, v in conf.items() if k != header[0]]
+        data.append({"range": f"Configuracion!A1:B{len(conf_rows)}", "values": conf_rows})
+        
+        # 2. Categorías
+        if len(cats) > 1:
+            data.append({"range": "Categorias!A1", "values": cats})
+        
+        # 3. Presupuestos: solo Categoría y Límite, Gastado Actual vuelve a 0
+        if len(pres) > 1:
+            new_pres = [pres[0]] + [[row[0], row[1] if len(row) > 1 else 0, 0] for row in pres[1:] if row]
+            data.append({"range": "Presupuestos!A1", "values": new_pres})
+        
+        # Las hojas reemplazadas se vacían antes (el mes nuevo trae filas por defecto)
+        replaced = [f"{d['range'].split('!')[0]}!A:Z" for d in data[1:]]
+        if replaced: current_ss.values_batch_clear(replaced)
+        current_ss.values_batch_update({"valueInputOption": "USER_ENTERED", "data": data})
         logger.info(f"Datos migrados de {prev_filename} a {current_ss.title}")
         
     except Exception as e:
@@ -305,6 +301,15 @@ def get_categories() -> list:
         return vals[1:] if len(vals) > 1 else []
     except: return []
 
+def get_category_keywords() -> dict:
+    """{categoria: [palabras clave]} desde la columna Keywords de Categorias."""
+    try:
+        rows = get_categories_sheet().get_all_values()[1:]
+        return {r[0]: [k.strip() for k in r[1].split(",") if k.strip()] for r in rows if len(r) > 1 and r[0] and r[1]}
+    except Exception as e:
+        logger.warning(f"Error get_category_keywords: {e}")
+        return {}
+
 def add_category(name: str) -> bool:
     try:
         sheet = get_categories_sheet()
@@ -323,7 +328,14 @@ def add_transaction(data: dict, user: str, image_link: str = "", is_income: bool
         
         # Buscar SS específico de la fecha
         ss = get_monthly_spreadsheet(dt.year, dt.month)
-        tasa = get_exchange_rate(ss)
+        # Una sola lectura de Configuracion; la tasa de la fecha sale del índice en memoria
+        conf = get_all_config(ss)
+        try: tasa_mes = float(str(conf.get("TASA_USD", "1.0")).replace(",", "."))
+        except ValueError: tasa_mes = 1.0
+        source = conf.get("TASA_SOURCE", "MANUAL")
+        tasa = tasa_mes
+        if source in ["BCV", "PARALELO"]:
+            tasa = rate_index.get_rate(date_str, source) or tasa_mes
         
         sheet = ss.worksheet("Ingresos" if is_income else "Gastos")
         
@@ -452,6 +464,13 @@ def add_transaction(data: dict, user: str, image_link: str = "", is_income: bool
                     responsable=user,
                     imagen_url=image_link
                 )
+                # Contador del presupuesto y su celda "Gastado Actual"
+                import budget_ledger
+                entry = budget_ledger.record(cat, monto_usd, date_str)
+                if entry and entry["limite"] > 0:
+                    bsheet = ss.worksheet("Presupuestos")
+                    bcell = bsheet.find(cat)
+                    if bcell: bsheet.update_cell(bcell.row, 3, round(entry["gastado"], 2))
         except Exception as db_err:
             logger.warning(f"Error sync SQLite (no crítico): {db_err}")
         
@@ -475,25 +494,9 @@ def get_monthly_summary(year: int = None, month: int = None, ss = None) -> dict:
         sheet_g = ss.worksheet("Gastos")
         records_g = sheet_g.get_all_records()
         
-        total_gastos = 0
-        by_category = {}
-        daily_trend = []
-        
-        for row in records_g:
-            try:
-                val = row.get("Monto USD")
-                if not val: continue
-                val = float(str(val).replace(",", "."))
-                
-                cat = row.get("Categoría", "Otros")
-                by_category[cat] = by_category.get(cat, 0) + val
-                total_gastos += val
-                
-                daily_trend.append({
-                    "Fecha": row.get("Fecha"),
-                    "Monto USD": val
-                })
-            except: continue
+        # Un solo frame tipado (fechas y montos se parsean una vez, vectorizado)
+        frame = analytics.frame_from_records(records_g, categoria="Categoría")
+        total_gastos = analytics.total(frame)
             
         # 2. Procesar INGRESOS
         total_ingresos = 0
@@ -510,8 +513,9 @@ def get_monthly_summary(year: int = None, month: int = None, ss = None) -> dict:
         return {
             "total_usd": total_gastos,
             "total_ingresos": total_ingresos,
-            "by_category": by_category,
-            "daily_trend": daily_trend,
+            "by_category": analytics.by_category(frame),
+            "daily_trend": analytics.daily_trend_records(frame),
+            "frame": frame,
             "count": len(records_g),
             "year": year or datetime.now().year,
             "month": month or datetime.now().month
@@ -530,6 +534,8 @@ def set_budget(category: str, amount: float) -> bool:
             sheet.update_acell(f"B{cell.row}", amount)
         else:
             sheet.append_row([category, amount, 0])
+        import budget_ledger
+        budget_ledger.set_limit(category, amount)
         return True
     except Exception as e:
         logger.error(f"Error set_budget: {e}")
@@ -552,27 +558,21 @@ def get_all_budgets() -> dict:
         return {}
 
 def check_budget_alert(category: str) -> dict:
+    """Lectura O(1) del ledger local (ver budget_ledger)."""
+    import budget_ledger
+    return budget_ledger.check(category)
+
+def update_budget_spent(spent: dict, year: int = None, month: int = None) -> int:
+    """Escribe la columna 'Gastado Actual' de Presupuestos en una sola llamada."""
     try:
-        now = datetime.now()
-        ss = get_monthly_spreadsheet(now.year, now.month) # Del mes actual
-        bsheet = ss.worksheet("Presupuestos")
-        cell = bsheet.find(category)
-        if not cell: return None
-        
-        limit = float(bsheet.cell(cell.row, 2).value.replace(",", "."))
-        
-        summary = get_monthly_summary(ss=ss) # Pass ss to avoid re-fetching
-        spent = summary['by_category'].get(category, 0)
-        
-        pct = (spent / limit) * 100
-        
-        return {
-            "limit": limit,
-            "spent": spent,
-            "pct": pct,
-            "alert": "red" if pct >= 100 else "yellow" if pct >= 80 else "green"
-        }
-    except: return None
+        sheet = get_budget_sheet(get_monthly_spreadsheet(year, month))
+        cats = sheet.col_values(1)[1:]
+        if not cats: return 0
+        sheet.update(f"C2:C{len(cats) + 1}", [[round(spent.get(c, 0), 2)] for c in cats])
+        return len(cats)
+    except Exception as e:
+        logger.error(f"Error update_budget_spent: {e}")
+        return 0
 
 # --- AHORROS ---
 
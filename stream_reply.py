@@ -0,0 +1,125 @@
+"""
+Respuestas de IA en streaming para Telegram
+Consume la API de streaming de Gemini en un hilo y va editando el mensaje
+placeholder con el texto parcial a una cadencia limitada (Telegram limita
+las ediciones por chat). Una pregunta nueva del mismo chat cancela la
+generación en curso.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+import model_router
+
+logger = logging.getLogger(__name__)
+
+EDIT_INTERVAL = 1.5      # Segundos mínimos entre ediciones del mismo mensaje
+MAX_LENGTH = 4000        # Límite de Telegram (4096) con margen para el encabezado
+CURSOR = " ▌"
+# Comandos que inician una generación nueva y cancelan la respuesta en curso del chat:
+# comando -> si necesita argumentos (un /preguntar sin pregunta solo muestra la ayuda)
+CANCEL_COMMANDS = {"/preguntar": True, "/consejo": False, "/analisis": False}
+
+_active = {}  # chat_id -> threading.Event de la generación en curso
+
+
+def cancel(chat_id) -> bool:
+    """Cancela la generación en curso del chat (si existe)."""
+    stop = _active.get(chat_id)
+    if stop is None:
+        return False
+    stop.set()
+    return True
+
+
+def on_update(update) -> None:
+    """Llamado al recibir un update (antes del orden por chat): una pregunta nueva cancela la anterior."""
+    message = getattr(update, "message", None)
+    parts = ((message.text or "") if message else "").split(maxsplit=1)
+    if not parts or not update.effective_chat:
+        return
+    command = parts[0].split("@")[0].lower()  # /preguntar@MiBot en grupos
+    if command not in CANCEL_COMMANDS or (CANCEL_COMMANDS[command] and len(parts) < 2):
+        return
+    if cancel(update.effective_chat.id):
+        logger.info(f"Chat {update.effective_chat.id}: respuesta en curso cancelada por {command}")
+
+
+async def _edit(message, text: str, parse_mode: str = None) -> bool:
+    try:
+        await message.edit_text(text[:4096], parse_mode=parse_mode)
+        return True
+    except RetryAfter as e:
+        logger.warning(f"Límite de ediciones de Telegram: esperar {e.retry_after}s")
+        await asyncio.sleep(e.retry_after)
+        return False
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        if parse_mode:
+            # Markdown incompleto o inválido: mostrar en texto plano
+            return await _edit(message, text, None)
+        logger.warning(f"No se pudo editar el mensaje: {e}")
+        return False
+
+
+async def stream_reply(message, prompt: str, chat_id, header: str = "", fallback: str = None, kind: str = "chat") -> str:
+    """
+    Edita `message` con la respuesta en streaming a `prompt`.
+    Las ediciones parciales van en texto plano (el Markdown suele estar
+    incompleto); la final usa Markdown. Retorna el texto generado.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    cancel(chat_id)  # Solo una generación por chat
+    _active[chat_id] = stop
+
+    def produce():
+        try:
+            for chunk in model_router.stream_text(prompt, kind):
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    producer = loop.run_in_executor(None, produce)
+    plain_header = header.replace("*", "")
+    text, shown, last_edit = "", "", 0.0
+    error = None
+    try:
+        while not stop.is_set():
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=EDIT_INTERVAL)
+            except asyncio.TimeoutError:
+                item = ""
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                error = item
+                break
+            text = (text + item)[:MAX_LENGTH]
+            if text != shown and time.monotonic() - last_edit >= EDIT_INTERVAL:
+                if await _edit(message, plain_header + text + CURSOR):
+                    shown = text
+                last_edit = time.monotonic()
+
+        if stop.is_set():
+            await _edit(message, plain_header + text + "\n\n⏹️ Cancelado: respondiendo tu nueva pregunta.")
+        elif error is not None or not text.strip():
+            logger.warning(f"Streaming de Gemini fallido: {error}")
+            partial = text.strip() + "\n\n" if text.strip() else ""
+            await _edit(message, plain_header + partial + (fallback or f"❌ Error al generar la respuesta: {error or 'sin texto'}"))
+        else:
+            await _edit(message, header + text.strip(), parse_mode="Markdown")
+        return text.strip()
+    finally:
+        stop.set()  # Si el handler fue cancelado, el hilo deja de leer el stream
+        if _active.get(chat_id) is stop:
+            del _active[chat_id]
+        producer.add_done_callback(lambda f: f.exception())  # El hilo puede terminar después
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+import expense_parser
+from expense_parser import AMBIGUOUS, IGNORE, MATCH
+
+TODAY = datetime(2026, 10, 19)
+
+
+def parse(text):
+    return expense_parser.parse(text, today=TODAY)
+
+
+@pytest.mark.parametrize("text, fecha, concepto", [
+    ("gasté 30$ el 15/03", "2026-03-15", "Gasto"),
+    ("taxi 5$ 03/01/2025", "2025-01-03", "taxi"),
+    ("farmacia 12$ 2026-10-01", "2026-10-01", "farmacia"),
+    ("cena 40$ el 25/12", "2025-12-25", "cena"),  # Sin año y aún no llega: el año pasado
+    ("cena 40$ ayer", "2026-10-18", "cena"),
+])
+def test_fecha_explicita_o_relativa(text, fecha, concepto):
+    result = parse(text)
+    assert result["status"] == MATCH
+    assert result["data"]["fecha"] == fecha
+    assert result["data"]["concepto"] == concepto
+
+
+@pytest.mark.parametrize("text", ["gasté 30$ el 31/02", "gasté 30$ el 15/03 o el 16/03"])
+def test_fecha_invalida_o_doble_es_ambigua(text):
+    assert parse(text)["status"] == AMBIGUOUS
+
+
+@pytest.mark.parametrize("text", ["tengo 50$ en el banco", "te debo 20$", "me quedan 300 bs"])
+def test_moneda_sola_no_es_gasto(text):
+    assert parse(text)["status"] == AMBIGUOUS
+
+
+@pytest.mark.parametrize("text, monto, moneda, categoria", [
+    ("gasté 50$ en comida", 50, "USD", "comida"),
+    ("20$ taxi", 20, "USD", "transporte"),
+    ("pague 100 mil bs de condominio", 100000, "Bs", "hogar"),
+    ("compré 3 arepas por 6$", 6, "USD", "comida"),
+])
+def test_gastos_reconocidos(text, monto, moneda, categoria):
+    result = parse(text)
+    assert result["status"] == MATCH
+    assert (result["data"]["monto"], result["data"]["moneda"], result["data"]["categoria_sugerida"]) == (monto, moneda, categoria)
+
+
+@pytest.mark.parametrize("text, status", [
+    ("mañana es la reunión 15/03", IGNORE),
+    ("pagué 1.000 de luz", AMBIGUOUS),
+    ("10 euros pizza", AMBIGUOUS),
+])
+def test_casos_no_concluyentes(text, status):
+    assert parse(text)["status"] == status
@@ -0,0 +1,86 @@
+"""
+Procesamiento concurrente de updates de Telegram con orden por chat
+Updates de chats distintos corren en paralelo (hasta max_concurrent_updates);
+los de un mismo chat se procesan en el orden en que llegaron.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import stream_reply
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT = 30  # Segundos máximos esperando updates en curso al apagar
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Un asyncio.Lock por chat serializa sus updates; el semáforo de
+    BaseUpdateProcessor limita la concurrencia global y se toma solo cuando
+    llega el turno del chat (un chat ocupado no retiene cupos de los demás).
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}
+        self._waiting = defaultdict(int)  # chat_id -> updates en curso o esperando
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        """
+        Reemplaza al de BaseUpdateProcessor, que toma el semáforo global antes de
+        do_process_update: aquí se espera primero el turno del chat.
+        """
+        self._in_flight += 1
+        self._idle.clear()
+        key = self._chat_key(update)
+        # Antes de esperar el turno del chat: una pregunta nueva cancela la respuesta en streaming
+        stream_reply.on_update(update)
+        try:
+            if key is None:
+                async with self._semaphore:
+                    await self.do_process_update(update, coroutine)
+                return
+            lock = self._chat_locks.setdefault(key, asyncio.Lock())
+            self._waiting[key] += 1
+            try:
+                async with lock:
+                    async with self._semaphore:
+                        await self.do_process_update(update, coroutine)
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    # Sin más updates de este chat: liberar su lock
+                    del self._waiting[key]
+                    self._chat_locks.pop(key, None)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        """Nada que preparar."""
+
+    async def shutdown(self) -> None:
+        """Espera (con límite) a que terminen los updates en curso."""
+        if self._in_flight:
+            logger.info(f"Esperando {self._in_flight} updates en curso antes de apagar...")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Apagado con {self._in_flight} updates sin terminar")
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import io
 import pandas as pd
 from datetime import datetime
+import analytics
 
 def generate_pie_chart(category_data: dict):
     if not category_data: return None
@@ -35,18 +36,16 @@ def generate_comparison_chart(total_expenses: float, total_income: float):
     plt.close()
     return buf
 
-def generate_daily_trend(transactions: list):
-    """Espera lista de dicts con 'Fecha' y 'Monto USD'"""
-    if not transactions: return None
+def generate_daily_trend(transactions):
+    """Acepta el frame de analytics o lista de dicts con 'Fecha' y 'Monto USD'"""
+    df = analytics.frame_from_records(transactions)
+    if df.empty: return None
     
-    df = pd.DataFrame(transactions)
-    df['Fecha'] = pd.to_datetime(df['Fecha'])
-    daily = df.groupby('Fecha')['Monto USD'].sum().reset_index()
-    daily = daily.sort_values('Fecha')
+    daily = analytics.by_day(df)
     
     plt.figure(figsize=(10, 5))
-    plt.plot(daily['Fecha'], daily['Monto USD'], marker='o', linestyle='-', color='orange')
-    plt.fill_between(daily['Fecha'], daily['Monto USD'], color='orange', alpha=0.1)
+    plt.plot(daily.index, daily.values, marker='o', linestyle='-', color='orange')
+    plt.fill_between(daily.index, daily.values, color='orange', alpha=0.1)
     plt.title("Tendencia de Gastos Diarios")
     plt.xlabel("Día")
     plt.ylabel("USD")
@@ -59,27 +58,21 @@ def generate_daily_trend(transactions: list):
     plt.close()
     return buf
 
-def generate_top5_expenses(transactions: list):
-    """Top 5 gastos más altos del mes."""
-    if not transactions or len(transactions) < 1: return None
-    
-    df = pd.DataFrame(transactions)
-    # Asegurar que Monto USD sea numérico
-    df['Monto USD'] = pd.to_numeric(df['Monto USD'].astype(str).str.replace(',', '.'), errors='coerce')
-    df = df.dropna(subset=['Monto USD'])
-    
-    top5 = df.nlargest(5, 'Monto USD')
+def generate_top5_expenses(transactions):
+    """Top 5 gastos más altos del mes (frame de analytics o lista de dicts)."""
+    df = analytics.frame_from_records(transactions)
+    top5 = analytics.top_n(df, 5)
     
     if top5.empty: return None
     
     plt.figure(figsize=(10, 5))
     colors = ['#e74c3c', '#e67e22', '#f1c40f', '#3498db', '#9b59b6']
-    bars = plt.barh(top5['Concepto'].astype(str).str[:20], top5['Monto USD'], color=colors[:len(top5)])
+    bars = plt.barh(top5['concepto'].str[:20], top5['monto'], color=colors[:len(top5)])
     plt.xlabel('USD')
     plt.title('💸 Top 5 Gastos Más Altos')
     plt.gca().invert_yaxis()
     
-    for bar, val in zip(bars, top5['Monto USD']):
+    for bar, val in zip(bars, top5['monto']):
         plt.text(bar.get_width() + 0.5, bar.get_y() + bar.get_height()/2, f'${val:,.2f}', va='center')
     
     plt.tight_layout()
@@ -89,26 +82,16 @@ def generate_top5_expenses(transactions: list):
     plt.close()
     return buf
 
-def generate_weekday_distribution(transactions: list):
-    """Distribución de gastos por día de la semana."""
-    if not transactions: return None
-    
-    df = pd.DataFrame(transactions)
-    df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-    df['Monto USD'] = pd.to_numeric(df['Monto USD'].astype(str).str.replace(',', '.'), errors='coerce')
-    df = df.dropna(subset=['Fecha', 'Monto USD'])
-    
+def generate_weekday_distribution(transactions):
+    """Distribución de gastos por día de la semana (frame de analytics o lista de dicts)."""
+    df = analytics.frame_from_records(transactions)
     if df.empty: return None
     
-    df['DiaSemana'] = df['Fecha'].dt.day_name()
-    order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    spanish = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
-    
-    by_day = df.groupby('DiaSemana')['Monto USD'].sum().reindex(order).fillna(0)
+    by_day = analytics.by_weekday(df)
     
     plt.figure(figsize=(10, 5))
     colors = ['#3498db'] * 5 + ['#e74c3c', '#e74c3c']  # Fin de semana en rojo
-    plt.bar(spanish, by_day.values, color=colors)
+    plt.bar(analytics.WEEKDAYS_ES, by_day, color=colors)
     plt.title('📅 Gastos por Día de la Semana')
     plt.ylabel('USD')
     plt.xticks(rotation=45)
@@ -169,33 +152,17 @@ def generate_monthly_comparison(current_month: dict, previous_month: dict):
     plt.close()
     return buf
 
-def generate_heatmap_calendar(transactions: list):
+def generate_heatmap_calendar(transactions):
     """Heatmap estilo GitHub para visualizar actividad de gastos por día."""
-    if not transactions: return None
-    
     try:
         import numpy as np
         
-        df = pd.DataFrame(transactions)
-        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-        df['Monto USD'] = pd.to_numeric(df['Monto USD'].astype(str).str.replace(',', '.'), errors='coerce')
-        df = df.dropna(subset=['Fecha', 'Monto USD'])
-        
+        df = analytics.frame_from_records(transactions)
         if df.empty: return None
         
-        # Agrupar por día
-        daily = df.groupby(df['Fecha'].dt.date)['Monto USD'].sum()
-        
-        # Crear matriz para el mes actual
+        # Totales diarios del mes actual (vectorizado)
         now = datetime.now()
-        days_in_month = pd.date_range(start=f'{now.year}-{now.month:02d}-01', 
-                                       periods=31, freq='D')
-        days_in_month = days_in_month[days_in_month.month == now.month]
-        
-        # Crear datos para heatmap
-        data = []
-        for d in days_in_month:
-            data.append(daily.get(d.date(), 0))
+        data = list(analytics.month_heatmap(df, now.year, now.month))
         
         # Crear visualización
         fig, ax = plt.subplots(figsize=(12, 3))
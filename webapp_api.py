@@ -0,0 +1,252 @@
+"""
+API HTTP ligera para la Web App de Telegram (/api/*)
+Servidor asyncio en el mismo proceso del bot, detrás de nginx.
+/api/dashboard sirve un snapshot precalculado desde SQLite que se
+regenera en segundo plano tras las escrituras (una ráfaga, una regeneración). /api/directus/events recibe
+los eventos de Directus (ver directus_events).
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+import analytics
+import database  # SQLite local
+from config import DIRECTUS_EVENTS_SECRET, TELEGRAM_BOT_TOKEN, WEBAPP_API_HOST, WEBAPP_API_PORT
+
+logger = logging.getLogger(__name__)
+
+INIT_DATA_MAX_AGE = 24 * 3600   # Antigüedad máxima aceptada de initData (segundos)
+SAVINGS_TTL = 10 * 60           # Las metas de ahorro viven en Directus: se consultan con menos frecuencia
+MAX_REQUEST_BYTES = 16 * 1024
+MAX_BODY_BYTES = 256 * 1024     # Lotes de eventos de Directus
+DEBOUNCE_S = 1.0                # Escrituras seguidas (importación CSV) comparten una regeneración
+
+# Estado del proceso
+_snapshot = {"body": None, "etag": None, "built_at": None}
+_savings = {"pct": 0, "fetched_at": 0.0}
+_lock = threading.Lock()
+_rebuilding = False
+_dirty = False
+_stale = threading.Event()      # Hay escrituras sin reflejar en el snapshot
+_worker = None
+_server = None
+
+
+# ==================== AUTENTICACIÓN ====================
+
+def validate_init_data(init_data: str, bot_token: str = None) -> dict:
+    """
+    Valida Telegram.WebApp.initData (HMAC-SHA256 con clave derivada del token).
+    Retorna el usuario (dict) si es válido, None si no.
+    """
+    bot_token = bot_token or TELEGRAM_BOT_TOKEN
+    if not init_data or not bot_token:
+        return None
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        received_hash = fields.pop("hash", "")
+        data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+        secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        expected = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, received_hash):
+            return None
+        if time.time() - int(fields.get("auth_date", 0)) > INIT_DATA_MAX_AGE:
+            return None
+        return json.loads(fields.get("user", "{}"))
+    except Exception as e:
+        logger.warning(f"initData inválido: {e}")
+        return None
+
+
+# ==================== SNAPSHOT ====================
+
+def _savings_progress() -> int:
+    """Progreso global de metas de ahorro (cacheado SAVINGS_TTL)."""
+    if time.time() - _savings["fetched_at"] < SAVINGS_TTL:
+        return _savings["pct"]
+    try:
+        import directus_manager
+        metas = directus_manager.get_savings()
+        objetivo = sum(m["Objetivo USD"] for m in metas)
+        ahorrado = sum(m["Ahorrado Actual"] for m in metas)
+        _savings["pct"] = round(ahorrado / objetivo * 100) if objetivo > 0 else 0
+    except Exception as e:
+        logger.warning(f"No se pudo leer ahorros para el dashboard: {e}")
+    _savings["fetched_at"] = time.time()
+    return _savings["pct"]
+
+
+def build_snapshot() -> dict:
+    """Dashboard del mes actual a partir de la réplica/outbox local (sin llamadas a Directus por apertura)."""
+    now = datetime.now()
+    resumen = database.get_resumen_mes(now.year, now.month)
+
+    gastos = database.get_gastos_mes(now.year, now.month)
+    frame = analytics.build_frame([g["fecha"] for g in gastos], [g["monto_usd"] or 0 for g in gastos])
+    por_dia = analytics.month_heatmap(frame, now.year, now.month)[:now.day]
+
+    categories = sorted(resumen["by_category"].items(), key=lambda kv: kv[1], reverse=True)
+    return {
+        "month": now.strftime("%Y-%m"),
+        "totalExpenses": round(resumen["total_gastos"], 2),
+        "totalIncome": round(resumen["total_ingresos"], 2),
+        "balance": round(resumen["balance"], 2),
+        "savingsProgress": _savings_progress(),
+        "categories": {cat: round(total, 2) for cat, total in categories},
+        "dailyTrend": [round(v, 2) for v in por_dia],
+        "updatedAt": now.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def refresh_snapshot() -> dict:
+    """Recalcula el snapshot y su ETag. Seguro de llamar desde hilos."""
+    global _rebuilding, _dirty
+    with _lock:
+        if _rebuilding:
+            _dirty = True  # Otra regeneración en curso: repetir al terminar
+            return None
+        _rebuilding = True
+    try:
+        while True:
+            _dirty = False
+            data = build_snapshot()
+            body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            with _lock:
+                _snapshot.update(
+                    body=body,
+                    etag='"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+                    built_at=data["updatedAt"]
+                )
+                if not _dirty:
+                    _rebuilding = False
+                    return data
+    except Exception as e:
+        logger.error(f"Error generando snapshot del dashboard: {e}")
+        with _lock:
+            _rebuilding = False
+        return None
+
+
+def _snapshot_worker():
+    """Único hilo de regeneración: espera DEBOUNCE_S tras la primera escritura y regenera una vez."""
+    while True:
+        _stale.wait()
+        time.sleep(DEBOUNCE_S)
+        _stale.clear()  # Lo escrito durante la regeneración vuelve a marcarlo
+        refresh_snapshot()
+
+
+def invalidate(savings: bool = False):
+    """Llamar tras cada escritura: marca el snapshot para regenerarlo en segundo plano (savings=True relee las metas)."""
+    global _worker
+    if savings:
+        _savings["fetched_at"] = 0.0
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_snapshot_worker, name="dashboard-snapshot", daemon=True)
+            _worker.start()
+    _stale.set()
+
+
+# ==================== SERVIDOR HTTP ====================
+
+def _response(status: str, body: bytes = b"", headers: dict = None) -> bytes:
+    head = [f"HTTP/1.1 {status}", f"Content-Length: {len(body)}", "Connection: close"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _json_error(status: str, message: str) -> bytes:
+    body = json.dumps({"error": message}).encode("utf-8")
+    return _response(status, body, {"Content-Type": "application/json"})
+
+
+async def _dashboard(headers: dict, body: bytes = b"") -> bytes:
+    user = validate_init_data(headers.get("x-telegram-init-data", ""))
+    if not user:
+        return _json_error("401 Unauthorized", "initData inválido")
+
+    if _snapshot["body"] is None:
+        await asyncio.to_thread(refresh_snapshot)
+    body, etag = _snapshot["body"], _snapshot["etag"]
+    if body is None:
+        return _json_error("503 Service Unavailable", "Snapshot no disponible")
+
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if headers.get("if-none-match") == etag:
+        return _response("304 Not Modified", b"", cache_headers)
+    return _response("200 OK", body, {**cache_headers, "Content-Type": "application/json; charset=utf-8"})
+
+
+async def _directus_events(headers: dict, body: bytes = b"") -> bytes:
+    """Eventos de Directus autenticados con secreto compartido; 5xx hace que el emisor reintente."""
+    secret = headers.get("x-directus-events-secret", "")
+    if not DIRECTUS_EVENTS_SECRET or not hmac.compare_digest(secret.encode(), DIRECTUS_EVENTS_SECRET.encode()):
+        return _json_error("401 Unauthorized", "Secreto inválido")
+    try:
+        events = json.loads(body or b"null")
+    except ValueError:
+        return _json_error("400 Bad Request", "JSON inválido")
+    if not isinstance(events, (dict, list)):
+        return _json_error("400 Bad Request", "Se esperaba un evento o una lista")
+
+    import directus_events
+    result = await asyncio.to_thread(directus_events.handle, events)
+    status = "500 Internal Server Error" if result["errors"] else "200 OK"
+    return _response(status, json.dumps(result).encode("utf-8"), {"Content-Type": "application/json"})
+
+
+ROUTES = {
+    ("GET", "/api/dashboard"): _dashboard,
+    ("POST", "/api/directus/events"): _directus_events,
+}
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        if len(raw) > MAX_REQUEST_BYTES:
+            raise ValueError("Cabeceras demasiado grandes")
+        lines = raw.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+
+        length = int(headers.get("content-length") or 0)
+        handler = ROUTES.get((method.upper(), urlsplit(target).path.rstrip("/")))
+        if length > MAX_BODY_BYTES:
+            response = _json_error("413 Payload Too Large", "Cuerpo demasiado grande")
+        elif handler:
+            body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b""
+            response = await handler(headers, body)
+        else:
+            response = _json_error("404 Not Found", "Ruta no encontrada")
+    except Exception as e:
+        logger.warning(f"Petición inválida a webapp_api: {e}")
+        response = _json_error("400 Bad Request", "Petición inválida")
+
+    try:
+        writer.write(response)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start(host: str = None, port: int = None):
+    """Arranca el servidor en el event loop actual (llamar desde post_init)."""
+    global _server
+    if _server is not None:
+        return _server
+    _server = await asyncio.start_server(_handle, host or WEBAPP_API_HOST, port or WEBAPP_API_PORT)
+    logger.info(f"webapp_api escuchando en {host or WEBAPP_API_HOST}:{port or WEBAPP_API_PORT}")
+    await asyncio.to_thread(refresh_snapshot)
+    return _server
@@ -0,0 +1,168 @@
+"""
+Cola de trabajo para handlers pesados (foto, voz, CSV, análisis, consejo)
+Orden FIFO dentro de cada chat, chats distintos repartidos en un pool
+acotado de workers y contrapresión: si la cola está llena se rechaza al
+instante en lugar de acumular llamadas concurrentes a Gemini.
+"""
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 4            # Tareas pesadas simultáneas (≈ llamadas concurrentes a Gemini)
+MAX_PER_CHAT = 5       # Pendientes por chat
+MAX_TOTAL = 50         # Pendientes en total
+METRICS_WINDOW = 200   # Últimas N tareas para estadísticas de espera/ejecución
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    Cada chat tiene su deque de tareas; `_ready` contiene los chats con trabajo
+    y sin worker asignado, así un chat nunca corre dos tareas a la vez.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_per_chat: int = MAX_PER_CHAT, max_total: int = MAX_TOTAL):
+        self.workers = workers
+        self.max_per_chat = max_per_chat
+        self.max_total = max_total
+        self._pending = {}        # chat_id -> deque[(nombre, coro_factory, enqueued_at)]
+        self._ready = None        # asyncio.Queue de chat_ids
+        self._active = set()      # chats con una tarea en ejecución
+        self._tasks = []
+        self._total = 0
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._waits = deque(maxlen=METRICS_WINDOW)
+        self._runs = deque(maxlen=METRICS_WINDOW)
+
+    # ---------- ciclo de vida ----------
+
+    def start(self):
+        """Arranca los workers en el event loop actual (llamar desde post_init)."""
+        if self._tasks: return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"work-queue-{i}") for i in range(self.workers)]
+        logger.info(f"Cola de trabajo iniciada con {self.workers} workers")
+
+    async def stop(self, timeout: float = 30):
+        """Espera (con límite) a que se vacíe la cola y detiene los workers."""
+        deadline = time.monotonic() + timeout
+        while (self._total or self._active) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- encolado ----------
+
+    def submit(self, chat_id, name: str, coro_factory) -> int:
+        """
+        Encola una tarea. Retorna cuántas tareas tiene por delante (0 = empieza ya).
+        Lanza QueueFull si se supera el límite del chat o el global.
+        """
+        if self._ready is None: self.start()
+        chat_queue = self._pending.setdefault(chat_id, deque())
+        if len(chat_queue) >= self.max_per_chat or self._total >= self.max_total:
+            self.stats["rejected"] += 1
+            if not chat_queue: self._pending.pop(chat_id, None)
+            raise QueueFull()
+
+        # Por delante: las pendientes de este chat (+1 si ya corre una) o, si el chat
+        # está libre, las de otros chats esperando worker cuando no hay workers libres
+        busy = len(self._active) >= self.workers
+        ahead = len(chat_queue) + (1 if chat_id in self._active else 0)
+        if not ahead and busy:
+            ahead = self._ready.qsize() + 1
+
+        chat_queue.append((name, coro_factory, time.monotonic()))
+        self._total += 1
+        self.stats["accepted"] += 1
+        if len(chat_queue) == 1 and chat_id not in self._active:
+            self._ready.put_nowait(chat_id)
+        return ahead
+
+    # ---------- workers ----------
+
+    async def _worker(self, idx: int):
+        while True:
+            chat_id = await self._ready.get()
+            chat_queue = self._pending.get(chat_id)
+            if not chat_queue:
+                continue
+            name, coro_factory, enqueued_at = chat_queue.popleft()
+            self._total -= 1
+            self._active.add(chat_id)
+            started = time.monotonic()
+            self._waits.append(started - enqueued_at)
+            try:
+                await coro_factory()
+                self.stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Tarea '{name}' del chat {chat_id} falló: {e}")
+            finally:
+                self._runs.append(time.monotonic() - started)
+                self._active.discard(chat_id)
+                if chat_queue:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    self._pending.pop(chat_id, None)
+
+    # ---------- métricas ----------
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values: return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def get_metrics(self) -> dict:
+        return {
+            "queued": self._total,
+            "running": len(self._active),
+            "workers": self.workers,
+            "chats_waiting": len(self._pending),
+            **self.stats,
+            "wait_avg_s": round(sum(self._waits) / len(self._waits), 2) if self._waits else 0.0,
+            "wait_p95_s": round(self._percentile(self._waits, 0.95), 2),
+            "run_avg_s": round(sum(self._runs) / len(self._runs), 2) if self._runs else 0.0,
+        }
+
+
+_instance = WorkQueue()
+
+
+def queued(handler, name: str = None):
+    """
+    Envuelve un handler de PTB para que se ejecute en la cola de trabajo.
+    El dispatcher queda libre de inmediato; el usuario ve su posición si debe esperar.
+    """
+    name = name or handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        try:
+            ahead = _instance.submit(chat_id, name, lambda: handler(update, context))
+        except QueueFull:
+            if update.effective_message:
+                await update.effective_message.reply_text("🚦 Hay demasiadas tareas en cola. Intenta de nuevo en un momento.")
+            return
+        if ahead and update.effective_message:
+            await update.effective_message.reply_text(f"⏳ En cola (posición {ahead})")
+
+    return wrapper
+
+
+def start(): _instance.start()
+async def stop(timeout=30): await _instance.stop(timeout)
+def get_metrics(): return _instance.get_metrics()